@@ -13,4 +13,16 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ongoshop_project.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from shop.live import LiveFeedApp  # noqa: E402
+
+# the admin live feed (/admin/live/) is streamed here, everything else goes to Django
+application = LiveFeedApp(django_application)
+
+from django.conf import settings  # noqa: E402
+
+if getattr(settings, 'WARM_UP_ON_START', False):
+    from shop.startup import warm_up
+
+    warm_up()
@@ -42,18 +42,24 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'shop.middleware.StaticAssetMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'shop.profiling.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # only active with DEBUG = True; set NPLUSONE_STRICT = True to raise instead of log
+    'shop.nplusone.NPlusOneMiddleware',
 ]
 
 ROOT_URLCONF = 'ongoshop_project.urls'
 
 AUTH_USER_MODEL = 'shop.User'
 
+AUTHENTICATION_BACKENDS = ['shop.auth_backends.CachedModelBackend']
+
 
 
 TEMPLATES = [
@@ -73,6 +79,36 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'ongoshop_project.wsgi.application'
+ASGI_APPLICATION = 'ongoshop_project.asgi.application'
+
+# Two-tier cache (shop.tiered_cache): a small per-process LRU in front of a file cache that
+# every worker on the host shares (a DatabaseCache after `manage.py createcachetable` shares
+# it across hosts). Local copies may lag writes from other workers by LOCAL_TIMEOUT seconds,
+# so keys that must never be stale bypass them. get_or_set() recomputes an expired key in
+# one worker only and refreshes hot keys early; the dashboard shows this worker's counters
+CACHES = {
+    'default': {
+        'BACKEND': 'shop.tiered_cache.TieredCache',
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'SHARED': 'shared',
+            'LOCAL_MAX_ENTRIES': 1000,
+            'LOCAL_TIMEOUT': 5,
+            'LOCAL_EXCLUDE': ('django.contrib.sessions', 'shop:throttle', 'shop:user:'),
+            'STALE_TIMEOUT': 30,
+            'LOCK_TIMEOUT': 10,
+        },
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+}
+
+# Cache-first sessions with DB fallback; unchanged sessions are never re-saved.
+# Expired rows are removed by `python manage.py sweep_sessions --loop`.
+SESSION_ENGINE = 'shop.session_store'
 
 
 # Database
@@ -89,6 +125,23 @@ DATABASES = {
     }
 }
 
+# Orders, their items and payments are sharded by user (shop.sharding): a user's orders live
+# on the database their bucket (user id % ORDER_SHARD_BUCKETS) is placed on, buckets without
+# a ShardBucket row on the first alias. Every alias carries the full schema (`manage.py migrate
+# --database <alias>` each one); only default holds everything else. ORDER_SHARDS may only be
+# appended to: a shard's position is its number, and shard k hands out order ids with
+# id % ORDER_ID_STRIDE == k so ids stay unique everywhere. Add an alias, migrate it, then
+# `manage.py rebalance_shards` moves buckets onto it. Processes re-read the bucket map every
+# ORDER_SHARD_MAP_TTL seconds.
+# Checkout commits stock and the cart on default first, then writes the order on its shard;
+# `manage.py place_checkouts --loop` places orders whose request failed in between.
+# ongoshop_project.settings_shards runs three SQLite shards locally
+ORDER_SHARDS = ['default']
+ORDER_SHARD_BUCKETS = 1024
+ORDER_ID_STRIDE = 16
+ORDER_SHARD_MAP_TTL = 5.0
+DATABASE_ROUTERS = ['shop.sharding.ShardRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -126,10 +179,90 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 STATICFILES_DIRS = [BASE_DIR / 'shop' / 'static']
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+
+# collectstatic writes content-hashed names plus .gz/.br siblings,
+# which shop.middleware.StaticAssetMiddleware serves with immutable caching
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'shop.storage.CompressedManifestStaticFilesStorage',
+    },
+}
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Payments: callbacks are queued and applied by `manage.py process_payment_events`,
+# `manage.py reconcile_payments` fixes payments whose callback never arrived
+PAYMENT_PROVIDER = 'shop.payments.StubPaymentProvider'
+PAYMENT_WEBHOOK_SECRET = 'django-insecure-payment-webhook-secret'
+PAYMENT_STUB_STATE_FILE = BASE_DIR / 'payment_stub.json'
+PAYMENT_STUB_DROP_RATE = 0.0
+
+# Order side effects (receipts, stock alerts, activity log) run in `manage.py run_tasks`
+LOW_STOCK_THRESHOLD = 5
+
+# Activity logs older than this many days are removed by `manage.py purge_activity_logs`;
+# other keys override the default for one log category
+ACTIVITY_LOG_RETENTION_DAYS = {
+    'default': 365,
+    'แจ้งเตือนสต็อก': 30,
+}
+
+# Carts without activity for this many days are removed by `manage.py purge_carts`;
+# carts that hold nothing go sooner
+CART_IDLE_DAYS = 60
+EMPTY_CART_IDLE_DAYS = 7
+
+# Request profiling: a sampled fraction of requests (plus admin requests sent with an
+# `X-Profile: 1` header or `profile=1` cookie) is profiled into PROFILE_DIR
+PROFILE_SAMPLE_RATE = 0.0
+PROFILE_INTERVAL = 0.005
+PROFILE_DIR = BASE_DIR / 'profiles'
+PROFILE_KEEP = 200
+
+# Anonymous product pages are served from pre-rendered files (`manage.py build_snapshots`);
+# product and category changes regenerate them through the task worker
+SNAPSHOT_DIR = BASE_DIR / 'snapshots'
+SNAPSHOT_MAX_AGE = 24 * 60 * 60
+
+# Change feed (shop.changes): product, category, order and payment writes append events in
+# the same transaction; `manage.py tail_changes` reads them and `manage.py compact_changes`
+# drops superseded events older than this many days
+CHANGE_FEED_COMPACT_AFTER_DAYS = 7
+
+# Login/registration throttling (shop.throttle), checked before any password hash or query:
+# token buckets of `burst` attempts refilled at `per_minute`, per client IP and per username.
+# Emptying a bucket with a `lockout` locks it for that many seconds; a successful login
+# refills the username's. Counters are shown on the admin dashboard. Set a rule to None to
+# disable it. The buckets are kept in the shared tier of the default cache, whose add() and
+# incr() are atomic across processes
+THROTTLE_RULES = {
+    'login_ip': {'burst': 5, 'per_minute': 5},
+    'register_ip': {'burst': 3, 'per_minute': 1},
+    'login_user': {'burst': 5, 'per_minute': 1, 'lockout': 900},
+}
+# reverse proxies in front of the app that append to X-Forwarded-For
+THROTTLE_TRUSTED_PROXIES = 0
+
+# Import every view and compile every template when the WSGI or ASGI app is loaded, before the
+# worker takes traffic (`manage.py profile_startup` shows what the first request costs)
+WARM_UP_ON_START = False
+
+# Live admin pages (dashboard, order list) stream order changes and activity logs over
+# Server-Sent Events from /admin/live/. Needs the ASGI app (ongoshop_project.asgi); each
+# worker polls the change feed once per interval however many tabs are open
+LIVE_FEED_INTERVAL = 1.0
+LIVE_FEED_HEARTBEAT = 15
+
+# Thai postal dataset behind the checkout address autocomplete (shop.postal), one
+# (postal code, subdistrict, district, province) row per line; rebuild it from a full
+# public dataset with `manage.py import_postal_data`
+POSTAL_DATA = BASE_DIR / 'shop' / 'data' / 'thai_postal.tsv'
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
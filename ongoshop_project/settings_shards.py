@@ -0,0 +1,10 @@
+# Local sharding setup: orders spread over three SQLite files next to the default one.
+#   DJANGO_SETTINGS_MODULE=ongoshop_project.settings_shards python manage.py migrate
+#   (then again with --database orders_1 and --database orders_2)
+from ongoshop_project.settings import *  # noqa: F401,F403
+
+DATABASES = {
+    alias: {"ENGINE": "django.db.backends.sqlite3", "NAME": BASE_DIR / f"{alias}.sqlite3"}
+    for alias in ("default", "orders_1", "orders_2")
+}
+ORDER_SHARDS = ['default', 'orders_1', 'orders_2']
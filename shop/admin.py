@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import User, Category, Product, Cart, CartItem, Order, OrderItem, Payment, Address
+from .models import User, Category, Product, Cart, CartItem, Order, OrderItem, Payment, PaymentEvent, Address, Task
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 
 @admin.register(User)
@@ -15,4 +15,6 @@ admin.site.register(CartItem)
 admin.site.register(Order)
 admin.site.register(OrderItem)
 admin.site.register(Payment)
+admin.site.register(PaymentEvent)
 admin.site.register(Address)
+admin.site.register(Task)
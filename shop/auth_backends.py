@@ -0,0 +1,49 @@
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+
+from shop.models import User, Address
+
+USER_CACHE_TIMEOUT = 60 * 15
+
+
+def _user_cache_key(user_id):
+    return f'shop:user:{user_id}'
+
+
+def get_cached_user(user_id):
+    """Return the user with their address attached as ``cached_address``."""
+    key = _user_cache_key(user_id)
+    user = cache.get(key)
+    if user is None:
+        try:
+            user = User._default_manager.get(pk=user_id)
+        except User.DoesNotExist:
+            return None
+        user.cached_address = Address.objects.filter(user_id=user.pk).first()
+        cache.set(key, user, USER_CACHE_TIMEOUT)
+    return user
+
+
+def get_cached_address(user):
+    if not hasattr(user, 'cached_address'):
+        user.cached_address = Address.objects.filter(user_id=user.pk).first()
+    return user.cached_address
+
+
+def invalidate_user(user_id):
+    cache.delete(_user_cache_key(user_id))
+
+
+class CachedModelBackend(ModelBackend):
+    """
+    ModelBackend whose per-request ``get_user`` is served from the cache, so
+    authenticated page views skip the ``shop_user`` lookup. Entries are
+    dropped by the ``post_save`` handlers in ``shop.signals`` whenever the
+    user or their address changes. ``shop:user:`` keys skip the per-process
+    tier of ``CACHES['default']``, so the delete reaches every worker and
+    role and password changes apply on the very next request.
+    """
+
+    def get_user(self, user_id):
+        user = get_cached_user(user_id)
+        return user if user is not None and self.user_can_authenticate(user) else None
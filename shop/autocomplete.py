@@ -0,0 +1,337 @@
+import heapq
+import os
+import re
+import threading
+import time
+import unicodedata
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+
+from django.db import connection
+from django.db.models import Sum
+from django.utils import timezone
+
+from shop.models import Product, Category, ProductSalesDaily, CategorySalesDaily
+
+KIND_PRODUCT = 0
+KIND_CATEGORY = 1
+KIND_NAMES = {KIND_PRODUCT: 'product', KIND_CATEGORY: 'category'}
+
+SEPARATOR = '\x00'
+SCAN_LIMIT = 2000
+MAX_RESULTS = 10
+TOP_DEPTH = 30
+MEMO_SIZE = 2048
+REFRESH_SECONDS = 5
+REBUILD_SECONDS = 60 * 60
+
+# Where a search prefix may match: after whitespace, or inside a run of Thai
+# (written without spaces between words) on any character that can begin a
+# syllable. That leaves out vowel signs, tone marks, the vowels that only
+# follow a consonant (ะ า ำ ๅ) and ๆ, and the consonant right after a leading
+# vowel (เ แ โ ใ ไ), which belongs to that vowel's syllable.
+WORD_START = re.compile(
+    r'(?<!\S)\S'
+    r'|(?<=[\u0e01-\u0e3f\u0e45-\u0e5b])[\u0e01-\u0e2f\u0e3f-\u0e44\u0e4f-\u0e5b]'
+)
+
+
+def normalize(text):
+    return unicodedata.normalize('NFC', text).casefold()
+
+
+def word_starts(key):
+    """Offsets in normalized ``key`` a search prefix may match at (WORD_START)."""
+    return [match.start() for match in WORD_START.finditer(key)]
+
+
+class _Keys:
+    """Sequence view of the sorted positions, compared by the text they point at."""
+
+    def __init__(self, index, length):
+        self.index = index
+        self.length = length
+
+    def __len__(self):
+        return len(self.index.positions)
+
+    def __getitem__(self, i):
+        start = self.index.positions[i]
+        return self.index.blob[start:start + self.length]
+
+
+class PrefixIndex:
+    """
+    Immutable prefix index over product and category names.
+
+    All normalized names are concatenated into one string and the index is a
+    sorted ``array`` of offsets at every ``word_starts()``, so a name costs its
+    characters plus a few bytes of arrays rather than a Python object per
+    entry. A prefix is a contiguous range of offsets found with two binary
+    searches; results inside the range are ranked by popularity, with the
+    top entries of every prefix wider than ``SCAN_LIMIT`` computed at build
+    time.
+    """
+
+    def __init__(self, entries):
+        # entries: iterable of (kind, id, name, score), by kind then id
+        self.kinds = array('b')
+        self.ids = array('q')
+        self.scores = array('d')
+        starts = array('L')
+        names = []
+        keys = []
+        offset = 0
+        for kind, pk, name, score in entries:
+            key = normalize(name)
+            self.kinds.append(kind)
+            self.ids.append(pk)
+            self.scores.append(score)
+            starts.append(offset)
+            names.append(name)
+            keys.append(key)
+            offset += len(key) + 1
+        self.blob = SEPARATOR.join(keys) + SEPARATOR
+        self.names = names
+
+        positions = []
+        for item, key in enumerate(keys):
+            base = starts[item]
+            positions.extend((base + i, item) for i in word_starts(key))
+        del keys
+        blob = self.blob
+        positions.sort(key=lambda entry: blob[entry[0]:blob.index(SEPARATOR, entry[0])])
+        self.positions = array('L', (position for position, _ in positions))
+        self.items = array('L', (item for _, item in positions))
+        del positions
+
+        self.top = {}
+        self._memo = OrderedDict()
+        self._lock = threading.Lock()
+        self._precompute()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def name_of(self, kind, pk):
+        """The indexed name of ``(kind, pk)``, or None; entries are sorted by kind then id."""
+        lo = bisect_left(self.kinds, kind)
+        hi = bisect_right(self.kinds, kind, lo)
+        i = bisect_left(self.ids, pk, lo, hi)
+        return self.names[i] if i < hi and self.ids[i] == pk else None
+
+    def _range(self, prefix):
+        keys = _Keys(self, len(prefix))
+        lo = bisect_left(keys, prefix)
+        hi = bisect_right(keys, prefix, lo)
+        return lo, hi
+
+    def _rank(self, lo, hi, limit):
+        return heapq.nlargest(limit, set(self.items[lo:hi]), key=self.scores.__getitem__)
+
+    def _precompute(self):
+        # Any prefix matching more than SCAN_LIMIT word starts gets its top
+        # results stored, so a query never ranks more than SCAN_LIMIT rows.
+        # Groups sharing a prefix are contiguous, so each level is one walk
+        # over the ranges of the level above that were still too wide.
+        wide = [(0, len(self.positions))]
+        length = 1
+        while wide:
+            keys = _Keys(self, length)
+            next_wide = []
+            for lo, hi in wide:
+                i = lo
+                while i < hi:
+                    prefix = keys[i]
+                    end = bisect_right(keys, prefix, i, hi)
+                    if end - i > SCAN_LIMIT and SEPARATOR not in prefix:
+                        self.top[prefix] = self._rank(i, end, TOP_DEPTH)
+                        next_wide.append((i, end))
+                    i = end
+            wide = next_wide
+            length += 1
+
+    def search(self, prefix, limit=MAX_RESULTS):
+        prefix = normalize(prefix).strip()
+        if not prefix:
+            return []
+        if prefix in self.top and limit <= TOP_DEPTH:
+            return self.top[prefix][:limit]
+        with self._lock:
+            memo = self._memo.get((prefix, limit))
+            if memo is not None:
+                self._memo.move_to_end((prefix, limit))
+                return memo
+        lo, hi = self._range(prefix)
+        result = self._rank(lo, hi, limit)
+        with self._lock:
+            self._memo[(prefix, limit)] = result
+            if len(self._memo) > MEMO_SIZE:
+                self._memo.popitem(last=False)
+        return result
+
+
+def _popularity(model, key):
+    return dict(model.objects.values_list(key).annotate(total=Sum('units')).values_list(key, 'total'))
+
+
+def load_entries():
+    """Read names and popularity (units sold, from the sales rollups)."""
+    product_scores = _popularity(ProductSalesDaily, 'product_id')
+    category_scores = _popularity(CategorySalesDaily, 'category_id')
+    for pk, name in Product.objects.order_by('id').values_list('id', 'name').iterator(chunk_size=10000):
+        yield KIND_PRODUCT, pk, name, float(product_scores.get(pk, 0))
+    for pk, name in Category.objects.order_by('id').values_list('id', 'name').iterator(chunk_size=10000):
+        yield KIND_CATEGORY, pk, name, float(category_scores.get(pk, 0))
+
+
+class Autocomplete:
+    """
+    Per-worker autocomplete: a large immutable ``PrefixIndex`` plus a small
+    overlay of products renamed or added since it was built. Every few
+    seconds one indexed query on ``Product.updated_at`` pulls new changes
+    in, keeping only those whose name differs from the one shown (checkout
+    stock updates touch ``updated_at`` too); deletions seen in this process
+    are tombstoned. ``serve`` builds the index in the master, and every
+    worker it forks starts from that copy and its own clock, catching up
+    through the overlay; hourly, a worker still alive rebuilds it in a
+    background thread, answering from the old one meanwhile. A process
+    without an index builds it on its first search, which waits for it.
+
+    The overlay, its normalized names and the set of hidden index entries
+    are replaced rather than changed, so ``search()`` reads them without
+    locking.
+    """
+
+    def __init__(self):
+        self.index = None
+        self.built_at = 0
+        self.checked_at = 0
+        self.changed_since = None
+        self.overlay = {}
+        self.tombstones = frozenset()
+        self.hidden = frozenset()
+        self.rebuilding = False
+        self.lock = threading.Lock()
+        self.build_lock = threading.Lock()
+
+    def after_fork(self):
+        # a forked worker's hour starts now, and it catches up on the first search;
+        # the master's locks may have been held mid-fork
+        self.built_at = time.monotonic()
+        self.checked_at = 0
+        self.rebuilding = False
+        self.lock = threading.Lock()
+        self.build_lock = threading.Lock()
+
+    def rebuild(self):
+        started = timezone.now()
+        index = PrefixIndex(load_entries())
+        with self.lock:
+            self.index = index
+            self.overlay = {}
+            self.tombstones = self.hidden = frozenset()
+            self.changed_since = started
+            self.built_at = self.checked_at = time.monotonic()
+
+    def _rebuild_in_background(self):
+        with self.lock:
+            if self.rebuilding:
+                return
+            self.rebuilding = True
+
+        def run():
+            try:
+                self.rebuild()
+            finally:
+                self.rebuilding = False
+                connection.close()
+
+        threading.Thread(target=run, name='autocomplete-rebuild', daemon=True).start()
+
+    def _shown_name(self, key):
+        if key in self.overlay:
+            return self.overlay[key][0]
+        if key in self.tombstones:
+            return None
+        return self.index.name_of(*key)
+
+    def _update(self, changes=None, deleted=()):
+        """Apply ``{key: name}`` and deleted keys under the lock, swapping in new collections if anything changed."""
+        with self.lock:
+            changes = {key: name for key, name in (changes or {}).items() if name != self._shown_name(key)}
+            deleted = [key for key in deleted if key in self.overlay or key not in self.tombstones]
+            if not changes and not deleted:
+                return
+            overlay = dict(self.overlay)
+            tombstones = set(self.tombstones)
+            for key, name in changes.items():
+                overlay[key] = (name, normalize(name))
+                tombstones.discard(key)
+            for key in deleted:
+                overlay.pop(key, None)
+                tombstones.add(key)
+            self.overlay = overlay
+            self.tombstones = frozenset(tombstones)
+            self.hidden = self.tombstones | overlay.keys()
+
+    def _refresh(self):
+        if self.index is None:
+            with self.build_lock:
+                if self.index is None:
+                    self.rebuild()
+            return
+        now = time.monotonic()
+        if now - self.built_at > REBUILD_SECONDS:
+            # keep answering from the current index while the new one builds
+            self._rebuild_in_background()
+        if now - self.checked_at < REFRESH_SECONDS:
+            return
+        self.checked_at = now
+        since = self.changed_since
+        changed = list(Product.objects.filter(updated_at__gte=since).values_list('id', 'name', 'updated_at'))
+        if changed:
+            self._update({(KIND_PRODUCT, pk): name for pk, name, _ in changed})
+            self.changed_since = max(since, max(updated_at for _, _, updated_at in changed))
+
+    def product_changed(self, product):
+        if self.index is not None:
+            self._update({(KIND_PRODUCT, product.pk): product.name})
+
+    def product_deleted(self, pk):
+        if self.index is not None:
+            self._update(deleted=[(KIND_PRODUCT, pk)])
+
+    def search(self, prefix, limit=MAX_RESULTS):
+        self._refresh()
+        index = self.index
+        if index is None:
+            return []
+        overlay = self.overlay
+        hidden = self.hidden
+
+        results = []
+        scores = {}
+        # ask for extra rows so hidden entries do not shorten the list
+        for item in index.search(prefix, min(limit + len(hidden), TOP_DEPTH)):
+            key = (index.kinds[item], index.ids[item])
+            if key in hidden:
+                scores[key] = index.scores[item]
+                continue
+            results.append((index.scores[item], key, index.names[item]))
+
+        needle = normalize(prefix).strip()
+        for key, (name, normalized) in overlay.items():
+            if any(normalized.startswith(needle, i) for i in word_starts(normalized)):
+                results.append((scores.get(key, 0.0), key, name))
+
+        results.sort(key=lambda row: -row[0])
+        return [
+            {'type': KIND_NAMES[kind], 'id': pk, 'name': name}
+            for _, (kind, pk), name in results[:limit]
+        ]
+
+
+autocomplete = Autocomplete()
+os.register_at_fork(after_in_child=autocomplete.after_fork)
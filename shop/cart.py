@@ -0,0 +1,124 @@
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import Case, F, Q, Value, When
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from shop.models import Cart, CartItem, Product
+
+MAX_QUANTITY = 999
+# purging works in days, so a cart only needs its activity written this often
+TOUCH_INTERVAL = timedelta(minutes=10)
+
+
+class CartError(ValueError):
+    pass
+
+
+def parse_changes(changes):
+    """
+    Validate ``[{"product_id": 1, "delta": 2}, {"product_id": 3, "quantity": 0}, ...]``
+    into ``({product_id: delta}, {product_id: quantity})``. ``delta`` adds to
+    the current quantity, ``quantity`` replaces it and 0 removes the line.
+    """
+    if not isinstance(changes, list) or not changes:
+        raise CartError("ไม่มีรายการที่ต้องการเปลี่ยนแปลง")
+    deltas, quantities = {}, {}
+    for change in changes:
+        try:
+            product_id = int(change['product_id'])
+            if 'quantity' in change:
+                quantity = int(change['quantity'])
+                if not 0 <= quantity <= MAX_QUANTITY:
+                    raise ValueError
+                quantities[product_id] = quantity
+                deltas.pop(product_id, None)
+            else:
+                delta = int(change.get('delta', 1))
+                if not -MAX_QUANTITY <= delta <= MAX_QUANTITY:
+                    raise ValueError
+                if product_id in quantities:
+                    quantities[product_id] = max(0, quantities[product_id] + delta)
+                else:
+                    deltas[product_id] = deltas.get(product_id, 0) + delta
+        except (KeyError, TypeError, ValueError, AttributeError):
+            raise CartError("ข้อมูลรายการในตะกร้าไม่ถูกต้อง")
+    return deltas, quantities
+
+
+def _increment(cart_id, deltas):
+    """Add positive deltas, inserting lines that do not exist yet, in one statement, capped at MAX_QUANTITY."""
+    qn = connection.ops.quote_name
+    table = qn(CartItem._meta.db_table)
+    # SQLite's two-argument MIN() is LEAST() elsewhere
+    least = 'MIN' if connection.vendor == 'sqlite' else 'LEAST'
+    sql = (
+        f"INSERT INTO {table} (cart_id, product_id, quantity) VALUES (%s, %s, %s) "
+        f"ON CONFLICT (cart_id, product_id) DO UPDATE SET quantity = "
+        f"{least}({table}.quantity + excluded.quantity, {MAX_QUANTITY})"
+    )
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, [(cart_id, product_id, min(delta, MAX_QUANTITY)) for product_id, delta in deltas.items()])
+
+
+def touch(cart):
+    """Record activity on ``cart``; skipped if it was recorded within TOUCH_INTERVAL."""
+    now = timezone.now()
+    if cart.last_activity > now - TOUCH_INTERVAL:
+        return
+    Cart.objects.filter(id=cart.id).update(last_activity=now)
+    cart.last_activity = now
+
+
+def apply_changes(cart, changes):
+    """
+    Apply a batch of quantity changes to ``cart`` in one transaction. Every
+    change is computed by the database (upserts and ``F()`` increments), so
+    concurrent requests never overwrite each other's quantities.
+    """
+    deltas, quantities = parse_changes(changes)
+    wanted = deltas.keys() | quantities.keys()
+    with transaction.atomic():
+        known = set(Product.objects.filter(id__in=wanted).values_list('id', flat=True))
+        if wanted - known:
+            raise CartError("ไม่พบสินค้าที่เลือก")
+
+        additions = {pk: delta for pk, delta in deltas.items() if delta > 0}
+        removals = {pk: delta for pk, delta in deltas.items() if delta < 0}
+        if additions:
+            _increment(cart.id, additions)
+        if removals:
+            cart.items.filter(product_id__in=removals).update(quantity=Greatest(
+                Case(*[When(product_id=pk, then=F('quantity') + delta) for pk, delta in removals.items()]),
+                Value(0),
+            ))
+
+        replaced = {pk: quantity for pk, quantity in quantities.items() if quantity}
+        if replaced:
+            CartItem.objects.bulk_create(
+                [CartItem(cart=cart, product_id=pk, quantity=quantity) for pk, quantity in replaced.items()],
+                update_conflicts=True,
+                unique_fields=['cart', 'product'],
+                update_fields=['quantity'],
+            )
+        cleared = [pk for pk, quantity in quantities.items() if not quantity]
+        cart.items.filter(product_id__in=wanted).filter(Q(quantity=0) | Q(product_id__in=cleared)).delete()
+        touch(cart)
+
+
+def cart_state(cart):
+    """JSON-ready lines and totals for the cart page."""
+    lines = []
+    total = 0
+    for item in cart.items.select_related('product').order_by('id'):
+        subtotal = item.product.price * item.quantity
+        total += subtotal
+        lines.append({
+            'product_id': item.product_id,
+            'name': item.product.name,
+            'price': item.product.price,
+            'quantity': item.quantity,
+            'subtotal': subtotal,
+        })
+    return {'items': lines, 'total': total, 'count': len(lines)}
@@ -0,0 +1,204 @@
+import time
+from collections import namedtuple
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Exists, OuterRef, Q
+from django.db.models.expressions import RawSQL
+from django.utils import timezone
+
+from shop.models import ChangeConsumer, ChangeEvent, Category, Order, Payment, Product
+from shop.sharding import shards
+
+TOPICS = {
+    'product': Product,
+    'category': Category,
+    'order': Order,
+    'payment': Payment,
+}
+DEFAULT_COMPACT_AFTER_DAYS = 7
+
+Position = namedtuple('Position', 'txid id')
+START = Position(0, 0)
+
+# the writing transaction's id, and the oldest transaction still running:
+# every transaction below that horizon has finished, so its events are
+# either all visible or gone, and nothing can commit behind a reader
+_TXID = 'pg_current_xact_id()::text::bigint'
+_HORIZON = 'pg_snapshot_xmin(pg_current_snapshot())::text::bigint'
+
+
+def feeds():
+    """
+    Databases with a feed of their own: default, and every order shard,
+    whose order and payment events commit with the rows they describe.
+    """
+    return list(dict.fromkeys(['default', *shards()]))
+
+
+def offset_name(name, using='default'):
+    # consumer offsets all live on default, one per consumer and feed
+    return name if using == 'default' else f'{name}@{using}'
+
+
+def feed_of(offset):
+    name, _, using = offset.name.rpartition('@')
+    return using if name and using in feeds() else 'default'
+
+
+def txid_sql(connection):
+    return _TXID if connection.vendor == 'postgresql' else '0'
+
+
+def position_of(event):
+    return Position(event.txid, event.id)
+
+
+def record(topic, ids, operation='save', using='default'):
+    """
+    Append one event per id to the feed. Call it inside the transaction that
+    makes the change, so the events commit, or roll back, with it.
+    """
+    if not ids:
+        return
+    connection = connections[using]
+    table = connection.ops.quote_name(ChangeEvent._meta.db_table)
+    sql = (
+        f"INSERT INTO {table} (topic, object_id, operation, txid, created_at) "
+        f"VALUES (%s, %s, %s, {txid_sql(connection)}, %s)"
+    )
+    now = timezone.now()
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, [(topic, pk, operation, now) for pk in ids])
+
+
+def _after(position):
+    return Q(txid__gt=position.txid) | Q(txid=position.txid, id__gt=position.id)
+
+
+def _visible(queryset, using='default'):
+    if connections[using].vendor == 'postgresql':
+        return queryset.filter(txid__lt=RawSQL(_HORIZON, []))
+    # SQLite runs one write transaction at a time, so ids already follow commit order
+    return queryset
+
+
+def read(after=START, limit=500, topics=None, using='default'):
+    """
+    Up to ``limit`` events after ``after`` in feed order. Pass the position
+    of the last event back in to continue; a position is never skipped past
+    an event that has yet to commit.
+    """
+    events = _visible(ChangeEvent.objects.using(using).filter(_after(after)), using)
+    if topics:
+        events = events.filter(topic__in=topics)
+    return list(events.order_by('txid', 'id')[:limit])
+
+
+def latest(using='default'):
+    event = _visible(ChangeEvent.objects.using(using), using).order_by('-txid', '-id').first()
+    return position_of(event) if event else START
+
+
+def load(events, using='default'):
+    """Current rows for ``events`` read from feed ``using``, as ``{(topic, object_id): instance}``; deleted rows are missing."""
+    ids = {}
+    for event in events:
+        ids.setdefault(event.topic, set()).add(event.object_id)
+    rows = {}
+    for topic, pks in ids.items():
+        model = TOPICS[topic]
+        # products and categories are only ever on default
+        queryset = model.objects.using(using) if model in (Order, Payment) else model.objects
+        for pk, instance in queryset.in_bulk(pks).items():
+            rows[topic, pk] = instance
+    return rows
+
+
+class Consumer:
+    """
+    A named reader of feed ``using`` whose position is stored in
+    ChangeConsumer. ``poll()`` returns the next batch and ``commit()``
+    stores its position once the batch is handled, so a consumer that dies
+    in between gets the batch again (at-least-once delivery; handlers must
+    be idempotent).
+    """
+
+    def __init__(self, name, topics=None, batch_size=500, from_latest=False, using='default'):
+        self.topics = topics
+        self.batch_size = batch_size
+        self.using = using
+        start = latest(using) if from_latest else START
+        self.offset, _ = ChangeConsumer.objects.get_or_create(
+            name=offset_name(name, using), defaults={'txid': start.txid, 'event_id': start.id},
+        )
+
+    @property
+    def position(self):
+        return Position(self.offset.txid, self.offset.event_id)
+
+    def poll(self):
+        return read(self.position, self.batch_size, self.topics, self.using)
+
+    def commit(self, events):
+        if not events:
+            return
+        self.offset.txid, self.offset.event_id = position_of(events[-1])
+        self.offset.save(update_fields=['txid', 'event_id', 'updated_at'])
+
+    def consume(self, handler):
+        """Hand the next batch to ``handler(events)`` and commit it. Returns the batch size."""
+        events = self.poll()
+        if events:
+            handler(events)
+            self.commit(events)
+        return len(events)
+
+
+def lag(offset):
+    """Events the consumer with ``offset`` has yet to read."""
+    using = feed_of(offset)
+    return _visible(ChangeEvent.objects.using(using).filter(_after(Position(offset.txid, offset.event_id))), using).count()
+
+
+def compactable(now=None, using='default'):
+    """
+    ``(superseded, tombstones)`` querysets of events of feed ``using``
+    older than CHANGE_FEED_COMPACT_AFTER_DAYS that compaction may drop:
+    events with a newer event for the same row, and delete events every
+    consumer of the feed has read. The newest event per live row always stays, so a new consumer
+    can start from the beginning and still see every row.
+    """
+    now = now or timezone.now()
+    days = getattr(settings, 'CHANGE_FEED_COMPACT_AFTER_DAYS', DEFAULT_COMPACT_AFTER_DAYS)
+    old = ChangeEvent.objects.using(using).filter(created_at__lt=now - timedelta(days=days))
+    newer = ChangeEvent.objects.using(using).filter(topic=OuterRef('topic'), object_id=OuterRef('object_id')).filter(
+        Q(txid__gt=OuterRef('txid')) | Q(txid=OuterRef('txid'), id__gt=OuterRef('id'))
+    )
+    superseded = old.filter(Exists(newer))
+    tombstones = old.filter(operation='delete').exclude(Exists(newer))
+    offsets = [offset for offset in ChangeConsumer.objects.all() if feed_of(offset) == using]
+    slowest = min(offsets, key=lambda offset: (offset.txid, offset.event_id), default=None)
+    if slowest:
+        tombstones = tombstones.exclude(_after(Position(slowest.txid, slowest.event_id)))
+    return superseded, tombstones
+
+
+def compact(batch_size=5000, pause=0.0, now=None, using='default'):
+    """Delete compactable events of feed ``using`` ``batch_size`` rows at a time. Returns ``{kind: deleted}``."""
+    superseded, tombstones = compactable(now, using)
+    deleted = {}
+    for kind, events in (('superseded', superseded), ('tombstones', tombstones)):
+        total = 0
+        while True:
+            ids = list(events.order_by('txid', 'id').values_list('id', flat=True)[:batch_size])
+            if not ids:
+                break
+            ChangeEvent.objects.using(using).filter(id__in=ids).delete()
+            total += len(ids)
+            if len(ids) < batch_size:
+                break
+            time.sleep(pause)
+        deleted[kind] = total
+    return deleted
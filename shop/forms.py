@@ -3,9 +3,34 @@ from django.contrib.auth.forms import AuthenticationForm
 from django.contrib.auth import get_user_model
 from shop.models import Product, Order, User, Category
 from django.contrib.auth.password_validation import validate_password
+from django.core.validators import RegexValidator
+from shop.postal import postal
 
 User = get_user_model()
 
+postal_code_validator = RegexValidator(r'^\d{5}$', "รหัสไปรษณีย์ต้องเป็นตัวเลข 5 หลัก")
+
+
+def clean_postal_address(form):
+    """
+    Check the district and province against the postal code and store them
+    as the postal dataset spells them; blank ones are filled in when they
+    follow from the code. Postal codes missing from the dataset are taken as
+    typed.
+    """
+    data = form.cleaned_data
+    code = data.get('postal_code')
+    places = postal.places(code) if code else []
+    if not places:
+        return
+    place = postal.match(code, data.get('city', ''), data.get('province', ''))
+    if place is None:
+        form.add_error('postal_code', "รหัสไปรษณีย์ไม่ตรงกับอำเภอ/เขตและจังหวัดที่กรอก")
+    elif data.get('city') or len(places) == 1:
+        data['city'], data['province'] = place
+    elif data.get('province') or len({province for _, province in places}) == 1:
+        data['province'] = place[1]
+
 class RegisterForm(forms.ModelForm):
     password = forms.CharField(
         widget=forms.PasswordInput(attrs={'placeholder': 'Enter password'}),
@@ -76,6 +101,10 @@ class GuestCheckoutForm(forms.Form):
     receiver_name = forms.CharField(max_length=150, label="ชื่อผู้รับ")
     phone = forms.CharField(max_length=20, label="เบอร์โทรศัพท์")
     address_line = forms.CharField(widget=forms.Textarea(attrs={'rows': 3}), label="ที่อยู่จัดส่ง")
+    # may be left blank when the postal code says which they are
+    city = forms.CharField(max_length=100, required=False, label="อำเภอ/เขต")
+    province = forms.CharField(max_length=100, required=False, label="จังหวัด")
+    postal_code = forms.CharField(max_length=5, validators=[postal_code_validator], label="รหัสไปรษณีย์")
     payment_method = forms.ChoiceField(
         choices=[
             ('transfer', 'Bank Transfer'),
@@ -85,6 +114,14 @@ class GuestCheckoutForm(forms.Form):
         label="วิธีชำระเงิน"
     )
 
+    def clean(self):
+        cleaned_data = super().clean()
+        clean_postal_address(self)
+        for field in ('city', 'province'):
+            if not cleaned_data.get(field) and field not in self.errors:
+                self.add_error(field, "กรุณากรอก" + self.fields[field].label)
+        return cleaned_data
+
 class ProductForm(forms.ModelForm):
     categories = forms.ModelMultipleChoiceField(
         queryset=Category.objects.all(),
@@ -153,6 +190,18 @@ class ProfileForm(forms.ModelForm):
         widget=forms.Textarea(attrs={'rows': 3, 'class': 'textarea'}), 
         required=False
     )
+    city = forms.CharField(
+        label="อำเภอ/เขต", max_length=100, required=False,
+        widget=forms.TextInput(attrs={'class': 'input'})
+    )
+    province = forms.CharField(
+        label="จังหวัด", max_length=100, required=False,
+        widget=forms.TextInput(attrs={'class': 'input'})
+    )
+    postal_code = forms.CharField(
+        label="รหัสไปรษณีย์", max_length=5, required=False, validators=[postal_code_validator],
+        widget=forms.TextInput(attrs={'class': 'input', 'inputmode': 'numeric', 'placeholder': '10330'})
+    )
 
     class Meta:
         model = User
@@ -170,4 +219,9 @@ class ProfileForm(forms.ModelForm):
             'email': forms.EmailInput(attrs={'class': 'input'}),
             'phone': forms.TextInput(attrs={'class': 'input', 'placeholder': '0812345678'}),
             'profile_picture': forms.TextInput(attrs={'class': 'input', 'placeholder': 'https://example.com/image.png'}),
-        }
\ No newline at end of file
+        }
+
+    def clean(self):
+        cleaned_data = super().clean()
+        clean_postal_address(self)
+        return cleaned_data
@@ -0,0 +1,313 @@
+import base64
+import json
+from datetime import datetime, time, timedelta
+
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from shop.models import User, Product, Category, Order, ActivityLog
+from shop.sharding import each_shard
+
+
+class GridFilter:
+    """
+    One server-side filter of a grid, read from ``request.GET[param]``.
+
+    ``kind`` is one of ``choice``, ``int``, ``date`` or ``text`` (exact match). For date filters
+    ``end_of_day=True`` turns the given day into an exclusive upper bound so
+    ``date_joined__lt`` still uses the index instead of a ``__date`` cast.
+    """
+
+    def __init__(self, param, label, lookup, kind='choice', choices=None, end_of_day=False):
+        self.param = param
+        self.label = label
+        self.lookup = lookup
+        self.kind = kind
+        self.choices = choices or []
+        self.end_of_day = end_of_day
+
+    def parse(self, raw):
+        if raw in (None, ''):
+            return None
+        if self.kind == 'text':
+            return raw.strip() or None
+        if self.kind == 'int':
+            try:
+                return int(raw)
+            except ValueError:
+                return None
+        if self.kind == 'date':
+            try:
+                day = parse_date(raw)
+            except ValueError:
+                # well formed but impossible, like 2024-02-30
+                return None
+            if day is None:
+                return None
+            if self.end_of_day:
+                day += timedelta(days=1)
+            return timezone.make_aware(datetime.combine(day, time.min))
+        if self.choices and raw not in dict(self.choices):
+            return None
+        return raw
+
+
+class DataGrid:
+    """
+    Reusable admin list with keyset pagination.
+
+    Rows are ordered by one indexed column plus the primary key as a tie
+    breaker, and pages are addressed by an opaque cursor holding the last
+    seen ``(value, pk)`` pair, so page N costs the same as page 1 and no
+    ``COUNT(*)`` is ever issued. Subclasses declare ``model``,
+    ``sortable`` (query param -> ``(indexed field, label)``), ``filters``
+    and ``search_field`` (matched by prefix so the index can be used).
+    """
+
+    model = None
+    sortable = {}
+    default_sort = '-id'
+    filters = []
+    search_field = None
+    page_size = 50
+    max_page_size = 200
+
+    def __init__(self, request, queryset=None, params=None):
+        self.request = request
+        self.params = request.GET if params is None else params
+        self.queryset = queryset if queryset is not None else self.model._default_manager.all()
+        self.sort = self.params.get('sort') or self.default_sort
+        if self.sort.lstrip('-') not in self.sortable:
+            self.sort = self.default_sort
+        self.search = (self.params.get('q') or '').strip()
+        self.active_filters = {}
+        for grid_filter in self.filters:
+            value = grid_filter.parse(self.params.get(grid_filter.param))
+            if value is not None:
+                self.active_filters[grid_filter] = value
+        try:
+            self.per_page = min(int(self.params.get('per_page', self.page_size)), self.max_page_size)
+        except ValueError:
+            self.per_page = self.page_size
+        if self.per_page < 1:
+            self.per_page = self.page_size
+
+    @property
+    def sort_field(self):
+        return self.sortable[self.sort.lstrip('-')][0]
+
+    @property
+    def descending(self):
+        return self.sort.startswith('-')
+
+    def get_queryset(self):
+        queryset = self.queryset
+        for grid_filter, value in self.active_filters.items():
+            queryset = queryset.filter(**{grid_filter.lookup: value})
+        if self.search and self.search_field:
+            queryset = queryset.filter(**{f'{self.search_field}__startswith': self.search})
+        return queryset
+
+    def _ordering(self, reverse=False):
+        descending = self.descending != reverse
+        prefix = '-' if descending else ''
+        return [f'{prefix}{self.sort_field}', f'{prefix}pk']
+
+    def _seek(self, queryset, cursor, reverse=False):
+        value, pk = cursor
+        field = self.sort_field
+        op = 'lt' if self.descending != reverse else 'gt'
+        return queryset.filter(
+            Q(**{f'{field}__{op}': value}) | Q(**{field: value, f'pk__{op}': pk})
+        )
+
+    def _encode(self, row):
+        value = getattr(row, self.sort_field)
+        if isinstance(value, datetime):
+            # DjangoJSONEncoder keeps milliseconds only: the cursor must match the row exactly
+            value = value.isoformat()
+        raw = json.dumps([value, row.pk], cls=DjangoJSONEncoder)
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+    def _decode(self, token):
+        if not token:
+            return None
+        try:
+            padded = token + '=' * (-len(token) % 4)
+            value, pk = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            return self.model._meta.get_field(self.sort_field).to_python(value), int(pk)
+        except (ValueError, TypeError, ValidationError):
+            # a cursor that was tampered with or outlived a sort change: start over
+            return None
+
+    def _fetch(self, queryset, limit, reverse=False):
+        """The first ``limit`` rows of ``queryset``, already seeked and ordered."""
+        return list(queryset[:limit])
+
+    def page(self):
+        queryset = self.get_queryset()
+        after = self._decode(self.params.get('after'))
+        before = None if after else self._decode(self.params.get('before'))
+
+        if before:
+            queryset = self._seek(queryset, before, reverse=True).order_by(*self._ordering(reverse=True))
+            rows = self._fetch(queryset, self.per_page + 1, reverse=True)
+            has_more_before = len(rows) > self.per_page
+            rows = rows[:self.per_page][::-1]
+            has_more_after = True
+        else:
+            if after:
+                queryset = self._seek(queryset, after)
+            rows = self._fetch(queryset.order_by(*self._ordering()), self.per_page + 1)
+            has_more_after = len(rows) > self.per_page
+            rows = rows[:self.per_page]
+            has_more_before = after is not None
+
+        self.rows = rows
+        self.next_cursor = self._encode(rows[-1]) if rows and has_more_after else None
+        self.prev_cursor = self._encode(rows[0]) if rows and has_more_before else None
+        return rows
+
+    def query_string(self, **overrides):
+        params = self.params.copy()
+        for key in ('after', 'before'):
+            params.pop(key, None)
+        for key, value in overrides.items():
+            if value is None:
+                params.pop(key, None)
+            else:
+                params[key] = value
+        return params.urlencode()
+
+    @property
+    def at_head(self):
+        """True once ``page()`` returned the first page of a newest-first listing."""
+        return self.descending and self.prev_cursor is None and not self.search
+
+    @property
+    def next_query(self):
+        return self.query_string(after=self.next_cursor) if self.next_cursor else None
+
+    @property
+    def prev_query(self):
+        return self.query_string(before=self.prev_cursor) if self.prev_cursor else None
+
+    def sort_links(self):
+        links = []
+        for name, (field, label) in self.sortable.items():
+            active = self.sort.lstrip('-') == name
+            target = name if active and self.descending else f'-{name}'
+            links.append({
+                'name': name,
+                'label': label,
+                'active': active,
+                'descending': active and self.descending,
+                'query': self.query_string(sort=target),
+            })
+        return links
+
+    def filter_controls(self):
+        return [
+            {
+                'filter': grid_filter,
+                'value': self.params.get(grid_filter.param, ''),
+            }
+            for grid_filter in self.filters
+        ]
+
+
+class UserGrid(DataGrid):
+    model = User
+
+    sortable = {
+        'date_joined': ('date_joined', 'วันที่สมัคร'),
+        'username': ('username', 'username'),
+        'id': ('id', 'ID'),
+    }
+    default_sort = '-date_joined'
+    search_field = 'username'
+    filters = [
+        GridFilter('role', 'บทบาท', 'role', choices=User.ROLE_CHOICES),
+        GridFilter('joined_from', 'สมัครตั้งแต่', 'date_joined__gte', kind='date'),
+        GridFilter('joined_to', 'สมัครถึง', 'date_joined__lt', kind='date', end_of_day=True),
+    ]
+
+
+class ProductGrid(DataGrid):
+    model = Product
+
+    sortable = {
+        'id': ('id', 'ID'),
+        'name': ('name', 'ชื่อสินค้า'),
+        'price': ('price', 'ราคา'),
+        'stock': ('stock', 'สต็อก'),
+    }
+    default_sort = '-id'
+    search_field = 'name'
+    filters = [
+        GridFilter('stock_min', 'สต็อกตั้งแต่', 'stock__gte', kind='int'),
+        GridFilter('stock_max', 'สต็อกไม่เกิน', 'stock__lte', kind='int'),
+    ]
+
+
+class CategoryGrid(DataGrid):
+    model = Category
+
+    sortable = {
+        'id': ('id', 'ID'),
+        'name': ('name', 'ชื่อหมวดหมู่'),
+    }
+    default_sort = 'name'
+    search_field = 'name'
+
+
+class OrderGrid(DataGrid):
+    """
+    Orders of every shard: each shard returns its own first rows of the
+    page and the page is the first of their merge, so a page costs one
+    indexed query per shard at any depth.
+    """
+    model = Order
+
+    sortable = {
+        'created_at': ('created_at', 'วันที่สั่ง'),
+        'id': ('id', 'เลขที่'),
+    }
+    default_sort = '-created_at'
+    filters = [
+        GridFilter('status', 'สถานะ', 'status', choices=Order.STATUS_CHOICES),
+        GridFilter('created_from', 'สั่งตั้งแต่', 'created_at__gte', kind='date'),
+        GridFilter('created_to', 'สั่งถึง', 'created_at__lt', kind='date', end_of_day=True),
+    ]
+
+    def _fetch(self, queryset, limit, reverse=False):
+        rows = [row for shard_queryset in each_shard(queryset) for row in shard_queryset[:limit]]
+        rows.sort(key=lambda row: (getattr(row, self.sort_field), row.pk), reverse=self.descending != reverse)
+        return rows[:limit]
+
+
+class ActivityLogGrid(DataGrid):
+    model = ActivityLog
+
+    sortable = {
+        'timestamp': ('timestamp', 'เวลา'),
+    }
+    default_sort = '-timestamp'
+    filters = [
+        GridFilter('user', 'ผู้ใช้ (username)', 'user__username', kind='text'),
+        GridFilter('category', 'หมวด', 'category'),
+        GridFilter('from', 'ตั้งแต่', 'timestamp__gte', kind='date'),
+        GridFilter('to', 'ถึง', 'timestamp__lt', kind='date', end_of_day=True),
+    ]
+
+    def __init__(self, request, queryset=None, params=None, categories=()):
+        # log categories are free text, so the choices come from the caller
+        self.filters = [
+            GridFilter(f.param, f.label, f.lookup, f.kind, [(c, c) for c in categories], f.end_of_day)
+            if f.param == 'category' else f
+            for f in self.filters
+        ]
+        super().__init__(request, queryset, params)
@@ -0,0 +1,338 @@
+import asyncio
+import contextvars
+import itertools
+import json
+import logging
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from importlib import import_module
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user
+from django.db import close_old_connections, connections
+from django.http import HttpRequest, parse_cookie
+from django.db.models import Count
+from django.urls import reverse
+from django.utils import dateformat, timezone
+
+from shop import changes, sharding
+from shop.models import ActivityLog, Order, Product, User
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 1.0
+DEFAULT_HEARTBEAT = 15
+# dashboard totals are recounted at most this often, however busy the orders are
+STATS_EVERY = 5.0
+# messages a client may fall behind before it is cut off
+QUEUE_SIZE = 256
+# recent messages replayed to a client that reconnects with Last-Event-ID
+BACKLOG = 1000
+# activity log ids below the newest one seen that may still commit (PostgreSQL
+# hands out ids before the inserting transactions commit, in any order)
+LOG_LOOKBACK = 100
+
+RETRY = b'retry: 3000\n\n'
+KEEP_ALIVE = b': keep-alive\n\n'
+
+
+def frame(event, data, ident=None):
+    """One Server-Sent Events message."""
+    lines = [f'id: {ident}'] if ident else []
+    lines += [f'event: {event}', f'data: {json.dumps(data, ensure_ascii=False)}', '', '']
+    return '\n'.join(lines).encode()
+
+
+RESYNC = frame('resync', {})
+
+
+def dashboard_totals():
+    return {
+        'total_users': User.objects.count(),
+        'total_products': Product.objects.count(),
+        'total_orders': sharding.count(Order.objects.all()),
+        'total_sales': sharding.total(Order.objects.filter(status='paid'), 'total_price'),
+    }
+
+
+def order_data(order, created):
+    return {
+        'id': order.id,
+        'created': created,
+        'user': order.user.username if order.user else 'Guest',
+        'item_count': order.item_count,
+        'total_price': order.total_price,
+        'status': order.status,
+        'status_display': order.get_status_display(),
+        'created_at': dateformat.format(timezone.localtime(order.created_at), 'Y-m-d H:i'),
+        'detail_url': reverse('shop:admin_order_detail', args=[order.id]),
+        'delete_url': reverse('shop:admin_order_delete', args=[order.id]),
+    }
+
+
+def activity_data(log):
+    return {
+        'id': log.id,
+        'timestamp': dateformat.format(timezone.localtime(log.timestamp), 'd/m/Y H:i'),
+        'action': log.action,
+        'user': log.user.username,
+        'category': log.category,
+    }
+
+
+class Client:
+    """One connected page: a bounded queue of encoded messages."""
+
+    def __init__(self):
+        self.queue = asyncio.Queue(QUEUE_SIZE)
+        self.dropped = False
+
+    def put(self, chunk):
+        if self.dropped:
+            return
+        try:
+            self.queue.put_nowait(chunk)
+        except asyncio.QueueFull:
+            # a stalled tab must not hold the rest back or grow without bound
+            self.dropped = True
+
+
+class Broadcaster:
+    """
+    The worker's single source of live admin updates. While at least one
+    page is connected, one task polls the change feed of every order shard
+    and the activity log every LIVE_FEED_INTERVAL seconds on its own thread and
+    hands each message, encoded once, to every client's queue, so the
+    queries cost the same for 500 open tabs as for one. The task stops with
+    the last client; the next one starts again from the newest rows.
+    """
+
+    def __init__(self):
+        self.interval = getattr(settings, 'LIVE_FEED_INTERVAL', DEFAULT_INTERVAL)
+        self.heartbeat = getattr(settings, 'LIVE_FEED_HEARTBEAT', DEFAULT_HEARTBEAT)
+        self.clients = set()
+        self.backlog = deque(maxlen=BACKLOG)
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix='live-feed')
+        self.task = None
+        self.runs = itertools.count(1)
+        self.run_id = None
+        self.seq = 0
+        self.polls = 0
+        self.published = 0
+        self._reset()
+
+    def _reset(self):
+        # poll state, only touched on the executor thread: a feed position per order shard
+        self.positions = None
+        self.log_floor = 0
+        self.logs_seen = set()
+        self.stats_due = 0.0
+        self.stats_stale = False
+
+    def _stop(self):
+        connections.close_all()
+        self._reset()
+
+    def subscribe(self, last_event_id=None):
+        """
+        Register a client and return it with the messages it missed since
+        ``last_event_id``, or None if they can no longer be replayed.
+        """
+        loop = asyncio.get_running_loop()
+        if self.task is None or self.task.get_loop() is not loop:
+            self.run_id = f'{os.getpid():x}.{next(self.runs)}'
+            self.backlog.clear()
+            # a fresh context: the task must not inherit the request that started it
+            self.task = loop.create_task(self.run(), context=contextvars.Context())
+        client = Client()
+        self.clients.add(client)
+        return client, self.replay(last_event_id)
+
+    def replay(self, last_event_id):
+        if not last_event_id:
+            return []
+        run_id, _, seq = last_event_id.rpartition('-')
+        if run_id != self.run_id or not seq.isdigit():
+            return None
+        seq = int(seq)
+        if self.backlog and seq < self.backlog[0][0] - 1:
+            return None
+        return [chunk for number, chunk in self.backlog if number > seq]
+
+    def publish(self, messages):
+        for event, data in messages:
+            self.seq += 1
+            chunk = frame(event, data, f'{self.run_id}-{self.seq}')
+            self.backlog.append((self.seq, chunk))
+            for client in self.clients:
+                client.put(chunk)
+            self.published += 1
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        try:
+            while self.clients:
+                started = loop.time()
+                try:
+                    messages = await loop.run_in_executor(self.executor, self.poll)
+                except Exception:
+                    logger.exception("live feed poll failed")
+                    messages = []
+                self.publish(messages)
+                await asyncio.sleep(max(0.0, self.interval - (loop.time() - started)))
+        finally:
+            self.task = None
+            await loop.run_in_executor(self.executor, self._stop)
+
+    def poll(self):
+        """Messages for everything committed since the last poll; runs on the executor thread."""
+        close_old_connections()
+        self.polls += 1
+        if self.positions is None:
+            self.positions = {using: changes.latest(using) for using in sharding.shards()}
+            newest = ActivityLog.objects.order_by('-id').values_list('id', flat=True).first() or 0
+            self.log_floor = newest
+            return []
+
+        messages = []
+        for using, position in self.positions.items():
+            events = changes.read(position, topics=[Order.change_topic], using=using)
+            if events:
+                self.positions[using] = changes.position_of(events[-1])
+                messages += self.order_messages(events, using)
+                self.stats_stale = True
+        messages += self.activity_messages()
+        if self.stats_stale and time.monotonic() >= self.stats_due:
+            messages.append(('stats', dashboard_totals()))
+            self.stats_stale = False
+            self.stats_due = time.monotonic() + STATS_EVERY
+        return messages
+
+    def order_messages(self, events, using='default'):
+        created = {event.object_id for event in events if event.operation == 'create'}
+        # one message per order, in the order of its last change
+        ids = list(dict.fromkeys(event.object_id for event in reversed(events)))[::-1]
+        orders = Order.objects.using(using).prefetch_related('user').annotate(item_count=Count('items')).in_bulk(ids)
+        messages = []
+        for pk in ids:
+            order = orders.get(pk)
+            if order is None:
+                messages.append(('order_deleted', {'id': pk}))
+            else:
+                messages.append(('order', order_data(order, pk in created)))
+        return messages
+
+    def activity_messages(self):
+        recent = ActivityLog.objects.filter(id__gt=self.log_floor).values_list('id', flat=True)
+        new = sorted(set(recent) - self.logs_seen)
+        if not new:
+            return []
+        logs = ActivityLog.objects.select_related('user').filter(id__in=new).order_by('id')
+        messages = [('activity', activity_data(log)) for log in logs]
+        self.logs_seen.update(new)
+        self.log_floor = max(self.log_floor, new[-1] - LOG_LOOKBACK)
+        self.logs_seen = {pk for pk in self.logs_seen if pk > self.log_floor}
+        return messages
+
+    async def stream(self, last_event_id=None):
+        """The body of one text/event-stream response."""
+        client, missed = self.subscribe(last_event_id)
+        try:
+            yield RETRY
+            if missed is None:
+                yield RESYNC
+            else:
+                for chunk in missed:
+                    yield chunk
+            while not client.dropped:
+                try:
+                    chunk = await asyncio.wait_for(client.queue.get(), self.heartbeat)
+                except TimeoutError:
+                    chunk = KEEP_ALIVE
+                # everything one poll published goes out in a single write
+                while not client.queue.empty():
+                    chunk += client.queue.get_nowait()
+                if client.dropped:
+                    break
+                yield chunk
+            # cut off: the browser reconnects with the last id it got and is
+            # replayed from the backlog, or told to resync
+        finally:
+            self.clients.discard(client)
+
+
+broadcaster = Broadcaster()
+
+
+def is_admin(cookie_header):
+    """Whether the session in a Cookie header belongs to an admin; blocking, like any session load."""
+    from shop.views import admin_check
+
+    close_old_connections()
+    try:
+        request = HttpRequest()
+        request.COOKIES = parse_cookie(cookie_header)
+        engine = import_module(settings.SESSION_ENGINE)
+        request.session = engine.SessionStore(request.COOKIES.get(settings.SESSION_COOKIE_NAME))
+        return admin_check(get_user(request))
+    finally:
+        close_old_connections()
+
+
+class LiveFeedApp:
+    """
+    ASGI application in front of Django's that serves the live feed path
+    itself. Through Django's handler every open stream would keep its
+    request's sync thread (session, middleware) alive for as long as the
+    tab stays open; here the session is checked once on the shared thread
+    pool and an open tab costs a coroutine and a queue.
+    """
+
+    def __init__(self, application):
+        self.application = application
+        self.path = None
+
+    async def __call__(self, scope, receive, send):
+        if self.path is None:
+            self.path = reverse('shop:admin_live_feed')
+        if scope['type'] != 'http' or scope['path'] != self.path:
+            return await self.application(scope, receive, send)
+
+        headers = {name.decode('latin-1'): value.decode('latin-1') for name, value in scope['headers']}
+        if not await sync_to_async(is_admin, thread_sensitive=False)(headers.get('cookie', '')):
+            await send({'type': 'http.response.start', 'status': 403, 'headers': []})
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', b'text/event-stream; charset=utf-8'),
+                (b'cache-control', b'no-cache'),
+                # nginx buffers proxied responses unless told otherwise
+                (b'x-accel-buffering', b'no'),
+            ],
+        })
+        stream = broadcaster.stream(headers.get('last-event-id'))
+
+        async def pump():
+            async for chunk in stream:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+
+        async def disconnected():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+
+        tasks = [asyncio.create_task(pump()), asyncio.create_task(disconnected())]
+        try:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await stream.aclose()
@@ -0,0 +1,160 @@
+import json
+from contextlib import ExitStack
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import resolve
+
+from shop.models import User, Category, Product, Cart, CartItem, Order, OrderItem, Payment, Address, ActivityLog
+from shop.nplusone import NPlusOneError, detect_n_plus_one
+from shop.payments import sign_payload
+from shop.profiling import list_profiles
+from shop.sharding import shards
+from shop.urls import urlpatterns
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Render every shop view against a throwaway dataset and report N+1 query patterns"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=12, help="rows per list so loops show up")
+        parser.add_argument('--threshold', type=int, default=5)
+        parser.add_argument('--strict', action='store_true', help="exit with an error if anything is found")
+
+    def handle(self, *args, **options):
+        failures = []
+        try:
+            # the seeded orders are on their shards: roll those back as well
+            with ExitStack() as stack:
+                for alias in dict.fromkeys(['default', *shards()]):
+                    stack.enter_context(transaction.atomic(using=alias))
+                self.run_checks(options, failures)
+                raise Rollback
+        except Rollback:
+            pass
+
+        if failures:
+            for report in failures:
+                self.stdout.write(report)
+            if options['strict']:
+                raise CommandError(f"{len(failures)} view(s) with N+1 queries")
+        else:
+            self.stdout.write("[nplusone] no repeated query patterns found")
+
+    def seed(self, rows):
+        admin = User.objects.create_user('nplusone-admin', password='unused-password', role='admin')
+        customer = User.objects.create_user('nplusone-customer', password='unused-password')
+        Address.objects.create(user=customer, receiver_name='Test', phone='0800000000', address_line='Bangkok')
+        categories = [Category.objects.create(name=f'N+1 category {i}') for i in range(rows)]
+        products = []
+        for i in range(rows):
+            product = Product.objects.create(name=f'N+1 product {i}', price=100 + i, stock=50)
+            product.categories.add(categories[i % len(categories)])
+            products.append(product)
+        cart = Cart.objects.create(user=customer)
+        for product in products:
+            CartItem.objects.create(cart=cart, product=product, quantity=1)
+        orders = []
+        for i in range(rows):
+            order = Order.objects.create(user=customer, total_price=200, status='pending')
+            for product in products[:3]:
+                OrderItem.objects.create(order=order, product=product, quantity=1, unit_price=product.price)
+            Payment.objects.create(order=order, amount=200, method='transfer', status='pending', provider_ref=f'nplusone-{i}')
+            orders.append(order)
+        for i in range(rows):
+            ActivityLog.objects.create(user=admin, action=f'N+1 check {i}', category='ทดสอบ')
+        return admin, customer, categories, products, orders
+
+    def run_checks(self, options, failures):
+        admin, customer, categories, products, orders = self.seed(options['rows'])
+        category, product, order = categories[0], products[0], orders[0]
+        checkout = {'receiver_name': 'Test', 'phone': '0800000000', 'address_line': '1 Rama I Rd', 'city': 'ปทุมวัน', 'province': 'กรุงเทพมหานคร', 'postal_code': '10330', 'payment_method': 'transfer'}
+        batch = json.dumps({'changes': [{'product_id': p.id, 'delta': 1} for p in products]})
+        callback = json.dumps({'provider_ref': 'nplusone-0', 'status': 'success', 'amount': 200}).encode()
+        profiles = list_profiles(1)
+        profile = profiles[0]['name'] if profiles else 'missing'
+
+        # (user, method, url, data, client options); writes that delete or log out come last
+        pages = [
+            (None, 'get', '/', None, {}),
+            (None, 'get', '/products/', None, {}),
+            (None, 'get', f'/products/category/{category.id}/', None, {}),
+            (None, 'get', f'/product/{product.id}/', None, {}),
+            (None, 'get', '/products/autocomplete/?q=N', None, {}),
+            (None, 'get', '/address/autocomplete/?q=10330', None, {}),
+            (None, 'get', '/login/', None, {}),
+            (None, 'get', '/register/', None, {}),
+            (None, 'post', '/payments/callback/', callback,
+             {'content_type': 'application/json', 'headers': {'X-Signature': sign_payload(callback)}}),
+            (customer, 'get', '/profile/', None, {}),
+            (customer, 'get', '/profile/edit/', None, {}),
+            (customer, 'get', '/profile/password_change/', None, {}),
+            (customer, 'get', '/profile/password_change/done/', None, {}),
+            (customer, 'post', '/cart/add/', {'product_id': product.id, 'quantity': 1}, {}),
+            (customer, 'post', '/cart/batch/', batch, {'content_type': 'application/json'}),
+            (customer, 'post', '/update_cart/', {'product_id': product.id, 'action': 'increase'}, {}),
+            (customer, 'post', '/cart/remove/', {'product_id': products[1].id}, {}),
+            (customer, 'get', '/cart/', None, {}),
+            (customer, 'get', '/checkout/', None, {}),
+            (customer, 'post', '/checkout/', checkout, {}),
+            (customer, 'get', '/order/confirm/', None, {}),
+            (customer, 'post', '/order/confirm/', None, {}),
+            (customer, 'get', '/order/success/', None, {}),
+            (customer, 'get', '/orders/', None, {}),
+            (customer, 'get', f'/orders/{order.id}/', None, {}),
+            (customer, 'get', f'/order/{order.id}/pay/', None, {}),
+            (customer, 'post', f'/order/{order.id}/pay/', {'payment_method': 'transfer'}, {}),
+            (admin, 'get', '/admin/dashboard/', None, {}),
+            (admin, 'get', '/admin/live/', None, {}),
+            (admin, 'get', '/admin/products/', None, {}),
+            (admin, 'get', '/admin/products/add/', None, {}),
+            (admin, 'get', f'/admin/products/edit/{product.id}/', None, {}),
+            (admin, 'get', '/admin/categories/', None, {}),
+            (admin, 'get', '/admin/categories/add/', None, {}),
+            (admin, 'get', f'/admin/categories/edit/{category.id}/', None, {}),
+            (admin, 'get', '/admin/orders/', None, {}),
+            (admin, 'post', '/admin/orders/bulk-status/',
+             {'status': 'paid', 'scope': 'selected', 'orders': [o.id for o in orders[3:]]}, {}),
+            (admin, 'get', f'/admin/orders/{order.id}/', None, {}),
+            (admin, 'get', '/admin/users/', None, {}),
+            (admin, 'get', f'/admin/users/edit/{customer.id}/', None, {}),
+            (admin, 'get', '/admin/reports/sales/', None, {}),
+            (admin, 'get', '/admin/activity/', None, {}),
+            (admin, 'get', '/admin/profiles/', None, {}),
+            (admin, 'get', f'/admin/profiles/{profile}/', None, {}),
+            (admin, 'get', '/profile/', None, {}),
+            (admin, 'post', f'/admin/orders/{orders[1].id}/cancel/', None, {}),
+            (admin, 'post', f'/admin/orders/{orders[2].id}/delete/', None, {}),
+            (admin, 'post', f'/admin/products/delete/{products[-1].id}/', None, {}),
+            (admin, 'post', f'/admin/categories/delete/{categories[-1].id}/', None, {}),
+            (customer, 'get', '/logout/', None, {}),
+        ]
+
+        clients = {}
+        covered = set()
+        with override_settings(ALLOWED_HOSTS=['*']):
+            for user, method, url, data, extra in pages:
+                client = clients.get(user)
+                if client is None:
+                    client = clients[user] = Client()
+                    if user is not None:
+                        client.force_login(user)
+                covered.add(resolve(url.partition('?')[0]).url_name)
+                label = f"{method.upper()} {url}"
+                try:
+                    with detect_n_plus_one(label, threshold=options['threshold'], strict=True):
+                        response = getattr(client, method)(url, data or {}, **extra)
+                except NPlusOneError as error:
+                    failures.append(str(error))
+                else:
+                    self.stdout.write(f"[nplusone] ok   {label} ({response.status_code})")
+
+        missing = sorted({pattern.name for pattern in urlpatterns} - covered)
+        if missing:
+            failures.append(f"Views not checked, add them to check_n_plus_one: {', '.join(missing)}")
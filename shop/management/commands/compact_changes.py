@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop.changes import compact, compactable, feeds
+
+
+class Command(BaseCommand):
+    help = "Drop change feed events superseded by a newer event for the same row, and delete events every consumer has read"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--sleep', type=float, default=0.1, help="seconds to pause between batches")
+        parser.add_argument('--dry-run', action='store_true', help="only count what would be deleted")
+        parser.add_argument('--loop', action='store_true', help="keep compacting every --interval seconds")
+        parser.add_argument('--interval', type=float, default=3600)
+
+    def handle(self, *args, **options):
+        while True:
+            for using in feeds():
+                started = time.monotonic()
+                if options['dry_run']:
+                    superseded, tombstones = compactable(using=using)
+                    counts = {'superseded': superseded.count(), 'tombstones': tombstones.count()}
+                    verb = 'would delete'
+                else:
+                    counts = compact(options['batch_size'], options['sleep'], using=using)
+                    verb = 'deleted'
+                summary = ', '.join(f"{kind}: {count}" for kind, count in counts.items())
+                self.stdout.write(
+                    f"[changes] {using}: {verb} {sum(counts.values())} events ({summary}) in {time.monotonic() - started:.2f}s"
+                )
+            if not options['loop'] or options['dry_run']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,320 @@
+import io
+import random
+import time
+from datetime import timedelta
+from multiprocessing import Pool
+
+from django.core.management.base import BaseCommand
+from django.core.management.color import no_style
+from django.db import connection, connections, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from shop.models import User, Category, Product, Cart, CartItem, Order, OrderItem, Payment, ActivityLog
+from shop.sharding import bucket_of, id_stride, prepare_sequence, shard_for, shard_number, shards
+
+THAI_WORDS = ['เสื้อ', 'กางเกง', 'รองเท้า', 'กระเป๋า', 'หมวก', 'นาฬิกา', 'แว่นตา', 'ถุงเท้า', 'เข็มขัด', 'ผ้าพันคอ']
+ENGLISH_WORDS = ['Classic', 'Sport', 'Cotton', 'Denim', 'Leather', 'Premium', 'Basic', 'Vintage', 'Slim', 'Oversize']
+COLORS = ['สีดำ', 'สีขาว', 'สีแดง', 'สีน้ำเงิน', 'Black', 'White', 'Navy', 'Grey']
+ORDER_STATUSES = ['paid'] * 30 + ['shipping'] * 15 + ['delivered'] * 30 + ['pending'] * 22 + ['cancelled'] * 3
+PAYMENT_STATUS = {'paid': 'success', 'shipping': 'success', 'delivered': 'success', 'pending': 'pending', 'cancelled': 'cancelled'}
+PAYMENT_METHODS = ['transfer', 'credit_card', 'cash']
+LOG_ACTIONS = [
+    ('เพิ่มสินค้าใหม่', 'จัดการสินค้า'),
+    ('แก้ไขสินค้า', 'จัดการสินค้า'),
+    ('อัปเดตสถานะคำสั่งซื้อ', 'จัดการคำสั่งซื้อ'),
+    ('สั่งซื้อสินค้า', 'คำสั่งซื้อ'),
+]
+
+
+def product_price(product_id, seed):
+    # derived from the id so order lines can price a product without reading it
+    return 20 + (product_id * 7919 + seed) % 4980
+
+
+# COPY's text format: \N is NULL, backslash escapes the separators
+COPY_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+
+def copy_field(value):
+    return '\\N' if value is None else str(value).translate(COPY_ESCAPES)
+
+
+def skewed(rng, low, count, exponent):
+    """Pick from ``[low, low + count)`` with popularity concentrated at the low end."""
+    return low + int(count * rng.random() ** exponent)
+
+
+class Writer:
+    """Bulk row writer for database ``using``: COPY on PostgreSQL, batched multi-row INSERTs elsewhere."""
+
+    def __init__(self, batch_size, using='default'):
+        self.batch_size = batch_size
+        self.using = using
+        self.postgres = connections[using].vendor == 'postgresql'
+
+    @property
+    def connection(self):
+        return connections[self.using]
+
+    def write(self, model, columns, rows):
+        table = model._meta.db_table
+        if self.postgres:
+            return self._copy(table, columns, rows)
+        return self._insert(table, columns, rows)
+
+    def _adapt(self, value):
+        if hasattr(value, 'tzinfo'):
+            return self.connection.ops.adapt_datetimefield_value(value)
+        return value
+
+    def _insert(self, table, columns, rows):
+        qn = self.connection.ops.quote_name
+        sql = f"INSERT INTO {qn(table)} ({', '.join(qn(c) for c in columns)}) VALUES ({', '.join(['%s'] * len(columns))})"
+        total = 0
+        batch = []
+        with self.connection.cursor() as cursor:
+            for row in rows:
+                batch.append([self._adapt(value) for value in row])
+                if len(batch) >= self.batch_size:
+                    cursor.executemany(sql, batch)
+                    total += len(batch)
+                    batch = []
+            if batch:
+                cursor.executemany(sql, batch)
+                total += len(batch)
+        return total
+
+    def _copy(self, table, columns, rows):
+        qn = self.connection.ops.quote_name
+        # text rather than csv: csv cannot tell NULL from an empty string without quoting every string
+        sql = f"COPY {qn(table)} ({', '.join(qn(c) for c in columns)}) FROM STDIN"
+        total = 0
+        with self.connection.cursor() as cursor:
+            raw = cursor.cursor
+            while True:
+                buffer = io.StringIO()
+                count = 0
+                for row in rows:
+                    buffer.write('\t'.join(map(copy_field, row)))
+                    buffer.write('\n')
+                    count += 1
+                    if count >= self.batch_size:
+                        break
+                if not count:
+                    return total
+                buffer.seek(0)
+                if hasattr(raw, 'copy_expert'):
+                    raw.copy_expert(sql, buffer)
+                else:
+                    with raw.copy(sql) as copy:
+                        copy.write(buffer.getvalue())
+                total += count
+
+
+class Generator:
+    """
+    Produces one id range of one table. Every chunk seeds its own RNG from
+    ``(seed, table, start)``, so the dataset is identical for a given seed
+    no matter how many processes build it or in which order.
+    """
+
+    def __init__(self, options, base):
+        self.options = options
+        self.base = base
+        self.seed = options['seed']
+        self.now = timezone.now()
+        self.writer = Writer(options['batch_size'])
+
+    def rng(self, table, start):
+        return random.Random(f'{self.seed}:{table}:{start}')
+
+    def moment(self, rng):
+        return self.now - timedelta(seconds=int(rng.random() * self.options['days'] * 86400))
+
+    def categories(self, start, stop):
+        rows = ((pk, f'หมวดหมู่ {pk}', '') for pk in range(start, stop))
+        return self.writer.write(Category, ['id', 'name', 'description'], rows)
+
+    def products(self, start, stop):
+        rng = self.rng('product', start)
+
+        def rows():
+            for pk in range(start, stop):
+                name = f"{rng.choice(THAI_WORDS)} {rng.choice(ENGLISH_WORDS)} {rng.choice(COLORS)} #{pk}"
+                yield pk, name, '', product_price(pk, self.seed), rng.randint(0, 500), None, self.moment(rng)
+        return self.writer.write(
+            Product, ['id', 'name', 'description', 'price', 'stock', 'image_url', 'updated_at'], rows()
+        )
+
+    def product_categories(self, start, stop):
+        rng = self.rng('product_categories', start)
+        first, count = self.base['category'], self.options['categories']
+        through = Product.categories.through
+
+        def rows():
+            for pk in range(start, stop):
+                picked = {skewed(rng, first, count, 2) for _ in range(rng.randint(1, 2))}
+                for category_id in picked:
+                    yield pk, category_id
+        return self.writer.write(through, ['product_id', 'category_id'], rows())
+
+    def users(self, start, stop):
+        rng = self.rng('user', start)
+
+        def rows():
+            for pk in range(start, stop):
+                yield (
+                    pk, '!', None, False, f'user{pk}', '', '', f'user{pk}@example.com', False, True,
+                    self.moment(rng), f'08{rng.randint(10000000, 99999999)}', rng.randint(16, 70), 'customer', None,
+                )
+        return self.writer.write(User, [
+            'id', 'password', 'last_login', 'is_superuser', 'username', 'first_name', 'last_name', 'email',
+            'is_staff', 'is_active', 'date_joined', 'phone', 'age', 'role', 'profile_picture',
+        ], rows())
+
+    def carts(self, start, stop):
+        rng = self.rng('cart', start)
+        product_first, product_count = self.base['product'], self.options['products']
+        carts, items = [], []
+        # roughly a third of users left something in a cart
+        for user_id in range(start, stop):
+            if rng.random() > 0.33:
+                continue
+            created = self.moment(rng)
+            carts.append((user_id, user_id, created, created))
+            picked = {skewed(rng, product_first, product_count, 3) for _ in range(rng.randint(1, 4))}
+            items.extend((user_id, product_id, rng.randint(1, 3)) for product_id in picked)
+        written = self.writer.write(Cart, ['id', 'user_id', 'created_at', 'last_activity'], iter(carts))
+        written += self.writer.write(CartItem, ['cart_id', 'product_id', 'quantity'], iter(items))
+        return written
+
+    def orders(self, start, stop):
+        rng = self.rng('order', start)
+        options = self.options
+        user_first, user_count = self.base['user'], options['users']
+        product_first, product_count = self.base['product'], options['products']
+        stride = id_stride()
+        rows = {alias: ([], [], []) for alias in shards()}
+        for number in range(start, stop):
+            # repeat buyers: a small share of users places most orders
+            user_id = skewed(rng, user_first, user_count, 2.5)
+            # on the user's shard, with an id of that shard
+            alias = shard_for(user_id)
+            order_id = number * stride + shard_number(alias)
+            orders, lines, payments = rows[alias]
+            created = self.moment(rng)
+            status = rng.choice(ORDER_STATUSES)
+            count = max(1, int(rng.expovariate(1 / options['lines_per_order']) + 0.5))
+            total = 0
+            for product_id in {skewed(rng, product_first, product_count, 3) for _ in range(count)}:
+                quantity = rng.randint(1, 3)
+                price = product_price(product_id, self.seed)
+                total += quantity * price
+                lines.append((order_id, product_id, quantity, price))
+            orders.append((order_id, user_id, total, status, created, False, bucket_of(user_id)))
+            payments.append((order_id, total, rng.choice(PAYMENT_METHODS), PAYMENT_STATUS[status], None, created))
+
+        written = 0
+        for alias, (orders, lines, payments) in rows.items():
+            writer = Writer(self.options['batch_size'], alias)
+            with transaction.atomic(using=alias):
+                written += writer.write(
+                    Order, ['id', 'user_id', 'total_price', 'status', 'created_at', 'sales_recorded', 'bucket'], iter(orders)
+                )
+                written += writer.write(OrderItem, ['order_id', 'product_id', 'quantity', 'unit_price'], iter(lines))
+                written += writer.write(
+                    Payment, ['order_id', 'amount', 'method', 'status', 'provider_ref', 'created_at'], iter(payments)
+                )
+        return written
+
+    def activity_logs(self, start, stop):
+        rng = self.rng('activity', start)
+        user_first, user_count = self.base['user'], self.options['users']
+
+        def rows():
+            for _ in range(start, stop):
+                action, category = rng.choice(LOG_ACTIONS)
+                yield skewed(rng, user_first, user_count, 2), action, category, self.moment(rng)
+        return self.writer.write(ActivityLog, ['user_id', 'action', 'category', 'timestamp'], rows())
+
+
+def _run_chunk(job):
+    generator, stage, start, stop = job
+    connections.close_all()
+    with transaction.atomic():
+        return getattr(generator, stage)(start, stop)
+
+
+class Command(BaseCommand):
+    help = "Generate a deterministic, skewed synthetic dataset for scale testing"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--categories', type=int, default=200)
+        parser.add_argument('--products', type=int, default=10000)
+        parser.add_argument('--users', type=int, default=5000)
+        parser.add_argument('--orders', type=int, default=40000)
+        parser.add_argument('--lines-per-order', type=float, default=2.5, help="average order lines per order")
+        parser.add_argument('--activity-logs', type=int, default=10000)
+        parser.add_argument('--days', type=int, default=365, help="spread timestamps over this many days")
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--chunk-size', type=int, default=20000, help="rows of the driving table per chunk")
+        parser.add_argument('--batch-size', type=int, default=5000, help="rows per INSERT batch / COPY buffer")
+
+    def handle(self, *args, **options):
+        base = {
+            'category': (Category.objects.aggregate(m=Max('id'))['m'] or 0) + 1,
+            'product': (Product.objects.aggregate(m=Max('id'))['m'] or 0) + 1,
+            'user': (User.objects.aggregate(m=Max('id'))['m'] or 0) + 1,
+            # order numbers: order ids are number * ORDER_ID_STRIDE + the shard's number
+            'order': max((Order.objects.using(alias).aggregate(m=Max('id'))['m'] or 0) // id_stride() for alias in shards()) + 1,
+        }
+        if Cart.objects.filter(id__gte=base['user']).exists():
+            # cart ids mirror the new user ids
+            base['user'] = max(base['user'], Cart.objects.aggregate(m=Max('id'))['m'] + 1)
+
+        generator = Generator(options, base)
+        workers = options['workers']
+        if connection.vendor == 'sqlite':
+            # SQLite allows a single writer
+            workers = 1
+
+        stages = [
+            ('categories', base['category'], options['categories']),
+            ('products', base['product'], options['products']),
+            ('product_categories', base['product'], options['products']),
+            ('users', base['user'], options['users']),
+            ('carts', base['user'], options['users']),
+            ('orders', base['order'], options['orders']),
+            ('activity_logs', 0, options['activity_logs']),
+        ]
+
+        started = time.monotonic()
+        connections.close_all()
+        pool = Pool(workers) if workers > 1 else None
+        try:
+            for stage, first, count in stages:
+                chunk = options['chunk_size']
+                jobs = [(generator, stage, lo, min(lo + chunk, first + count)) for lo in range(first, first + count, chunk)]
+                stage_started = time.monotonic()
+                if pool:
+                    rows = sum(pool.imap_unordered(_run_chunk, jobs))
+                else:
+                    rows = sum(_run_chunk(job) for job in jobs)
+                elapsed = time.monotonic() - stage_started
+                rate = rows / elapsed if elapsed else 0
+                self.stdout.write(f"[generate] {stage}: {rows} rows in {elapsed:.1f}s ({rate:.0f} rows/s)")
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+
+        # explicit ids were written, so move the sequences past them
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), [Category, Product, User, Cart]):
+                cursor.execute(sql)
+        for alias in shards():
+            prepare_sequence(alias, restart=True)
+
+        self.stdout.write(f"[generate] done in {time.monotonic() - started:.1f}s, seed {options['seed']}")
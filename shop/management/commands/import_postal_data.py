@@ -0,0 +1,58 @@
+import csv
+import json
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.postal import DEFAULT_DATA, PostalIndex, write_rows
+
+# column names of the widely used open datasets ({"district" (ตำบล/แขวง),
+# "amphoe" (อำเภอ/เขต), "province", "zipcode"}) or our own, first match wins
+COLUMNS = {
+    'postal_code': ('postal_code', 'zipcode', 'zip', 'postcode'),
+    'subdistrict': ('subdistrict', 'tambon', 'district'),
+    'district': ('amphoe', 'amphur', 'district'),
+    'province': ('province', 'changwat'),
+}
+
+
+def _column(record, field):
+    for name in COLUMNS[field]:
+        if name in record:
+            return str(record[name]).strip()
+    raise CommandError(f"no {field} column, expected one of {', '.join(COLUMNS[field])}")
+
+
+class Command(BaseCommand):
+    help = "Convert a Thai postal dataset (JSON list or CSV of subdistricts) into the file the address autocomplete loads"
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', help="a .json list of records or a .csv file with a header row")
+        parser.add_argument('--output', default=None, help="where to write (default: POSTAL_DATA)")
+
+    def handle(self, *args, **options):
+        source = Path(options['source'])
+        output = Path(options['output'] or getattr(settings, 'POSTAL_DATA', DEFAULT_DATA))
+        with source.open(encoding='utf-8-sig', newline='') as data:
+            records = json.load(data) if source.suffix == '.json' else list(csv.DictReader(data))
+
+        rows = []
+        skipped = 0
+        for record in records:
+            row = tuple(_column(record, field) for field in ('postal_code', 'subdistrict', 'district', 'province'))
+            if len(row[0]) != 5 or not row[0].isdigit() or not row[2] or not row[3]:
+                skipped += 1
+                continue
+            rows.append(row)
+        if not rows:
+            raise CommandError(f"no usable rows in {source}")
+
+        # the index must build from it, or every worker would fail on its first lookup
+        index = PostalIndex(rows)
+        write_rows(output, rows)
+        self.stdout.write(
+            f"[postal] wrote {len(index)} rows ({len(index.provinces.names)} provinces, "
+            f"{len(index.districts.names)} district names, {len(set(index.codes))} postal codes) to {output}"
+            + (f", skipped {skipped} incomplete" if skipped else "")
+        )
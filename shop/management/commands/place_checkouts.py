@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop.orders import place_pending_checkouts
+
+
+class Command(BaseCommand):
+    help = "Place the orders of confirmed checkouts whose request failed before writing them to their shard"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=float, default=60, help="seconds a checkout is left to its own request")
+        parser.add_argument('--keep-days', type=int, default=7, help="days placed checkouts are kept to turn away resubmitted forms")
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--loop', action='store_true', help="run every --interval seconds")
+        parser.add_argument('--interval', type=float, default=60)
+
+    def handle(self, *args, **options):
+        while True:
+            placed, waiting, deleted = place_pending_checkouts(options['older_than'], options['keep_days'], options['batch_size'])
+            self.stdout.write(f"[checkouts] placed {placed} orders, {waiting} waiting on a shard move, deleted {deleted} old checkouts")
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,42 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop.payments import process_events
+
+
+class Command(BaseCommand):
+    help = "Apply queued payment provider callbacks in batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--loop', action='store_true', help="keep polling for new events")
+        parser.add_argument('--idle-sleep', type=float, default=1.0)
+        parser.add_argument('--report-every', type=float, default=60, help="seconds between throughput lines with --loop")
+
+    def handle(self, *args, **options):
+        events_since = changed_since = 0
+        since = time.monotonic()
+        while True:
+            events, changed = process_events(options['batch_size'])
+            events_since += events
+            changed_since += changed
+            if options['loop'] and time.monotonic() - since >= options['report_every']:
+                self.report(events_since, changed_since, since)
+                events_since = changed_since = 0
+                since = time.monotonic()
+            if events:
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['idle_sleep'])
+        self.report(events_since, changed_since, since)
+
+    def report(self, events, changed, since):
+        elapsed = time.monotonic() - since
+        rate = events / elapsed if elapsed else 0
+        self.stdout.write(
+            f"[payments] applied {events} events, {changed} payments updated "
+            f"in {elapsed:.2f}s ({rate:.0f} events/s)"
+        )
+        self.stdout.flush()
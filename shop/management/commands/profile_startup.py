@@ -0,0 +1,123 @@
+import json
+import os
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+PHASE_MARK = '@@phase '
+
+# runs in a fresh interpreter under -X importtime, so every import is cold
+CHILD = r'''
+import json, sys, time
+from wsgiref.util import setup_testing_defaults
+
+def mark(phase, started):
+    timings[phase] = time.perf_counter() - started
+    sys.stderr.write(f"@@phase {phase}\n")
+    sys.stderr.flush()
+
+def fetch(app, path):
+    environ = {'PATH_INFO': path, 'HTTP_HOST': 'localhost', 'SERVER_NAME': 'localhost'}
+    setup_testing_defaults(environ)
+    status = []
+    body = app(environ, lambda code, headers, exc_info=None: status.append(code))
+    size = sum(len(chunk) for chunk in body)
+    getattr(body, 'close', lambda: None)()
+    return status[0], size
+
+paths, warm = json.loads(sys.argv[1]), sys.argv[2] == '1'
+timings, responses = {}, []
+
+started = time.perf_counter()
+import django
+django.setup()
+mark('setup', started)
+
+started = time.perf_counter()
+from django.core.wsgi import get_wsgi_application
+app = get_wsgi_application()
+mark('application', started)
+
+if warm:
+    started = time.perf_counter()
+    from shop.startup import warm_up
+    warm_up()
+    mark('warm_up', started)
+
+first_response = None
+for path in paths:
+    started = time.perf_counter()
+    status, size = fetch(app, path)
+    mark(f'first {path}', started)
+    responses.append([path, status, size])
+    if first_response is None:
+        first_response = time.time()
+
+started = time.perf_counter()
+fetch(app, paths[0])
+mark(f'again {paths[0]}', started)
+
+print(json.dumps({'timings': timings, 'responses': responses, 'first_response': first_response}))
+'''
+
+
+def parse_importtime(stderr):
+    """Split ``-X importtime`` output into ``{phase: [(module, self_us, cumulative_us)]}``."""
+    phases = defaultdict(list)
+    current = []
+    for line in stderr.splitlines():
+        if line.startswith(PHASE_MARK):
+            phases[line[len(PHASE_MARK):]] = current
+            current = []
+        elif line.startswith('import time:') and '|' in line:
+            own, cumulative, name = line[len('import time:'):].split('|', 2)
+            if own.strip().isdigit():
+                current.append((name.strip(), int(own), int(cumulative)))
+    return phases
+
+
+class Command(BaseCommand):
+    help = "Start the app in a fresh interpreter and report import time per module and time to first response"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', action='append', dest='paths', help="URL to request, can be repeated (default /products/)")
+        parser.add_argument('--top', type=int, default=15, help="modules to list per phase")
+        parser.add_argument('--warm-up', action='store_true', help="run the WARM_UP_ON_START warm-up before the first request")
+
+    def handle(self, *args, **options):
+        paths = options['paths'] or ['/products/']
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings.SETTINGS_MODULE)
+        env['PYTHONPATH'] = os.pathsep.join(filter(None, [str(settings.BASE_DIR), env.get('PYTHONPATH')]))
+
+        launched = time.time()
+        child = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', CHILD, json.dumps(paths), '1' if options['warm_up'] else '0'],
+            capture_output=True, text=True, env=env, cwd=settings.BASE_DIR,
+        )
+        if child.returncode:
+            raise CommandError(f"startup failed:\n{child.stderr[-4000:]}")
+        result = json.loads(child.stdout.strip().splitlines()[-1])
+        phases = parse_importtime(child.stderr)
+
+        for path, status, size in result['responses']:
+            self.stdout.write(f"[startup] {path} -> {status}, {size} bytes")
+        self.stdout.write(f"[startup] time to first response {result['first_response'] - launched:.3f}s (includes interpreter start)")
+        top = options['top']
+        for phase, seconds in result['timings'].items():
+            modules = phases.get(phase, [])
+            imported = sum(own for _, own, _ in modules) / 1e6
+            self.stdout.write(f"[startup] {phase}: {seconds * 1000:.1f}ms, {len(modules)} modules imported in {imported * 1000:.1f}ms")
+            for name, own, cumulative in sorted(modules, key=lambda row: -row[2])[:top]:
+                self.stdout.write(f"[startup]     {cumulative / 1000:8.1f}ms cumulative {own / 1000:7.1f}ms self  {name}")
+
+        by_package = defaultdict(int)
+        for modules in phases.values():
+            for name, own, _ in modules:
+                by_package[name.split('.')[0]] += own
+        self.stdout.write("[startup] import time per top-level package:")
+        for package, own in sorted(by_package.items(), key=lambda item: -item[1])[:top]:
+            self.stdout.write(f"[startup]     {own / 1000:8.1f}ms  {package}")
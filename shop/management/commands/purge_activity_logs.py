@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop.retention import expired_logs, purge_activity_logs
+
+
+class Command(BaseCommand):
+    help = "Delete activity logs older than ACTIVITY_LOG_RETENTION_DAYS in small batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--sleep', type=float, default=0.1, help="seconds to pause between batches")
+        parser.add_argument('--dry-run', action='store_true', help="only count what would be deleted")
+        parser.add_argument('--loop', action='store_true', help="keep purging every --interval seconds")
+        parser.add_argument('--interval', type=float, default=3600)
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.monotonic()
+            if options['dry_run']:
+                counts = {rule: logs.count() for rule, logs in expired_logs()}
+                verb = 'would delete'
+            else:
+                counts = purge_activity_logs(options['batch_size'], options['sleep'])
+                verb = 'deleted'
+            summary = ', '.join(f"{rule}: {count}" for rule, count in counts.items())
+            self.stdout.write(f"[retention] {verb} {sum(counts.values())} logs ({summary}) in {time.monotonic() - started:.2f}s")
+            if not options['loop'] or options['dry_run']:
+                break
+            time.sleep(options['interval'])
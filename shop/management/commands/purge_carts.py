@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop.retention import idle_carts, purge_carts
+
+
+class Command(BaseCommand):
+    help = "Delete carts idle beyond CART_IDLE_DAYS (EMPTY_CART_IDLE_DAYS for empty ones) in small batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--sleep', type=float, default=0.1, help="seconds to pause between batches")
+        parser.add_argument('--limit', type=int, default=None, help="stop after this many carts; the next run carries on")
+        parser.add_argument('--dry-run', action='store_true', help="only count what would be deleted")
+        parser.add_argument('--loop', action='store_true', help="keep purging every --interval seconds")
+        parser.add_argument('--interval', type=float, default=3600)
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.monotonic()
+            if options['dry_run']:
+                counts = {rule: carts.count() for rule, carts in idle_carts()}
+                summary = ', '.join(f"{rule}: {count}" for rule, count in counts.items())
+                self.stdout.write(f"[carts] would delete {sum(counts.values())} carts ({summary})")
+                break
+            deleted = purge_carts(options['batch_size'], options['sleep'], limit=options['limit'], progress=self.progress)
+            summary = ', '.join(f"{rule}: {carts} carts, {items} items" for rule, (carts, items) in deleted.items())
+            self.stdout.write(f"[carts] done in {time.monotonic() - started:.2f}s ({summary})")
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+    def progress(self, rule, carts, items, reached):
+        self.stdout.write(f"[carts] {rule}: {carts} carts, {items} items deleted, idle since {reached:%Y-%m-%d %H:%M}")
+        self.stdout.flush()
@@ -0,0 +1,92 @@
+import time
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.models import Order, ShardBucket
+from shop.sharding import (
+    bucket_count, bucket_map, drop_rows, misplaced, move_buckets, placement, plan_moves, shards,
+)
+
+
+class Command(BaseCommand):
+    help = "Show how orders are spread over ORDER_SHARDS and move buckets of users between shards to even them out"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="only show the spread and the planned moves")
+        parser.add_argument('--limit', type=int, default=None, help="move at most this many buckets")
+        parser.add_argument('--bucket', type=int, help="move this one bucket (with --to) instead of planning")
+        parser.add_argument('--to', help="shard to move --bucket to")
+        parser.add_argument('--wait', type=float, default=None,
+                            help="seconds for every process to see a map change (default: ORDER_SHARD_MAP_TTL + 1)")
+        parser.add_argument('--batch-size', type=int, default=1000, help="orders copied per query")
+        parser.add_argument('--release', action='store_true',
+                            help="clear buckets left marked moving by an interrupted run; only while no other run is active")
+
+    def handle(self, *args, **options):
+        aliases = shards()
+        if options['bucket'] is not None and options['to'] not in aliases:
+            raise CommandError(f"--bucket needs --to, one of {', '.join(aliases)}")
+        if options['bucket'] is not None and not 0 <= options['bucket'] < bucket_count():
+            raise CommandError(f"buckets are 0 to {bucket_count() - 1}")
+
+        stuck = list(ShardBucket.objects.filter(moving=True).values_list('bucket', flat=True))
+        if stuck and not options['release']:
+            raise CommandError(
+                f"buckets {', '.join(map(str, stuck))} are marked moving: another run is active or was "
+                f"interrupted. Once none is running, rerun with --release"
+            )
+        if stuck and not options['dry_run']:
+            # the source still has every row; copies on the target are dropped below
+            ShardBucket.objects.filter(bucket__in=stuck).update(moving=False)
+            self.stdout.write(f"[shards] released {len(stuck)} buckets")
+        bucket_map.refresh(force=True)
+
+        sizes = placement()
+        self.status(sizes)
+        self.clean_up(options['dry_run'])
+
+        if options['bucket'] is not None:
+            source = bucket_map.shard_of(options['bucket'])
+            moves = [] if source == options['to'] else [(options['bucket'], source, options['to'])]
+        else:
+            moves = plan_moves(sizes, options['limit'])
+        if not moves:
+            self.stdout.write("[shards] nothing to move")
+            return
+        orders = sum(sizes[source].get(bucket, 0) for bucket, source, _ in moves)
+        routes = Counter((source, target) for _, source, target in moves)
+        for (source, target), count in sorted(routes.items()):
+            self.stdout.write(f"[shards] plan: {count} buckets {source} -> {target}")
+        self.stdout.write(f"[shards] plan: {len(moves)} buckets, {orders} orders")
+        if options['dry_run']:
+            return
+
+        started = time.monotonic()
+        moved = move_buckets(
+            moves, options['wait'], options['batch_size'], log=lambda message: self.stdout.write(f"[shards] {message}"),
+        )
+        self.stdout.write(f"[shards] moved {len(moves)} buckets, {moved} orders in {time.monotonic() - started:.1f}s")
+        self.status(placement())
+
+    def status(self, sizes):
+        buckets = Counter(bucket_map.shard_of(bucket) for bucket in range(bucket_count()))
+        for alias in shards():
+            self.stdout.write(f"[shards] {alias}: {sum(sizes[alias].values())} orders, {buckets[alias]} buckets")
+
+    def clean_up(self, dry_run):
+        """Drop rows a finished or interrupted move left behind on a shard their bucket is no longer on."""
+        for alias, buckets in misplaced().items():
+            for bucket, ids in buckets.items():
+                home = bucket_map.shard_of(bucket)
+                copied = list(Order.objects.using(home).filter(id__in=ids).values_list('id', flat=True))
+                only_here = len(ids) - len(copied)
+                if copied and not dry_run:
+                    drop_rows(alias, copied)
+                verb = 'would drop' if dry_run else 'dropped'
+                self.stdout.write(f"[shards] bucket {bucket}: {verb} {len(copied)} stale copies on {alias} (now on {home})")
+                if only_here:
+                    # written by a process that had yet to see the move: left alone for someone to look at
+                    self.stdout.write(
+                        self.style.WARNING(f"[shards] bucket {bucket}: {only_here} orders exist only on {alias}, not on {home}")
+                    )
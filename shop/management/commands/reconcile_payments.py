@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop.payments import reconcile
+
+
+class Command(BaseCommand):
+    help = "Compare pending payments with the payment provider and fix divergence"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--loop', action='store_true', help="run every --interval seconds")
+        parser.add_argument('--interval', type=float, default=300)
+
+    def handle(self, *args, **options):
+        while True:
+            checked, fixed = reconcile(batch_size=options['batch_size'])
+            self.stdout.write(f"[payments] reconciled {checked} pending payments, fixed {fixed}")
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
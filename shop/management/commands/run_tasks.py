@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop import tasks  # noqa: F401  (registers the task functions)
+from shop.task_queue import run_batch
+
+
+class Command(BaseCommand):
+    help = "Run queued background tasks (receipts, stock alerts, activity logging)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--loop', action='store_true', help="keep polling for new tasks")
+        parser.add_argument('--idle-sleep', type=float, default=1.0)
+
+    def handle(self, *args, **options):
+        total = failed = 0
+        started = time.monotonic()
+        while True:
+            ran, errors = run_batch(options['batch_size'])
+            total += ran
+            failed += errors
+            if ran:
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['idle_sleep'])
+
+        elapsed = time.monotonic() - started
+        rate = total / elapsed if elapsed else 0
+        self.stdout.write(f"[tasks] ran {total} tasks ({failed} failed) in {elapsed:.2f}s ({rate:.0f} tasks/s)")
@@ -0,0 +1,89 @@
+import gc
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.wsgi import get_wsgi_application
+
+from shop.postal import postal
+from shop.prefork import Arbiter
+from shop.startup import warm_up
+
+
+class Command(BaseCommand):
+    help = "Serve the site with a pre-forking WSGI server that preloads the app once and shares it with every worker"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bind', default='127.0.0.1:8000', help="host:port to listen on")
+        parser.add_argument('--workers', type=int, default=(os.cpu_count() or 1) * 2 + 1)
+        parser.add_argument('--max-requests', type=int, default=1000, help="recycle a worker after this many requests, 0 to never")
+        parser.add_argument('--max-requests-jitter', type=int, default=100, help="random extra requests so workers do not recycle together")
+        parser.add_argument('--graceful-timeout', type=float, default=30)
+        parser.add_argument('--stats-interval', type=float, default=0, help="print the memory report every N seconds")
+        parser.add_argument('--access-log', action='store_true')
+        parser.add_argument('--no-preload', action='store_true', help="let every worker load the app on its own, before it accepts requests")
+        parser.add_argument('--lazy-autocomplete', action='store_true', help="leave the search index to each worker's first search instead of building it in the master")
+
+    def handle(self, *args, **options):
+        host, _, port = options['bind'].rpartition(':')
+        if not port.isdigit():
+            raise CommandError("--bind must look like host:port")
+
+        preload = not options['no_preload']
+        started = time.monotonic()
+        if preload:
+            # no collections while loading, so the heap is laid out without
+            # holes that later frees would dirty after the fork
+            gc.disable()
+            app = get_wsgi_application()
+            self.preload(options)
+            self.stdout.write(f"[serve] preloaded the app in {time.monotonic() - started:.2f}s")
+        else:
+            app = LazyApplication()
+
+        Arbiter(
+            app,
+            (host or '127.0.0.1', int(port)),
+            workers=options['workers'],
+            max_requests=options['max_requests'],
+            max_requests_jitter=options['max_requests_jitter'],
+            graceful_timeout=options['graceful_timeout'],
+            stats_interval=options['stats_interval'],
+            access_log=options['access_log'],
+            freeze=preload,
+            post_fork=None if preload else app.load,
+            log=self.log,
+        ).run()
+
+    def log(self, message):
+        self.stdout.write(message)
+        self.stdout.flush()
+
+    def preload(self, options):
+        # imports every routed view (shop.views, shop.forms and what they use)
+        # and compiles every template
+        warm_up()
+        # the postal index needs no database, so every worker shares the master's copy
+        postal.load()
+        # built once here: workers share the copy and keep it current through its overlay
+        if not options['lazy_autocomplete']:
+            from shop.autocomplete import autocomplete
+            autocomplete.rebuild()
+
+
+class LazyApplication:
+    """WSGI app built inside each worker, warmed up if WARM_UP_ON_START is set."""
+
+    def __init__(self):
+        self.app = None
+
+    def load(self):
+        if self.app is None:
+            self.app = get_wsgi_application()
+            if getattr(settings, 'WARM_UP_ON_START', False):
+                warm_up()
+        return self.app
+
+    def __call__(self, environ, start_response):
+        return self.load()(environ, start_response)
@@ -0,0 +1,99 @@
+import statistics
+import threading
+import time
+import uuid
+from collections import Counter
+from multiprocessing import Pool
+
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+
+
+def _hammer(job):
+    """Call get_or_set() on one hot key from ``threads`` threads until ``until``; returns timings."""
+    alias, key, threads, until, compute, timeout = job
+    computes, latencies = [], []
+    lock = threading.Lock()
+
+    def recompute():
+        started = time.time()
+        # stands in for the query or render the cached value saves
+        time.sleep(compute)
+        with lock:
+            computes.append((started, time.time()))
+        return started
+
+    def loop():
+        cache = caches[alias]
+        mine = []
+        while time.time() < until:
+            started = time.perf_counter()
+            cache.get_or_set(key, recompute, timeout)
+            mine.append(time.perf_counter() - started)
+        with lock:
+            latencies.extend(mine)
+
+    workers = [threading.Thread(target=loop) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    stats = getattr(caches[alias], 'stats', None)
+    return {'computes': computes, 'latencies': latencies, 'stats': stats() if stats else {}}
+
+
+def _overlap(intervals):
+    """Most intervals running at the same moment."""
+    points = sorted([(start, 1) for start, _ in intervals] + [(end, -1) for _, end in intervals])
+    running = peak = 0
+    for _, step in points:
+        running += step
+        peak = max(peak, running)
+    return peak
+
+
+class Command(BaseCommand):
+    help = "Hit one hot, slow-to-compute key from many processes and threads and count how often it is recomputed"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--alias', action='append', dest='aliases',
+                            help="cache alias to test, can be repeated (default: default and shared)")
+        parser.add_argument('--workers', type=int, default=4, help="processes")
+        parser.add_argument('--threads', type=int, default=8, help="threads per process")
+        parser.add_argument('--seconds', type=float, default=10.0)
+        parser.add_argument('--compute', type=float, default=0.2, help="seconds one recomputation takes")
+        parser.add_argument('--timeout', type=int, default=5, help="cache timeout of the hot key")
+
+    def handle(self, *args, **options):
+        aliases = options['aliases'] or ['default', 'shared']
+        for alias in aliases:
+            if alias not in caches:
+                raise CommandError(f"unknown cache alias {alias!r}")
+        for alias in aliases:
+            self.run(alias, options)
+
+    def run(self, alias, options):
+        key = f'stress:{uuid.uuid4().hex[:8]}'
+        backend = type(caches[alias])
+        until = time.time() + 0.5 + options['seconds']
+        jobs = [(alias, key, options['threads'], until, options['compute'], options['timeout'])] * options['workers']
+        with Pool(options['workers']) as pool:
+            results = pool.map(_hammer, jobs)
+        caches[alias].delete(key)
+
+        computes = [interval for result in results for interval in result['computes']]
+        latencies = sorted(latency for result in results for latency in result['latencies'])
+        stats = sum((Counter(result['stats']) for result in results), Counter())
+        expiries = options['seconds'] / options['timeout']
+        self.stdout.write(f"[cache] {alias} ({backend.__module__}.{backend.__name__}), "
+                          f"{options['workers']} processes x {options['threads']} threads, {options['seconds']:.0f}s")
+        self.stdout.write(
+            f"[cache]     {len(latencies)} calls, {len(computes)} recomputes for about {expiries:.0f} expiries, "
+            f"at most {_overlap(computes)} at once"
+        )
+        self.stdout.write(
+            f"[cache]     latency p50 {statistics.median(latencies) * 1000:.2f}ms, "
+            f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.2f}ms, max {latencies[-1] * 1000:.1f}ms"
+        )
+        if stats:
+            self.stdout.write("[cache]     " + ", ".join(f"{name} {stats[name]}" for name in stats if name != 'local_entries'))
@@ -0,0 +1,285 @@
+import random
+import statistics
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Pool
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.db.models import Sum
+from django.test import Client
+from django.urls import reverse
+
+from shop.models import User, Product, Cart, CartItem, Checkout, Order, OrderItem, Task
+from shop.orders import place_order
+from shop.session_store import pack_checkout_info
+from shop.sharding import each_shard
+from shop.tasks import render_order_receipt, log_order_activity, alert_low_stock
+
+CHECKOUT = {'receiver_name': 'Stress Test', 'phone': '0800000000', 'address_line': '1 Rama I Rd', 'city': 'ปทุมวัน', 'province': 'กรุงเทพมหานคร', 'postal_code': '10330', 'payment_method': 'transfer'}
+WRITES = ('INSERT', 'UPDATE', 'DELETE')
+
+
+def classify(exc):
+    """Bucket a database error: deadlock, serialization, lock_timeout or its class name."""
+    cause = exc.__cause__ or exc
+    code = getattr(getattr(cause, 'diag', None), 'sqlstate', None) or getattr(cause, 'sqlstate', None)
+    text = str(exc).lower()
+    if code == '40P01' or 'deadlock' in text:
+        return 'deadlock'
+    if code == '40001' or 'could not serialize' in text:
+        return 'serialization'
+    if code == '55P03' or 'database is locked' in text or 'lock timeout' in text:
+        return 'lock_timeout'
+    return type(exc).__name__
+
+
+class StatementStats:
+    """
+    Execute wrapper timing writes and locking reads, which is where a
+    checkout waits for other checkouts, and counting failed statements.
+    """
+
+    def __init__(self):
+        self.locking_time = 0.0
+        self.slowest = 0.0
+        self.errors = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        except Exception as exc:
+            self.errors[classify(exc)] += 1
+            raise
+        finally:
+            if sql.lstrip()[:6].upper() in WRITES or 'FOR UPDATE' in sql.upper():
+                elapsed = time.perf_counter() - started
+                self.locking_time += elapsed
+                self.slowest = max(self.slowest, elapsed)
+
+
+def _confirm_orders(job):
+    """Log in every user of ``job``, wait for the common start time, then confirm their orders."""
+    user_ids, start_at = job
+    # forked workers and new threads each need their own connection
+    connections.close_all()
+    clients = []
+    for user in User.objects.filter(id__in=user_ids):
+        client = Client(HTTP_HOST='localhost')
+        client.force_login(user)
+        session = client.session
+        session['checkout_info'] = pack_checkout_info(CHECKOUT)
+        session.save()
+        clients.append(client)
+
+    success_url = reverse('shop:product_list')
+    # stock taken, the order left to `manage.py place_checkouts`
+    pending_url = reverse('shop:my_orders')
+    stats = StatementStats()
+    latencies, outcomes = [], Counter()
+    time.sleep(max(0.0, start_at - time.time()))
+    with connection.execute_wrapper(stats):
+        for client in clients:
+            started = time.perf_counter()
+            response = client.post(reverse('shop:confirm_order'), {'action': 'pay_later'})
+            latencies.append(time.perf_counter() - started)
+            location = response['Location'] if response.status_code == 302 else None
+            outcomes['confirmed' if location == success_url else 'pending' if location == pending_url else 'failed'] += 1
+    finished = time.time()
+    connections.close_all()
+    return {
+        'latencies': latencies,
+        'outcomes': outcomes,
+        'errors': stats.errors,
+        'locking_time': stats.locking_time,
+        'slowest': stats.slowest,
+        'finished': finished,
+    }
+
+
+class LockSampler:
+    """Samples how many PostgreSQL backends wait on a lock; count x interval estimates total lock wait."""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.waited = 0.0
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        with connection.cursor() as cursor:
+            while not self._stop.is_set():
+                cursor.execute(
+                    "SELECT count(*) FROM pg_stat_activity WHERE datname = current_database() AND wait_event_type = 'Lock'"
+                )
+                waiting = cursor.fetchone()[0]
+                self.waited += waiting * self.interval
+                self.peak = max(self.peak, waiting)
+                time.sleep(self.interval)
+        connection.close()
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def _deadlocks():
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT deadlocks FROM pg_stat_database WHERE datname = current_database()")
+        return cursor.fetchone()[0]
+
+
+class Command(BaseCommand):
+    help = "Confirm many carts on the same hot products at once and report throughput, lock waits, deadlocks and oversold stock"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--products', type=int, default=5, help="hot products shared by every cart")
+        parser.add_argument('--stock', type=int, default=100, help="initial stock per hot product")
+        parser.add_argument('--items', type=int, default=2, help="hot products per cart")
+        parser.add_argument('--max-quantity', type=int, default=3)
+        parser.add_argument('--workers', type=int, default=8, help="concurrent checkouts")
+        parser.add_argument('--threads', action='store_true', help="run the workers as threads instead of processes")
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument('--keep', action='store_true', help="leave the generated users, products and orders in place")
+        parser.add_argument('--strict', action='store_true', help="exit with an error if stock was oversold")
+
+    def handle(self, *args, **options):
+        if options['items'] > options['products']:
+            raise CommandError("--items cannot exceed --products")
+        vendor = connection.vendor
+        self.stdout.write(f"[stress] {vendor} database, {options['users']} users, {options['products']} hot products, "
+                          f"{options['workers']} {'threads' if options['threads'] else 'processes'}")
+
+        run = uuid.uuid4().hex[:8]
+        products, users = self.seed(run, options)
+        try:
+            self.fire(products, users, options, vendor)
+            oversold = self.verify(products, users, options['stock'])
+        finally:
+            if not options['keep']:
+                self.cleanup(products, users)
+        if oversold and options['strict']:
+            raise CommandError(f"{oversold} units sold beyond the initial stock")
+
+    def seed(self, run, options):
+        rng = random.Random(options['seed'])
+        products = Product.objects.bulk_create([
+            Product(name=f'stress {run} hot {i}', price=100, stock=options['stock'])
+            for i in range(options['products'])
+        ])
+        users = User.objects.bulk_create([
+            User(username=f'stress-{run}-{i}', password='!') for i in range(options['users'])
+        ])
+        carts = Cart.objects.bulk_create([Cart(user=user) for user in users])
+        CartItem.objects.bulk_create([
+            CartItem(cart=cart, product=product, quantity=rng.randint(1, options['max_quantity']))
+            for cart in carts
+            for product in rng.sample(products, options['items'])
+        ])
+        demand = CartItem.objects.filter(cart__in=carts).aggregate(units=Sum('quantity'))['units']
+        self.stdout.write(f"[stress] demand {demand} units against {options['stock'] * len(products)} in stock")
+        return products, users
+
+    def fire(self, products, users, options, vendor):
+        workers = options['workers']
+        ids = [user.id for user in users]
+        # every worker is logged in and waiting before the first order goes out
+        start_at = time.time() + 1 + len(ids) * 0.005
+        jobs = [(ids[i::workers], start_at) for i in range(workers)]
+
+        deadlocks_before = _deadlocks() if vendor == 'postgresql' else None
+        sampler = LockSampler() if vendor == 'postgresql' else None
+        connections.close_all()
+        if sampler:
+            sampler.__enter__()
+        try:
+            if options['threads']:
+                with ThreadPoolExecutor(workers) as pool:
+                    results = list(pool.map(_confirm_orders, jobs))
+            else:
+                with Pool(workers) as pool:
+                    results = pool.map(_confirm_orders, jobs)
+        finally:
+            if sampler:
+                sampler.__exit__()
+
+        elapsed = max(result['finished'] for result in results) - start_at
+        latencies = sorted(latency for result in results for latency in result['latencies'])
+        outcomes = sum((result['outcomes'] for result in results), Counter())
+        errors = sum((result['errors'] for result in results), Counter())
+        locking = sum(result['locking_time'] for result in results)
+        slowest = max(result['slowest'] for result in results)
+
+        self.stdout.write(
+            f"[stress] {outcomes['confirmed']} orders confirmed, {outcomes['pending']} left to place_checkouts, "
+            f"{outcomes['failed']} failed in {elapsed:.2f}s "
+            f"({outcomes['confirmed'] / elapsed:.1f} orders/s)"
+        )
+        self.stdout.write(
+            f"[stress] latency p50 {statistics.median(latencies) * 1000:.1f}ms, "
+            f"p95 {latencies[int(len(latencies) * 0.95)] * 1000:.1f}ms, max {latencies[-1] * 1000:.1f}ms"
+        )
+        self.stdout.write(f"[stress] time in writes and locking reads {locking:.2f}s, slowest statement {slowest * 1000:.1f}ms")
+        if sampler:
+            self.stdout.write(
+                f"[stress] lock wait {sampler.waited:.2f}s (sampled), at most {sampler.peak} backends waiting, "
+                f"{_deadlocks() - deadlocks_before} deadlocks"
+            )
+        summary = ', '.join(f"{kind}: {count}" for kind, count in errors.most_common()) or 'none'
+        self.stdout.write(f"[stress] database errors: {summary}")
+
+    def verify(self, products, users, initial):
+        """Units sold must not exceed the initial stock, and stock must drop by exactly what was sold."""
+        # what `manage.py place_checkouts` would do with checkouts whose order failed
+        pending = list(Checkout.objects.filter(user__in=users, order_id__isnull=True))
+        for checkout in pending:
+            place_order(checkout)
+        if pending:
+            self.stdout.write(f"[stress] placed {len(pending)} orders left by failed requests")
+        sold = Counter()
+        for items in each_shard(OrderItem.objects.filter(order__user__in=users, product__in=products)):
+            sold.update(dict(items.values_list('product').annotate(units=Sum('quantity'))))
+        total_oversold = 0
+        for product in Product.objects.filter(id__in=[product.id for product in products]).order_by('id'):
+            units = sold.get(product.id, 0)
+            oversold = max(0, units - initial)
+            # units that left the shelf without the stock column noticing
+            unaccounted = units - (initial - product.stock)
+            total_oversold += oversold
+            status = 'OK' if not oversold and not unaccounted else 'VIOLATED'
+            self.stdout.write(
+                f"[stress] {status} product {product.id}: stock {initial} -> {product.stock}, sold {units}, "
+                f"oversold {oversold}, sold but not deducted {unaccounted}"
+            )
+        return total_oversold
+
+    def cleanup(self, products, users):
+        user_ids = {user.id for user in users}
+        orders = list(each_shard(Order.objects.filter(user__in=users)))
+        order_ids = {pk for shard_orders in orders for pk in shard_orders.values_list('id', flat=True)}
+        # side effects the confirmed orders queued for the task worker
+        queued_by_run = {
+            render_order_receipt.task_name: lambda args: args[0] in order_ids,
+            log_order_activity.task_name: lambda args: args[0] in user_ids,
+            alert_low_stock.task_name: lambda args: args[1] in user_ids,
+        }
+        stale = [
+            job.id for job in Task.objects.filter(status='pending', name__in=queued_by_run)
+            if queued_by_run[job.name](job.args)
+        ]
+        Task.objects.filter(id__in=stale).delete()
+        Checkout.objects.filter(user__in=user_ids).delete()
+        for shard_orders in orders:
+            shard_orders.delete()
+        User.objects.filter(id__in=user_ids).delete()
+        Product.objects.filter(id__in=[product.id for product in products]).delete()
@@ -0,0 +1,241 @@
+import asyncio
+import json
+import os
+import statistics
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client
+from django.urls import reverse
+from django.utils.module_loading import import_string
+
+from shop.live import broadcaster
+from shop.models import ActivityLog, Order, User
+from shop.orders import bulk_transition
+from shop.prefork import memory_stats
+from shop.sharding import orders_of
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class Tab:
+    """
+    One admin page holding the live feed open, talking to the ASGI app
+    directly. A stalled tab stops reading after the first chunk, like a
+    browser tab whose connection has frozen.
+    """
+
+    def __init__(self, number, cookie, stalled=False):
+        self.number = number
+        self.cookie = cookie
+        self.stalled = stalled
+        self.status = None
+        self.received = {}
+        self.buffer = b''
+        self.requested = False
+        self.ready = asyncio.Event()
+        self.gone = asyncio.Event()
+
+    def scope(self):
+        path = reverse('shop:admin_live_feed')
+        return {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': 'GET',
+            'scheme': 'http',
+            'path': path,
+            'raw_path': path.encode(),
+            'query_string': b'',
+            'root_path': '',
+            'headers': [
+                (b'host', b'localhost'),
+                (b'accept', b'text/event-stream'),
+                (b'cookie', self.cookie.encode()),
+            ],
+            'client': ('127.0.0.1', 10000 + self.number),
+            'server': ('localhost', 80),
+        }
+
+    async def receive(self):
+        if not self.requested:
+            self.requested = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await self.gone.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(self, message):
+        if message['type'] == 'http.response.start':
+            self.status = message['status']
+            return
+        if self.stalled and self.ready.is_set():
+            await self.gone.wait()
+            return
+        arrived = time.perf_counter()
+        self.buffer += message.get('body', b'')
+        *frames, self.buffer = self.buffer.split(b'\n\n')
+        for chunk in frames:
+            self.parse(chunk.decode(), arrived)
+        self.ready.set()
+
+    def parse(self, chunk, arrived):
+        fields = dict(line.split(': ', 1) for line in chunk.splitlines() if ': ' in line and not line.startswith(':'))
+        event = fields.get('event')
+        if event:
+            self.received.setdefault(message_key(event, json.loads(fields['data'])), arrived)
+
+    async def run(self, app):
+        await app(self.scope(), self.receive, self.send)
+        self.ready.set()
+
+
+def message_key(event, data):
+    if event == 'order':
+        return 'order', data['id'], data['status']
+    if event in ('order_deleted', 'activity'):
+        return event, data['id']
+    return (event,)
+
+
+class Command(BaseCommand):
+    help = "Hold many admin pages on the live feed (ASGI, in process) and measure how fast order changes reach all of them"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tabs', type=int, default=500, help="connected admin pages")
+        parser.add_argument('--stalled', type=int, default=0, help="of those, pages that stop reading")
+        parser.add_argument('--orders', type=int, default=100, help="orders created, paid and deleted while the pages listen")
+        parser.add_argument('--interval', type=float, default=None, help="override LIVE_FEED_INTERVAL (seconds)")
+        parser.add_argument('--timeout', type=float, default=30.0, help="seconds to wait for each phase to reach every page")
+
+    def handle(self, *args, **options):
+        if options['stalled'] > options['tabs']:
+            raise CommandError("--stalled cannot exceed --tabs")
+        if options['interval'] is not None:
+            broadcaster.interval = options['interval']
+
+        run = uuid.uuid4().hex[:8]
+        admin = User.objects.create(username=f'live-{run}', password='!', role='admin')
+        client = Client(HTTP_HOST='localhost')
+        client.force_login(admin)
+        cookie = f"{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}"
+        self.stdout.write(
+            f"[live] {options['tabs']} tabs ({options['stalled']} stalled), {options['orders']} orders, "
+            f"poll every {broadcaster.interval}s"
+        )
+        try:
+            asyncio.run(self.run(admin, cookie, options))
+        finally:
+            connections.close_all()
+            orders_of(admin).delete()
+            admin.delete()
+
+    async def run(self, admin, cookie, options):
+        app = import_string(settings.ASGI_APPLICATION)
+        loop = asyncio.get_running_loop()
+        # the "other admins and shoppers": writes from their own thread and connection
+        writer = ThreadPoolExecutor(1)
+        queries = QueryCounter()
+        # installed on the broadcaster's own thread, whose connection the polls use
+        await loop.run_in_executor(broadcaster.executor, lambda: connection.execute_wrappers.append(queries))
+
+        before = memory_stats(os.getpid())
+        threads_before = threading.active_count()
+        started = time.perf_counter()
+        tabs = [Tab(i, cookie, stalled=i < options['stalled']) for i in range(options['tabs'])]
+        tasks = [asyncio.create_task(tab.run(app)) for tab in tabs]
+        await asyncio.gather(*(tab.ready.wait() for tab in tabs))
+        connected = time.perf_counter() - started
+        statuses = {tab.status for tab in tabs}
+        if statuses != {200}:
+            raise CommandError(f"live feed answered {sorted(statuses, key=str)}")
+        after = memory_stats(os.getpid())
+        self.stdout.write(
+            f"[live] {len(tabs)} tabs connected in {connected:.2f}s, {len(broadcaster.clients)} clients on the broadcaster, "
+            f"{threading.active_count() - threads_before} more threads"
+        )
+        if before and after:
+            self.stdout.write(f"[live] RSS {before['rss'] // 1024} -> {after['rss'] // 1024} MB "
+                              f"({(after['rss'] - before['rss']) / len(tabs):.1f} kB per tab)")
+
+        listening = [tab for tab in tabs if not tab.stalled]
+        polls_before, queries_before = broadcaster.polls, queries.count
+        phases_started = time.perf_counter()
+
+        def create():
+            written = {}
+            for i in range(options['orders']):
+                order = Order.objects.create(user=admin, total_price=100 + i, status='pending')
+                written['order', order.id, 'pending'] = time.perf_counter()
+            return written
+
+        def pay():
+            orders = orders_of(admin)
+            ids = list(orders.values_list('id', flat=True))
+            bulk_transition(orders, 'paid', admin)
+            now = time.perf_counter()
+            written = {('order', pk, 'paid'): now for pk in ids}
+            written.update({('activity', pk): now for pk in ActivityLog.objects.filter(user=admin).values_list('id', flat=True)})
+            return written
+
+        def delete():
+            orders = orders_of(admin)
+            ids = list(orders.values_list('id', flat=True))
+            orders.delete()
+            now = time.perf_counter()
+            return {('order_deleted', pk): now for pk in ids}
+
+        latencies = []
+        for name, write in (('create', create), ('pay', pay), ('delete', delete)):
+            written = await loop.run_in_executor(writer, write)
+            deadline = time.perf_counter() + options['timeout']
+            while time.perf_counter() < deadline:
+                if all(all(key in tab.received for key in written) for tab in listening):
+                    break
+                await asyncio.sleep(0.02)
+            missing = sum(1 for tab in listening for key in written if key not in tab.received)
+            phase = [tab.received[key] - at for tab in listening for key, at in written.items() if key in tab.received]
+            latencies += phase
+            reached = max(phase) if phase else 0.0
+            self.stdout.write(
+                f"[live] {name}: {len(written)} messages reached {len(listening)} tabs, last one after {reached * 1000:.0f}ms"
+                + (f", {missing} deliveries missing" if missing else "")
+            )
+        elapsed = time.perf_counter() - phases_started
+
+        dropped = sum(1 for client in broadcaster.clients if client.dropped)
+        polls = broadcaster.polls - polls_before
+        latencies.sort()
+        if latencies:
+            self.stdout.write(
+                f"[live] delivery latency p50 {statistics.median(latencies) * 1000:.0f}ms, "
+                f"p95 {latencies[int(len(latencies) * 0.95)] * 1000:.0f}ms, max {latencies[-1] * 1000:.0f}ms "
+                f"over {len(latencies)} deliveries"
+            )
+        self.stdout.write(
+            f"[live] broadcaster: {polls} polls, {queries.count - queries_before} queries in {elapsed:.1f}s "
+            f"for all tabs, {broadcaster.published} messages, {dropped} stalled tabs dropped"
+        )
+
+        for tab in tabs:
+            tab.gone.set()
+        await asyncio.wait_for(asyncio.gather(*tasks, return_exceptions=True), options['timeout'])
+        # the poller notices the last client leaving on its next round
+        await asyncio.sleep(broadcaster.interval * 2)
+        self.stdout.write(
+            f"[live] after disconnect: {len(broadcaster.clients)} clients, poller {'running' if broadcaster.task else 'stopped'}"
+        )
+        await loop.run_in_executor(broadcaster.executor, lambda: connection.execute_wrappers.remove(queries))
+        await loop.run_in_executor(writer, connections.close_all)
+        writer.shutdown()
@@ -0,0 +1,57 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop.changes import TOPICS, START, Consumer, feeds, latest, lag, position_of, read
+from shop.models import ChangeConsumer
+
+
+class Command(BaseCommand):
+    help = "Print the product, category, order and payment change feed, optionally as a named consumer with a stored offset"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--consumer', help="read and commit the offset of this consumer (created on first use)")
+        parser.add_argument('--topic', action='append', dest='topics', choices=sorted(TOPICS), help="can be repeated")
+        parser.add_argument('--from-start', action='store_true', help="without --consumer, start at the oldest event instead of now")
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--follow', action='store_true', help="keep waiting for new events")
+        parser.add_argument('--interval', type=float, default=1.0, help="seconds between polls with --follow")
+        parser.add_argument('--database', default='default', choices=feeds(),
+                            help="feed to read: every order shard has its own, with that shard's order and payment events")
+        parser.add_argument('--status', action='store_true', help="list consumers with their offsets and lag, then exit")
+
+    def handle(self, *args, **options):
+        if options['status']:
+            for offset in ChangeConsumer.objects.order_by('name'):
+                self.stdout.write(f"[changes] {offset.name}: at {offset.txid}:{offset.event_id}, {lag(offset)} behind, committed {offset.updated_at:%Y-%m-%d %H:%M:%S}")
+            return
+
+        using = options['database']
+        consumer = None
+        if options['consumer']:
+            consumer = Consumer(options['consumer'], options['topics'], options['batch_size'], using=using)
+        elif options['from_start']:
+            position = START
+        else:
+            position = latest(using)
+
+        while True:
+            if consumer:
+                events = consumer.poll()
+            else:
+                events = read(position, options['batch_size'], options['topics'], using)
+            for event in events:
+                self.stdout.write(
+                    f"[changes] {event.txid}:{event.id} {event.created_at:%Y-%m-%d %H:%M:%S} "
+                    f"{event.topic} {event.object_id} {event.operation}"
+                )
+            self.stdout.flush()
+            if consumer:
+                # only after the batch is out: a crash before this re-delivers it
+                consumer.commit(events)
+            elif events:
+                position = position_of(events[-1])
+            if len(events) < options['batch_size']:
+                if not options['follow']:
+                    break
+                time.sleep(options['interval'])
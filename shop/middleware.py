@@ -0,0 +1,113 @@
+import mimetypes
+import os
+import stat as stat_module
+from functools import lru_cache
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.http import FileResponse, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.http import http_date, parse_http_date_safe
+
+from shop.storage import compressed_variants
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE_CONTROL = 'public, max-age=0, must-revalidate'
+
+
+def _accepted_encodings(header):
+    accepted = set()
+    for part in header.split(','):
+        token, _, params = part.strip().partition(';')
+        quality = params.strip().replace(' ', '')
+        if quality.startswith('q='):
+            try:
+                if float(quality[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        if token:
+            accepted.add(token.strip().lower())
+    return accepted
+
+
+@lru_cache(maxsize=1024)
+def _hashed_asset(path):
+    # hashed names never change content, so their stat and variants can be cached
+    stat = os.stat(path)
+    return stat, tuple(compressed_variants(path))
+
+
+class StaticAssetMiddleware:
+    """
+    Serve collected static files straight from ``STATIC_ROOT`` for deployments
+    without a CDN or a fronting web server. Content-hashed names from the
+    manifest get far-future immutable caching; everything else is revalidated.
+    Precompressed ``.br``/``.gz`` siblings are chosen by ``Accept-Encoding``.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.static_prefix = '/' + settings.STATIC_URL.lstrip('/')
+        self.static_root = str(settings.STATIC_ROOT) if settings.STATIC_ROOT else None
+
+    def __call__(self, request):
+        if self.static_root and request.path.startswith(self.static_prefix) and request.method in ('GET', 'HEAD'):
+            response = self.serve(request, request.path[len(self.static_prefix):])
+            if response is not None:
+                return response
+        return self.get_response(request)
+
+    def serve(self, request, name):
+        try:
+            path = safe_join(self.static_root, name)
+        except ValueError:
+            return None
+
+        hashed = getattr(staticfiles_storage, 'is_hashed', lambda n: False)(name)
+        try:
+            if hashed:
+                stat, variants = _hashed_asset(path)
+            else:
+                stat = os.stat(path)
+                variants = compressed_variants(path)
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        if not stat_module.S_ISREG(stat.st_mode):
+            return None
+
+        accepted = _accepted_encodings(request.headers.get('Accept-Encoding', ''))
+        serve_path, content_encoding = path, None
+        for encoding, candidate in variants:
+            if encoding in accepted:
+                serve_path, content_encoding = candidate, encoding
+                break
+
+        cache_control = IMMUTABLE_CACHE_CONTROL if hashed else REVALIDATE_CACHE_CONTROL
+        # each encoding is a different representation, so it needs its own validator
+        etag = '"%x-%x%s"' % (int(stat.st_mtime), stat.st_size, f'-{content_encoding}' if content_encoding else '')
+
+        if_none_match = request.headers.get('If-None-Match')
+        if_modified_since = parse_http_date_safe(request.headers.get('If-Modified-Since', ''))
+        if (if_none_match and etag in if_none_match) or (
+            not if_none_match and if_modified_since and int(stat.st_mtime) <= if_modified_since
+        ):
+            response = HttpResponseNotModified()
+            if variants:
+                response['Vary'] = 'Accept-Encoding'
+            response['ETag'] = etag
+            response['Cache-Control'] = cache_control
+            return response
+
+        content_type, _ = mimetypes.guess_type(name)
+        response = FileResponse(open(serve_path, 'rb'), content_type=content_type or 'application/octet-stream')
+        # FileResponse names the file after the open handle; assets are not downloads
+        del response['Content-Disposition']
+        if content_encoding:
+            response['Content-Encoding'] = content_encoding
+        if variants:
+            response['Vary'] = 'Accept-Encoding'
+        response['Cache-Control'] = cache_control
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(stat.st_mtime)
+        return response
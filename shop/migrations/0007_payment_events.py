@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0006_admin_grid_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='provider_ref',
+            field=models.CharField(blank=True, max_length=100, null=True, unique=True),
+        ),
+        migrations.CreateModel(
+            name='PaymentEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('provider_ref', models.CharField(max_length=100)),
+                ('status', models.CharField(choices=[('pending', 'รอการยืนยัน'), ('success', 'สำเร็จแล้ว'), ('cancelled', 'ยกเลิก')], max_length=50)),
+                ('amount', models.PositiveIntegerField(blank=True, null=True)),
+                ('payload', models.JSONField(blank=True, default=dict)),
+                ('received_at', models.DateTimeField(auto_now_add=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['processed_at', 'id'], name='shop_paymentevent_queue_idx')],
+                'constraints': [models.UniqueConstraint(fields=('provider_ref', 'status'), name='shop_paymentevent_ref_status_uniq')],
+            },
+        ),
+    ]
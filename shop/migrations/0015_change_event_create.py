@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 19:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0014_cart_last_activity'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='changeevent',
+            name='operation',
+            field=models.CharField(choices=[('create', 'create'), ('save', 'save'), ('delete', 'delete')], max_length=10),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-19 20:05
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models.functions import Coalesce, Mod
+
+
+def fill_buckets(apps, schema_editor):
+    Order = apps.get_model('shop', 'Order')
+    buckets = getattr(settings, 'ORDER_SHARD_BUCKETS', 1024)
+    Order.objects.using(schema_editor.connection.alias).update(bucket=Mod(Coalesce('user_id', 0), buckets))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0015_change_event_create'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShardBucket',
+            fields=[
+                ('bucket', models.PositiveIntegerField(primary_key=True, serialize=False)),
+                ('database', models.CharField(max_length=100)),
+                ('moving', models.BooleanField(default=False)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='bucket',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_buckets, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='order',
+            name='user',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='orderitem',
+            name='product',
+            field=models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='shop.product'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['bucket', 'id'], name='shop_order_bucket_idx'),
+        ),
+    ]
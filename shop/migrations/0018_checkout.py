@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-19 21:30
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0017_throttle_counter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='checkout_token',
+            field=models.UUIDField(blank=True, null=True, unique=True),
+        ),
+        migrations.CreateModel(
+            name='Checkout',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.UUIDField(unique=True)),
+                ('total_price', models.PositiveIntegerField()),
+                ('method', models.CharField(choices=[('credit_card', 'credit_card'), ('transfer', 'transfer'), ('cash', 'cash')], max_length=50)),
+                ('items', models.JSONField(default=list)),
+                ('order_id', models.BigIntegerField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['order_id', 'created_at'], name='shop_checkout_placed_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 22:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0018_checkout'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='payment',
+            name='status',
+            field=models.CharField(choices=[('pending', 'รอการยืนยัน'), ('success', 'สำเร็จแล้ว'), ('cancelled', 'ยกเลิก'), ('review', 'รอตรวจสอบ')], max_length=50),
+        ),
+        migrations.AlterField(
+            model_name='paymentevent',
+            name='status',
+            field=models.CharField(choices=[('pending', 'รอการยืนยัน'), ('success', 'สำเร็จแล้ว'), ('cancelled', 'ยกเลิก'), ('review', 'รอตรวจสอบ')], max_length=50),
+        ),
+    ]
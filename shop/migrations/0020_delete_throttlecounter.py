@@ -0,0 +1,16 @@
+# Generated by Django 5.2.18 on 2026-10-19 22:40
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0019_payment_review'),
+    ]
+
+    operations = [
+        migrations.DeleteModel(
+            name='ThrottleCounter',
+        ),
+    ]
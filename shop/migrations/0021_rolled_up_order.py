@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-19 23:10
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def fill_ledger(apps, schema_editor):
+    # the ledger lives on default, next to the rollups the flags already account for
+    if schema_editor.connection.alias != 'default':
+        return
+    Order = apps.get_model('shop', 'Order')
+    RolledUpOrder = apps.get_model('shop', 'RolledUpOrder')
+    for using in getattr(settings, 'ORDER_SHARDS', ['default']):
+        ids = Order.objects.using(using).filter(sales_recorded=True).values_list('id', flat=True)
+        RolledUpOrder.objects.bulk_create(
+            (RolledUpOrder(order_id=order_id) for order_id in ids.iterator(chunk_size=5000)),
+            batch_size=5000, ignore_conflicts=True,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0020_delete_throttlecounter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RolledUpOrder',
+            fields=[
+                ('order_id', models.BigIntegerField(primary_key=True, serialize=False)),
+            ],
+        ),
+        migrations.RunPython(fill_ledger, migrations.RunPython.noop),
+    ]
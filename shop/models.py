@@ -1,6 +1,29 @@
-from django.db import models
+from django.db import models, router, transaction
 from django.contrib.auth.models import AbstractUser
 from django.conf import settings
+from django.utils import timezone
+
+
+class ChangeTracked(models.Model):
+    """
+    Every save also writes a ChangeEvent for ``change_topic`` in the same
+    transaction (see shop.changes). Deletes, cascades included, are recorded
+    by the post_delete handlers in shop.signals, which Django already runs
+    inside the delete's transaction.
+    """
+    change_topic = None
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        from shop.changes import record
+
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        operation = 'create' if self._state.adding else 'save'
+        with transaction.atomic(using=using, savepoint=False):
+            super().save(*args, **kwargs)
+            record(self.change_topic, [self.pk], operation, using=using)
 
 class User(AbstractUser):
     phone = models.CharField(max_length=20, blank=True, null=True)
@@ -13,20 +36,49 @@ class User(AbstractUser):
     role = models.CharField(max_length=50, choices=ROLE_CHOICES, default='customer')
     profile_picture = models.CharField(max_length=255, blank=True, null=True, help_text="URL to profile picture")
 
-class Category(models.Model):
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            models.Index(fields=['date_joined', 'id'], name='shop_user_joined_idx'),
+            models.Index(fields=['role', 'date_joined'], name='shop_user_role_joined_idx'),
+            # the admin grid searches by prefix (username__startswith), which a
+            # plain btree only serves under the C collation
+            models.Index(fields=['username'], name='shop_user_username_like_idx', opclasses=['varchar_pattern_ops']),
+        ]
+
+class Category(ChangeTracked):
+    change_topic = 'category'
+
     name = models.CharField(max_length=100)
     description = models.TextField(blank=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['name', 'id'], name='shop_category_name_idx'),
+            models.Index(fields=['name'], name='shop_category_name_like_idx', opclasses=['varchar_pattern_ops']),
+        ]
+
     def __str__(self):
         return self.name
 
-class Product(models.Model):
+class Product(ChangeTracked):
+    change_topic = 'product'
+
     name = models.CharField(max_length=200)
     description = models.TextField(blank=True)
     price = models.PositiveIntegerField()
     stock = models.IntegerField(default=0)
     image_url = models.CharField(max_length=255, blank=True, null=True)
     categories = models.ManyToManyField(Category, related_name="products", blank=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['price', 'id'], name='shop_product_price_idx'),
+            models.Index(fields=['stock', 'id'], name='shop_product_stock_idx'),
+            # sorting by name uses the first, prefix search (name__startswith) the second
+            models.Index(fields=['name', 'id'], name='shop_product_name_idx'),
+            models.Index(fields=['name'], name='shop_product_name_like_idx', opclasses=['varchar_pattern_ops']),
+        ]
 
     def __str__(self):
         return self.name
@@ -34,6 +86,13 @@ class Product(models.Model):
 class Cart(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
+    # moved forward by shop.cart.touch() on cart writes; idle carts are purged by it
+    last_activity = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['last_activity', 'id'], name='shop_cart_activity_idx'),
+        ]
 
     def __str__(self):
         return f"Cart for {self.user.username}"
@@ -46,38 +105,116 @@ class CartItem(models.Model):
     class Meta:
         unique_together = ('cart', 'product')
 
-class Order(models.Model):
+class ShardedQuerySet(models.QuerySet):
+    """
+    Orders, items and payments live on the shard of the user's bucket
+    (shop.sharding). Without ``using()``, create() and bulk_create() let
+    the router place new rows by their user or order; reads still need
+    ``using()``, a related manager or a shop.sharding helper, since nothing
+    in a filter tells the router which shard to ask.
+    """
+
+    def create(self, **kwargs):
+        if self._db is not None:
+            return super().create(**kwargs)
+        obj = self.model(**kwargs)
+        obj.save(force_insert=True)
+        return obj
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        if self._db is None and objs:
+            return self.using(router.db_for_write(self.model, instance=objs[0])).bulk_create(objs, *args, **kwargs)
+        return super().bulk_create(objs, *args, **kwargs)
+
+class Order(ChangeTracked):
+    change_topic = 'order'
+
     STATUS_CHOICES = [
         ('pending', 'รอชำระเงิน'),
         ('paid', 'ชำระเงินแล้ว'),
         ('shipping', 'กำลังจัดส่ง'),
         ('delivered', 'จัดส่งสำเร็จ'),
+        ('cancelled', 'ยกเลิกแล้ว'),
     ]
-    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True)
+    # users live on default, the order on its shard: no constraint across databases
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, db_constraint=False)
     total_price = models.PositiveIntegerField()
     status = models.CharField(max_length=50, choices=STATUS_CHOICES, default='pending')
     created_at = models.DateTimeField(auto_now_add=True)
+    sales_recorded = models.BooleanField(default=False)
+    # shop.sharding.bucket_of(user), fixed at creation: the unit the rebalancer moves
+    bucket = models.PositiveIntegerField(default=0)
+    # Checkout.token of the checkout that placed it: at most one order per checkout
+    checkout_token = models.UUIDField(unique=True, null=True, blank=True)
+
+    objects = ShardedQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['sales_recorded', 'status', 'id'], name='shop_order_rollup_idx'),
+            models.Index(fields=['created_at', 'id'], name='shop_order_created_idx'),
+            models.Index(fields=['status', 'created_at', 'id'], name='shop_order_status_created_idx'),
+            models.Index(fields=['bucket', 'id'], name='shop_order_bucket_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        from shop import sharding
+
+        if self._state.adding:
+            self.bucket = sharding.bucket_of(self.user_id)
+            if self.pk is None:
+                using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+                self.pk = sharding.next_order_id(using)
+        super().save(*args, **kwargs)
 
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items')
-    product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True)
+    product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True, db_constraint=False)
     quantity = models.PositiveIntegerField()
     unit_price = models.PositiveIntegerField()
 
+    objects = ShardedQuerySet.as_manager()
+
     @property
     def subtotal(self):
         return self.quantity * self.unit_price
 
-class Payment(models.Model):
+class Payment(ChangeTracked):
+    change_topic = 'payment'
+
     PAYMENT_METHODS = [('credit_card','credit_card'), ('transfer','transfer'), ('cash','cash')]
-    PAYMENT_STATUS = [('pending','รอการยืนยัน'), ('success','สำเร็จแล้ว'), ('cancelled','ยกเลิก')]
+    # 'review': the provider took the money for an order cancelled meanwhile, to refund or reinstate by hand
+    PAYMENT_STATUS = [('pending','รอการยืนยัน'), ('success','สำเร็จแล้ว'), ('cancelled','ยกเลิก'), ('review','รอตรวจสอบ')]
 
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='payments')
     amount = models.PositiveIntegerField()
     method = models.CharField(max_length=50, choices=PAYMENT_METHODS)
     status = models.CharField(max_length=50, choices=PAYMENT_STATUS)
+    provider_ref = models.CharField(max_length=100, unique=True, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = ShardedQuerySet.as_manager()
+
+class PaymentEvent(models.Model):
+    provider_ref = models.CharField(max_length=100)
+    status = models.CharField(max_length=50, choices=Payment.PAYMENT_STATUS)
+    amount = models.PositiveIntegerField(null=True, blank=True)
+    payload = models.JSONField(default=dict, blank=True)
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['provider_ref', 'status'], name='shop_paymentevent_ref_status_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['processed_at', 'id'], name='shop_paymentevent_queue_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.provider_ref} -> {self.status}"
+
 class Address(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='addresses')
     receiver_name = models.CharField(max_length=150)
@@ -100,4 +237,132 @@ class ActivityLog(models.Model):
         return f'{self.user.username} - {self.action}'
 
     class Meta:
-        ordering = ['-timestamp']
+        ordering = ['-timestamp', '-id']
+        # every read and the retention purge walk the log in time order
+        indexes = [
+            models.Index(fields=['timestamp', 'id'], name='shop_activitylog_time_idx'),
+            models.Index(fields=['user', 'timestamp', 'id'], name='shop_activitylog_user_idx'),
+            models.Index(fields=['category', 'timestamp', 'id'], name='shop_activitylog_category_idx'),
+        ]
+
+class Task(models.Model):
+    STATUS_CHOICES = [
+        ('pending', 'pending'),
+        ('running', 'running'),
+        ('done', 'done'),
+        ('failed', 'failed'),
+    ]
+    name = models.CharField(max_length=200)
+    args = models.JSONField(default=list, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField()
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_at'], name='shop_task_queue_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.status})"
+
+
+class ProductSalesDaily(models.Model):
+    day = models.DateField()
+    # no FK constraint so history survives product deletion
+    product = models.ForeignKey(Product, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    units = models.BigIntegerField(default=0)
+    revenue = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'product'], name='shop_productsales_day_product_uniq'),
+        ]
+
+class CategorySalesDaily(models.Model):
+    day = models.DateField()
+    category = models.ForeignKey(Category, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    units = models.BigIntegerField(default=0)
+    revenue = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'category'], name='shop_categorysales_day_category_uniq'),
+        ]
+
+class RolledUpOrder(models.Model):
+    """An order whose items are in the sales rollups, kept on default so it commits with them (shop.reports)."""
+    # not a foreign key: the order lives on its shard
+    order_id = models.BigIntegerField(primary_key=True)
+
+    def __str__(self):
+        return f"order {self.order_id}"
+
+
+class ChangeEvent(models.Model):
+    """One insert, update or delete of a tracked row, written by shop.changes.record()."""
+    OPERATIONS = [('create', 'create'), ('save', 'save'), ('delete', 'delete')]
+
+    topic = models.CharField(max_length=20)
+    object_id = models.BigIntegerField()
+    operation = models.CharField(max_length=10, choices=OPERATIONS)
+    # PostgreSQL transaction id of the write (0 on SQLite); the feed is read in (txid, id) order
+    txid = models.BigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['txid', 'id'], name='shop_changeevent_feed_idx'),
+            models.Index(fields=['topic', 'object_id', 'txid', 'id'], name='shop_changeevent_key_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.topic} {self.object_id} {self.operation}"
+
+class ChangeConsumer(models.Model):
+    """Committed position of a named change feed consumer."""
+    name = models.CharField(max_length=100, primary_key=True)
+    txid = models.BigIntegerField(default=0)
+    event_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} @ {self.txid}:{self.event_id}"
+
+class ShardBucket(models.Model):
+    """A bucket of users' orders placed on a shard other than the first one, or being moved (shop.sharding)."""
+    bucket = models.PositiveIntegerField(primary_key=True)
+    database = models.CharField(max_length=100)
+    moving = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.bucket} -> {self.database}" + (" (moving)" if self.moving else "")
+
+class Checkout(models.Model):
+    """
+    A confirmed checkout, written on default together with its stock and
+    cart changes, before its order exists on the shard. ``order_id`` is set
+    once the order is placed (shop.orders.place_order); until then the row
+    holds everything needed to place it.
+    """
+    token = models.UUIDField(unique=True)
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    total_price = models.PositiveIntegerField()
+    method = models.CharField(max_length=50, choices=Payment.PAYMENT_METHODS)
+    # [[product_id, quantity, unit_price], ...]
+    items = models.JSONField(default=list)
+    order_id = models.BigIntegerField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['order_id', 'created_at'], name='shop_checkout_placed_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.token} -> " + (f"order {self.order_id}" if self.order_id else "not placed")
@@ -0,0 +1,153 @@
+import logging
+import os
+import re
+import sys
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from shop.sharding import shards
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_THRESHOLD = 5
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+THIS_FILE = os.path.abspath(__file__)
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST = re.compile(r'\bIN\s*\((?:\s*(?:\?|%s|[\w.-]+)\s*,?)+\)', re.IGNORECASE)
+_SPACE = re.compile(r'\s+')
+
+
+class NPlusOneError(AssertionError):
+    pass
+
+
+def fingerprint(sql):
+    """Reduce a SQL statement to its shape: literals and IN lists are collapsed."""
+    sql = _STRING.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    sql = _IN_LIST.sub('IN (...)', sql)
+    return _SPACE.sub(' ', sql).strip()
+
+
+def _location():
+    """Innermost project frame and template node on the current stack."""
+    code_location = template_location = None
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if template_location is None and frame.f_code.co_name == 'render_annotated':
+            node = frame.f_locals.get('self')
+            origin = getattr(node, 'origin', None)
+            token = getattr(node, 'token', None)
+            if origin is not None and token is not None:
+                template_location = f"{origin.template_name}:{token.lineno}"
+        if (
+            code_location is None
+            and filename.startswith(PROJECT_ROOT)
+            and filename != THIS_FILE
+            and f'{os.sep}site-packages{os.sep}' not in filename
+        ):
+            code_location = f"{os.path.relpath(filename, PROJECT_ROOT)}:{frame.f_lineno} in {frame.f_code.co_name}"
+        if code_location and template_location:
+            break
+        frame = frame.f_back
+    return code_location, template_location
+
+
+class QueryRecorder:
+    """
+    ``connection.execute_wrapper`` hook grouping queries by fingerprint. The
+    same query on two shards is one per shard, not a repeat, so queries on
+    any database but default are grouped under their alias.
+    """
+
+    def __init__(self):
+        self.counts = defaultdict(int)
+        self.locations = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        alias = context['connection'].alias
+        key = fingerprint(sql) if alias == 'default' else f'[{alias}] {fingerprint(sql)}'
+        self.counts[key] += 1
+        if self.counts[key] == 2:
+            # the first repeat is where the loop is, no need to walk the stack for every query
+            self.locations[key] = _location()
+        return execute(sql, params, many, context)
+
+    def repeated(self, threshold):
+        return [
+            {
+                'sql': sql,
+                'count': count,
+                'code': self.locations.get(sql, (None, None))[0],
+                'template': self.locations.get(sql, (None, None))[1],
+            }
+            for sql, count in sorted(self.counts.items(), key=lambda item: -item[1])
+            if count >= threshold
+        ]
+
+
+def format_report(label, findings):
+    lines = [f"Possible N+1 queries in {label}:"]
+    for finding in findings:
+        lines.append(f"  {finding['count']}x {finding['sql'][:200]}")
+        if finding['template']:
+            lines.append(f"      template: {finding['template']}")
+        if finding['code']:
+            lines.append(f"      code:     {finding['code']}")
+    return '\n'.join(lines)
+
+
+@contextmanager
+def detect_n_plus_one(label='block', threshold=None, strict=False, using=None):
+    """
+    Record the queries run inside the block, on ``using`` or on default and
+    every order shard, and report same-shape queries repeated ``threshold``
+    times or more on one database. With ``strict=True`` it raises
+    ``NPlusOneError``, which makes it usable as a test assertion::
+
+        with detect_n_plus_one('admin_order_list', strict=True):
+            client.get('/admin/orders/')
+    """
+    threshold = threshold or getattr(settings, 'NPLUSONE_THRESHOLD', DEFAULT_THRESHOLD)
+    if using is None:
+        aliases = dict.fromkeys(['default', *shards()])
+    else:
+        aliases = [using]
+    recorder = QueryRecorder()
+    with ExitStack() as stack:
+        for alias in aliases:
+            stack.enter_context(connections[alias].execute_wrapper(recorder))
+        yield recorder
+    findings = recorder.repeated(threshold)
+    if findings:
+        report = format_report(label, findings)
+        if strict:
+            raise NPlusOneError(report)
+        logger.warning(report)
+
+
+class NPlusOneMiddleware:
+    """
+    Development-only middleware that logs repeated same-shape queries per
+    request (with the template line or code location that issued them).
+    Disabled unless ``DEBUG`` is on; ``NPLUSONE_STRICT = True`` turns the
+    warning into an exception.
+    """
+
+    def __init__(self, get_response):
+        if not settings.DEBUG:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.strict = getattr(settings, 'NPLUSONE_STRICT', False)
+
+    def __call__(self, request):
+        label = f"{request.method} {request.path}"
+        with detect_n_plus_one(label, strict=self.strict):
+            return self.get_response(request)
@@ -0,0 +1,232 @@
+from collections import Counter
+from datetime import timedelta
+
+from django.db import IntegrityError, connections, transaction
+from django.db.models import Case, Count, F, Value, When
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from shop.changes import record, txid_sql
+from shop.models import Checkout, Order, OrderItem, Payment, Product, ActivityLog, ChangeEvent
+from shop.sharding import ShardMoving, each_shard, shard_for
+from shop.task_queue import enqueue
+from shop.tasks import log_order_activity, render_order_receipt
+
+# target status -> statuses an order may move to it from
+ALLOWED_TRANSITIONS = {
+    'paid': ('pending',),
+    'shipping': ('paid',),
+    'delivered': ('shipping',),
+    'cancelled': ('pending', 'paid'),
+}
+
+LOG_CATEGORY = "จัดการคำสั่งซื้อ"
+
+
+def _log_text(target):
+    if target == 'cancelled':
+        return "ยกเลิกคำสั่งซื้อ #", ""
+    return "อัปเดตสถานะคำสั่งซื้อ #", f" เป็น '{target}'"
+
+
+def take_stock(quantities, low_stock_threshold):
+    """
+    Take ``{product_id: quantity}`` off stock, never below zero, with one
+    UPDATE and one change event per product. Returns the ids of products
+    that fell below ``low_stock_threshold`` because of it.
+    """
+    with transaction.atomic():
+        before = dict(Product.objects.select_for_update().filter(id__in=quantities).values_list('id', 'stock'))
+        if not before:
+            return []
+        # stock-only, like Product.save(update_fields=['stock', 'updated_at']): names and pages stay as they are
+        Product.objects.filter(id__in=before).update(
+            stock=Greatest(F('stock') - Case(*[When(id=pk, then=Value(quantities[pk])) for pk in before]), Value(0)),
+            updated_at=timezone.now(),
+        )
+        record(Product.change_topic, list(before))
+    return [pk for pk, stock in before.items() if stock >= low_stock_threshold > max(0, stock - quantities[pk])]
+
+
+def open_checkout(token, cart, method, low_stock_threshold):
+    """
+    The default side of confirming ``cart``: record Checkout ``token`` with
+    the cart's items, take their stock and remove those items from the
+    cart, in one transaction on default that commits before the order is
+    written on its shard (place_order). The items are read and locked in
+    that transaction, so one added meanwhile stays in the cart for the next
+    order. Returns ``(checkout, ids of products that fell below
+    low_stock_threshold)``, ``(None, [])`` if ``token`` was confirmed
+    already, as when the form is sent twice, or ``(None, None)`` if the
+    cart was emptied in the meantime.
+    """
+    with transaction.atomic():
+        items = list(cart.items.select_for_update().select_related('product'))
+        if not items:
+            return None, None
+        # the unique token: a second confirmation racing this one stops here, before any stock is taken
+        checkout, created = Checkout.objects.get_or_create(token=token, defaults={
+            'user': cart.user,
+            'total_price': sum(item.quantity * item.product.price for item in items),
+            'method': method,
+            'items': [[item.product_id, item.quantity, item.product.price] for item in items],
+        })
+        if not created:
+            return None, []
+        quantities = Counter()
+        for item in items:
+            quantities[item.product_id] += item.quantity
+        crossed_threshold = take_stock(quantities, low_stock_threshold)
+        cart.items.filter(id__in=[item.id for item in items]).delete()
+    return checkout, crossed_threshold
+
+
+def place_order(checkout):
+    """
+    Write the order, items and payment of ``checkout`` on the user's shard,
+    once: the order carries the checkout's token, unique on its shard, so a
+    retry finds the order an earlier attempt placed instead of adding
+    another. Records the order id on the checkout and returns the order.
+    Raises ShardMoving while the user's orders are being moved.
+    """
+    order = None
+    for shard_queryset in each_shard(Order.objects.filter(checkout_token=checkout.token)):
+        order = shard_queryset.first()
+        if order:
+            break
+    if order is None:
+        shard = shard_for(checkout.user_id, write=True)
+        try:
+            with transaction.atomic(using=shard):
+                order = Order.objects.using(shard).create(
+                    user_id=checkout.user_id,
+                    total_price=checkout.total_price,
+                    status='pending',
+                    checkout_token=checkout.token,
+                )
+                OrderItem.objects.using(shard).bulk_create([
+                    OrderItem(order=order, product_id=product_id, quantity=quantity, unit_price=unit_price)
+                    for product_id, quantity, unit_price in checkout.items
+                ])
+                Payment.objects.using(shard).create(
+                    order=order, amount=checkout.total_price, method=checkout.method, status='pending',
+                )
+        except IntegrityError:
+            # placed by a concurrent retry in the meantime
+            order = Order.objects.using(shard).get(checkout_token=checkout.token)
+        else:
+            # side effects run in the task worker
+            enqueue(render_order_receipt, order.id)
+            enqueue(log_order_activity, checkout.user_id, f"สั่งซื้อสินค้า คำสั่งซื้อ #{order.id} ยอดรวม {checkout.total_price} ฿", "คำสั่งซื้อ")
+    Checkout.objects.filter(pk=checkout.pk).update(order_id=order.id)
+    checkout.order_id = order.id
+    return order
+
+
+def place_pending_checkouts(older_than=60, keep_days=7, batch_size=500):
+    """
+    Place the orders of checkouts confirmed over ``older_than`` seconds ago
+    that still have none, because the request confirming them failed or
+    died between its two commits. Placed checkouts are kept ``keep_days``
+    to turn away a late second confirmation of the same form, then
+    deleted. Returns ``(placed, waiting on a shard move, deleted)``.
+    """
+    now = timezone.now()
+    placed = waiting = 0
+    pending = Checkout.objects.filter(order_id__isnull=True, created_at__lt=now - timedelta(seconds=older_than))
+    for checkout in pending.order_by('created_at')[:batch_size]:
+        try:
+            place_order(checkout)
+            placed += 1
+        except ShardMoving:
+            waiting += 1
+    deleted, _ = Checkout.objects.filter(order_id__isnull=False, created_at__lt=now - timedelta(days=keep_days)).delete()
+    return placed, waiting, deleted
+
+
+def bulk_transition(queryset, target, actor):
+    """
+    Move every order of ``queryset`` that may go to ``target`` there, on
+    each shard in turn (or the one ``queryset`` is pinned to), and write
+    one activity log row and one change event per moved order. Orders in
+    any other status, and orders being moved between shards, are left
+    alone. Returns a summary dict with ``updated``, ``skipped`` and
+    ``by_status`` (matching orders per status before the change).
+    """
+    updated = 0
+    by_status = Counter()
+    for shard_queryset in each_shard(queryset, write=True):
+        by_status.update(dict(shard_queryset.order_by().values_list('status').annotate(n=Count('id'))))
+        if shard_queryset.db == 'default':
+            updated += _transition_default(shard_queryset, target, actor)
+        else:
+            updated += _transition_shard(shard_queryset, target, actor)
+
+    matched = sum(by_status.values())
+    return {'updated': updated, 'skipped': matched - updated, 'by_status': dict(by_status)}
+
+
+def _transition_default(queryset, target, actor):
+    """
+    Orders on default, next to the activity log: one UPDATE, and one INSERT
+    each for the log rows and the change events.
+    """
+    sources = ALLOWED_TRANSITIONS[target]
+    candidates = queryset.filter(status__in=sources).order_by().values('id')
+    prefix, suffix = _log_text(target)
+
+    connection = connections['default']
+    qn = connection.ops.quote_name
+    orders = qn(Order._meta.db_table)
+    logs = qn(ActivityLog._meta.db_table)
+    events = qn(ChangeEvent._meta.db_table)
+    txid = txid_sql(connection)
+    subquery, params = candidates.query.sql_with_params()
+    now = timezone.now()
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            # one statement: the UPDATE hands the moved ids straight to both INSERTs
+            cursor.execute(
+                f"WITH moved AS ("
+                f"UPDATE {orders} SET status = %s WHERE id IN ({subquery}) AND status = ANY(%s) RETURNING id"
+                f"), logged AS ("
+                f"INSERT INTO {logs} (user_id, action, category, timestamp) "
+                f"SELECT %s, %s || moved.id || %s, %s, %s FROM moved"
+                f") INSERT INTO {events} (topic, object_id, operation, txid, created_at) "
+                f"SELECT %s, moved.id, 'save', {txid}, %s FROM moved",
+                [target, *params, list(sources), actor.id, prefix, suffix, LOG_CATEGORY, now, Order.change_topic, now],
+            )
+            return cursor.rowcount
+        # SQLite holds the write lock from the INSERT on, so both
+        # statements see the same rows
+        cursor.execute(
+            f"INSERT INTO {logs} (user_id, action, category, timestamp) "
+            f"SELECT %s, %s || id || %s, %s, %s FROM {orders} WHERE id IN ({subquery})",
+            [actor.id, prefix, suffix, LOG_CATEGORY, now, *params],
+        )
+        cursor.execute(
+            f"INSERT INTO {events} (topic, object_id, operation, txid, created_at) "
+            f"SELECT %s, id, 'save', {txid}, %s FROM {orders} WHERE id IN ({subquery})",
+            [Order.change_topic, now, *params],
+        )
+        return Order.objects.using('default').filter(id__in=candidates, status__in=sources).update(status=target)
+
+
+def _transition_shard(queryset, target, actor):
+    """
+    Orders on another shard: the update and its change events commit there
+    first, then the log rows go to default with the ids that moved.
+    """
+    sources = ALLOWED_TRANSITIONS[target]
+    using = queryset.db
+    with transaction.atomic(using=using):
+        # locked, so every id read here is still in a source status for the UPDATE
+        ids = list(queryset.filter(status__in=sources).select_for_update().order_by('id').values_list('id', flat=True))
+        updated = Order.objects.using(using).filter(id__in=ids, status__in=sources).update(status=target)
+        record(Order.change_topic, ids, using=using)
+    prefix, suffix = _log_text(target)
+    ActivityLog.objects.bulk_create([
+        ActivityLog(user_id=actor.id, action=f"{prefix}{pk}{suffix}", category=LOG_CATEGORY) for pk in ids
+    ])
+    return updated
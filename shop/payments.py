@@ -0,0 +1,202 @@
+import hashlib
+import hmac
+import json
+import logging
+import random
+import uuid
+from pathlib import Path
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from shop.changes import record
+from shop.models import Order, Payment, PaymentEvent
+from shop.sharding import each_shard, shards, writable
+from shop.task_queue import enqueue
+from shop.tasks import update_sales_rollups
+
+logger = logging.getLogger(__name__)
+
+# status reported by the provider -> (Payment.status, Order.status or None)
+STATUS_TRANSITIONS = {
+    'success': ('success', 'paid'),
+    'cancelled': ('cancelled', None),
+}
+
+
+def sign_payload(body):
+    return hmac.new(settings.PAYMENT_WEBHOOK_SECRET.encode(), body, hashlib.sha256).hexdigest()
+
+
+def verify_signature(body, signature):
+    return bool(signature) and hmac.compare_digest(sign_payload(body), signature)
+
+
+def amount_error(provider_ref, status, amount):
+    """
+    Why a callback's ``amount`` is unacceptable, or None: it must be a whole
+    number equal to what the payment was charged, and a success, which marks
+    the order paid, has to state it.
+    """
+    if amount is None:
+        return 'missing amount' if STATUS_TRANSITIONS.get(status, (None, None))[1] else None
+    if type(amount) is not int or amount < 0:
+        return 'invalid amount'
+    for queryset in each_shard(Payment.objects.filter(provider_ref=provider_ref)):
+        charged = queryset.values_list('amount', flat=True).first()
+        if charged is not None:
+            return None if amount == charged else 'amount mismatch'
+    return None
+
+
+def enqueue_event(provider_ref, status, amount=None, payload=None):
+    """
+    Record a provider callback for the worker. Duplicate deliveries of the
+    same ``(provider_ref, status)`` are dropped by the unique constraint.
+    """
+    if status not in STATUS_TRANSITIONS:
+        return False
+    PaymentEvent.objects.bulk_create(
+        [PaymentEvent(provider_ref=provider_ref, status=status, amount=amount, payload=payload or {})],
+        ignore_conflicts=True,
+    )
+    return True
+
+
+def apply_statuses(statuses, using=None):
+    """
+    Apply ``{provider_ref: status}`` to Payment and Order rows with one
+    UPDATE per target status on every shard (or only ``using``), recording
+    a change event per moved row. Only pending rows move, so replaying the
+    same statuses is a no-op; payments of orders being moved between shards
+    are left for reconciliation. A success for an order that was cancelled
+    meanwhile does not count as paid: its payment goes to 'review' for
+    someone to refund or reinstate. Returns the number of payments changed.
+    """
+    changed = 0
+    by_status = {}
+    for ref, status in statuses.items():
+        if status in STATUS_TRANSITIONS:
+            by_status.setdefault(status, []).append(ref)
+
+    for alias in [using] if using else shards():
+        with transaction.atomic(using=alias):
+            for status, refs in by_status.items():
+                changed += _apply_status(alias, status, refs)
+    return changed
+
+
+def _apply_status(using, status, refs):
+    payment_status, order_status = STATUS_TRANSITIONS[status]
+    payments = writable(Payment.objects.using(using).filter(provider_ref__in=refs, status='pending'))
+    moved = 0
+    if order_status:
+        stranded = list(payments.filter(order__status='cancelled').values_list('id', flat=True))
+        if stranded:
+            moved += Payment.objects.using(using).filter(id__in=stranded, status='pending').update(status='review')
+            record(Payment.change_topic, stranded, using=using)
+            logger.warning("payments %s reported %s for cancelled orders, left for review", stranded, status)
+            payments = payments.exclude(id__in=stranded)
+        settled = payments.filter(order=OuterRef('pk'))
+        order_ids = list(Order.objects.using(using).filter(Exists(settled), status='pending').values_list('id', flat=True))
+        if Order.objects.using(using).filter(id__in=order_ids, status='pending').update(status=order_status):
+            record(Order.change_topic, order_ids, using=using)
+            enqueue(update_sales_rollups)
+    payment_ids = list(payments.values_list('id', flat=True))
+    settled = Payment.objects.using(using).filter(id__in=payment_ids, status='pending').update(status=payment_status)
+    if settled:
+        record(Payment.change_topic, payment_ids, using=using)
+    return moved + settled
+
+
+def process_events(batch_size=500):
+    """Apply one batch of queued events. Returns ``(events, payments_changed)``."""
+    with transaction.atomic():
+        events = list(
+            PaymentEvent.objects.select_for_update(skip_locked=True)
+            .filter(processed_at__isnull=True)
+            .order_by('id')[:batch_size]
+        )
+        if not events:
+            return 0, 0
+        # later events for the same reference win
+        statuses = {event.provider_ref: event.status for event in events}
+        changed = apply_statuses(statuses)
+        PaymentEvent.objects.filter(id__in=[event.id for event in events]).update(processed_at=timezone.now())
+    return len(events), changed
+
+
+def reconcile(provider=None, batch_size=500):
+    """
+    Compare pending payments with the provider in keyset-ordered chunks,
+    shard by shard, and fix any that diverged (for example because a
+    callback was lost). Returns ``(checked, fixed)``.
+    """
+    provider = provider or get_provider()
+    checked = fixed = 0
+    for using in shards():
+        last_id = 0
+        while True:
+            chunk = list(
+                Payment.objects.using(using).filter(status='pending', provider_ref__isnull=False, id__gt=last_id)
+                .order_by('id')
+                .values_list('id', 'provider_ref')[:batch_size]
+            )
+            if not chunk:
+                break
+            last_id = chunk[-1][0]
+            checked += len(chunk)
+            remote = provider.fetch_statuses([ref for _, ref in chunk])
+            fixed += apply_statuses(remote, using)
+    return checked, fixed
+
+
+def get_provider():
+    return import_string(settings.PAYMENT_PROVIDER)()
+
+
+class StubPaymentProvider:
+    """
+    Offline stand-in for a payment gateway. Charges live in a JSON file so
+    the web process, the worker and the reconciler all see the same state.
+    Captures "deliver" their callback by enqueueing it directly; set
+    ``PAYMENT_STUB_DROP_RATE`` to lose a fraction of callbacks and exercise
+    reconciliation.
+    """
+
+    def __init__(self):
+        self.path = Path(getattr(settings, 'PAYMENT_STUB_STATE_FILE', settings.BASE_DIR / 'payment_stub.json'))
+        self.drop_rate = getattr(settings, 'PAYMENT_STUB_DROP_RATE', 0.0)
+
+    def _load(self):
+        try:
+            return json.loads(self.path.read_text())
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _store(self, state):
+        tmp = self.path.with_suffix('.tmp')
+        tmp.write_text(json.dumps(state))
+        tmp.replace(self.path)
+
+    def create_charge(self, payment):
+        ref = f'stub_{uuid.uuid4().hex}'
+        state = self._load()
+        state[ref] = {'status': 'pending', 'amount': payment.amount}
+        self._store(state)
+        return ref
+
+    def capture(self, ref, status='success'):
+        state = self._load()
+        charge = state.setdefault(ref, {'amount': None})
+        charge['status'] = status
+        self._store(state)
+        if random.random() >= self.drop_rate:
+            transaction.on_commit(lambda: enqueue_event(ref, status, charge['amount'], {'source': 'stub'}))
+
+    def fetch_statuses(self, refs):
+        state = self._load()
+        return {ref: state[ref]['status'] for ref in refs if ref in state}
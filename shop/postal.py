@@ -0,0 +1,218 @@
+import csv
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import chain, islice
+from pathlib import Path
+
+from django.conf import settings
+
+from shop.autocomplete import normalize
+
+DEFAULT_DATA = Path(__file__).resolve().parent / 'data' / 'thai_postal.tsv'
+FIELDS = ('postal_code', 'subdistrict', 'district', 'province')
+MAX_RESULTS = 10
+SCAN_LIMIT = 2000
+BANGKOK = 'กรุงเทพมหานคร'
+BANGKOK_ALIASES = {'กรุงเทพ', 'กรุงเทพฯ', 'กทม', 'กทม.', 'bangkok'}
+# what people type in front of a name: "ต.ลุมพินี", "แขวงลุมพินี", "จ.ภูเก็ต"
+NAME_PREFIXES = ('จังหวัด', 'อำเภอ', 'ตำบล', 'แขวง', 'เขต', 'จ.', 'อ.', 'ต.')
+
+
+def clean_name(text):
+    name = normalize(text).strip()
+    for prefix in NAME_PREFIXES:
+        if name.startswith(prefix) and len(name) > len(prefix):
+            name = name[len(prefix):].strip()
+            break
+    return BANGKOK if name in BANGKOK_ALIASES else name
+
+
+def read_rows(path):
+    """(postal_code, subdistrict, district, province) rows of a dataset file, header skipped."""
+    with open(path, encoding='utf-8', newline='') as data:
+        reader = csv.reader(data, delimiter='\t')
+        next(reader, None)
+        for row in reader:
+            if row:
+                yield tuple(row)
+
+
+def write_rows(path, rows):
+    with open(path, 'w', encoding='utf-8', newline='') as data:
+        writer = csv.writer(data, delimiter='\t', lineterminator='\n')
+        writer.writerow(FIELDS)
+        writer.writerows(sorted(set(rows), key=lambda row: (row[0], row[3], row[2], row[1])))
+
+
+class _Keys:
+    """Sequence view of a level's sorted rows, compared by their name cut to ``length``."""
+
+    def __init__(self, level, length):
+        self.level = level
+        self.length = length
+
+    def __len__(self):
+        return len(self.level.order)
+
+    def __getitem__(self, i):
+        level = self.level
+        return level.keys[level.of[level.order[i]]][:self.length]
+
+
+class _Level:
+    """Subdistricts, districts or provinces: every distinct name once, and the rows sorted by it."""
+
+    def __init__(self, values):
+        self.names = sorted(set(values))
+        ids = {name: i for i, name in enumerate(self.names)}
+        # Thai has no case, so most keys are the name itself and share its string
+        self.keys = [name if key == name else key for name, key in ((name, normalize(name)) for name in self.names)]
+        self.of = array('H', (ids[value] for value in values))
+        self.order = array('H', sorted(range(len(values)), key=lambda row: self.keys[self.of[row]]))
+
+    def name(self, row):
+        return self.names[self.of[row]]
+
+    def key(self, row):
+        return self.keys[self.of[row]]
+
+    def rows(self, prefix):
+        if not prefix:
+            return ()
+        keys = _Keys(self, len(prefix))
+        lo = bisect_left(keys, prefix)
+        hi = bisect_right(keys, prefix, lo)
+        return self.order[lo:hi]
+
+
+class PostalIndex:
+    """
+    Immutable index over the Thai postal dataset, one row per (postal code,
+    subdistrict, district, province). Each distinct name is stored once and
+    a row is a postal code in one ``array`` plus a small name number per
+    level, so the whole country (about 7,500 rows) stays well under a
+    megabyte. A postal code or code prefix is an integer range of the
+    sorted codes; a name prefix is two binary searches over the rows sorted
+    by that name.
+    """
+
+    def __init__(self, rows):
+        rows = sorted(set(rows))
+        self.codes = array('L', (int(row[0]) for row in rows))
+        self.subdistricts, self.districts, self.provinces = (
+            _Level([row[i] for row in rows]) for i in (1, 2, 3)
+        )
+
+    def __len__(self):
+        return len(self.codes)
+
+    def row(self, i):
+        return {
+            'postal_code': f'{self.codes[i]:05d}',
+            'subdistrict': self.subdistricts.name(i),
+            'district': self.districts.name(i),
+            'province': self.provinces.name(i),
+        }
+
+    def _code_rows(self, prefix):
+        if len(prefix) > 5:
+            return range(0)
+        lo = bisect_left(self.codes, int(prefix.ljust(5, '0')))
+        hi = bisect_right(self.codes, int(prefix.ljust(5, '9')), lo)
+        return range(lo, hi)
+
+    def _matches(self, i, term):
+        if term.isdigit():
+            return f'{self.codes[i]:05d}'.startswith(term)
+        return any(level.key(i).startswith(term) for level in (self.subdistricts, self.districts, self.provinces))
+
+    def lookup(self, postal_code):
+        code = postal_code.strip()
+        if len(code) != 5 or not code.isdigit():
+            return []
+        return [self.row(i) for i in self._code_rows(code)]
+
+    def search(self, query, limit=MAX_RESULTS):
+        """
+        Rows matching every word of ``query``, each a postal code prefix or
+        the start of one of the row's names. The first word (a postal code,
+        if there is one) picks the candidates: subdistrict matches first,
+        then whole districts, then provinces.
+        """
+        terms = sorted(filter(None, map(clean_name, query.split())), key=lambda term: not term.isdigit())
+        if not terms:
+            return []
+        first, rest = terms[0], terms[1:]
+        if first.isdigit():
+            candidates = self._code_rows(first)
+        else:
+            candidates = chain(self.subdistricts.rows(first), self.districts.rows(first), self.provinces.rows(first))
+        seen = set()
+        results = []
+        for i in islice(candidates, SCAN_LIMIT):
+            if i in seen or not all(self._matches(i, term) for term in rest):
+                continue
+            seen.add(i)
+            results.append(self.row(i))
+            if len(results) == limit:
+                break
+        return results
+
+    def places(self, postal_code):
+        """The distinct (district, province) pairs a postal code is used in."""
+        return list(dict.fromkeys((row['district'], row['province']) for row in self.lookup(postal_code)))
+
+    def match(self, postal_code, district, province):
+        """
+        The (district, province) of ``postal_code`` that the district and
+        province given (either may be blank) name, spelled as in the dataset,
+        or None. Accepts the usual spellings: "อ.เมือง", "เขตบางนา", "กทม".
+        """
+        district = clean_name(district)
+        province = clean_name(province)
+        for place in self.places(postal_code):
+            known_district, known_province = map(normalize, place)
+            if province and province != known_province:
+                continue
+            # "อ.เมือง" is how most addresses name the province's capital district
+            mueang = known_district == 'เมือง' + known_province
+            if district and district != known_district and not (mueang and district == 'เมือง'):
+                continue
+            return place
+        return None
+
+
+class ThaiPostal:
+    """The worker's postal index, read from ``POSTAL_DATA`` the first time it is used."""
+
+    def __init__(self):
+        self.index = None
+        self.lock = threading.Lock()
+
+    def load(self):
+        path = getattr(settings, 'POSTAL_DATA', DEFAULT_DATA)
+        self.index = PostalIndex(read_rows(path))
+        return self.index
+
+    def get(self):
+        index = self.index
+        if index is None:
+            with self.lock:
+                index = self.index or self.load()
+        return index
+
+    def search(self, query, limit=MAX_RESULTS):
+        return self.get().search(query, limit)
+
+    def lookup(self, postal_code):
+        return self.get().lookup(postal_code)
+
+    def places(self, postal_code):
+        return self.get().places(postal_code)
+
+    def match(self, postal_code, district, province):
+        return self.get().match(postal_code, district, province)
+
+
+postal = ThaiPostal()
@@ -0,0 +1,245 @@
+import gc
+import os
+import random
+import signal
+import socket
+import sys
+import time
+from pathlib import Path
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer
+
+from django.db import connections
+
+MEMORY_FIELDS = ('Rss', 'Pss', 'Shared_Clean', 'Shared_Dirty', 'Private_Clean', 'Private_Dirty')
+
+
+def memory_stats(pid):
+    """RSS breakdown of ``pid`` in kB from /proc (Linux only), or None."""
+    try:
+        text = Path(f'/proc/{pid}/smaps_rollup').read_text()
+    except OSError:
+        return None
+    stats = {}
+    for line in text.splitlines():
+        name, _, rest = line.partition(':')
+        if name in MEMORY_FIELDS:
+            stats[name] = int(rest.split()[0])
+    return {
+        'rss': stats.get('Rss', 0),
+        'pss': stats.get('Pss', 0),
+        'shared': stats.get('Shared_Clean', 0) + stats.get('Shared_Dirty', 0),
+        'private': stats.get('Private_Clean', 0) + stats.get('Private_Dirty', 0),
+    }
+
+
+class QuietHandler(WSGIRequestHandler):
+    access_log = False
+    # seconds a slow client may hold a worker
+    timeout = 30
+
+    def log_request(self, *args, **kwargs):
+        if self.access_log:
+            super().log_request(*args, **kwargs)
+
+
+class WorkerServer(WSGIServer):
+    """wsgiref server running on a listening socket inherited from the master."""
+
+    def __init__(self, sock, app, handler):
+        super().__init__(sock.getsockname()[:2], handler, bind_and_activate=False)
+        self.socket.close()
+        self.socket = sock
+        self.server_name, self.server_port = sock.getsockname()[:2]
+        self.setup_environ()
+        self.set_app(app)
+        self.timeout = 1.0
+        self.served = 0
+
+    def finish_request(self, request, client_address):
+        self.served += 1
+        super().finish_request(request, client_address)
+
+    def handle_error(self, request, client_address):
+        # the client went away or sent garbage, keep serving
+        pass
+
+
+class Arbiter:
+    """
+    Pre-forking master. The application is loaded once here, the garbage
+    collector's view of that heap is frozen, and workers are forked from it
+    so the preloaded modules, templates and caches stay in pages shared by
+    every worker instead of being copied into each one.
+
+    Signals: TERM/INT stop gracefully, HUP replaces the workers one by one,
+    USR1 prints the memory report.
+    """
+
+    def __init__(self, app, address, workers=4, max_requests=1000, max_requests_jitter=100,
+                 graceful_timeout=30, stats_interval=0, access_log=False, freeze=True, post_fork=None, log=print):
+        self.app = app
+        self.freeze = freeze
+        # called in each new worker before it accepts connections
+        self.post_fork = post_fork
+        self.address = address
+        self.worker_count = workers
+        self.max_requests = max_requests
+        self.max_requests_jitter = max_requests_jitter
+        self.graceful_timeout = graceful_timeout
+        self.stats_interval = stats_interval
+        self.handler = type('Handler', (QuietHandler,), {'access_log': access_log})
+        self.log = log
+        self.workers = {}
+        self.retiring = {}
+        self.stopping = False
+        self.reload_requested = False
+        self.stats_requested = False
+
+    # master
+
+    def listen(self):
+        host, port = self.address
+        self.socket = socket.create_server((host, port), backlog=2048)
+        self.socket.setblocking(False)
+
+    def run(self):
+        self.listen()
+        connections.close_all()
+        # everything allocated so far is shared with the workers; keep the
+        # collector from touching (and so copying) those pages
+        if self.freeze:
+            gc.collect()
+            gc.freeze()
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+        signal.signal(signal.SIGHUP, self._on_reload)
+        signal.signal(signal.SIGUSR1, self._on_stats)
+
+        for _ in range(self.worker_count):
+            self.spawn()
+        self.log(f"[serve] master {os.getpid()} listening on http://{self.address[0]}:{self.address[1]} with {self.worker_count} workers")
+
+        next_stats = time.monotonic() + self.stats_interval if self.stats_interval else None
+        while not self.stopping:
+            self.reap()
+            if self.reload_requested:
+                self.reload_requested = False
+                self.reload()
+            if self.stats_requested or (next_stats and time.monotonic() >= next_stats):
+                self.stats_requested = False
+                self.report()
+                if next_stats:
+                    next_stats = time.monotonic() + self.stats_interval
+            while len(self.workers) < self.worker_count and not self.stopping:
+                self.spawn()
+            time.sleep(0.2)
+        self.shutdown()
+
+    def spawn(self):
+        limit = self.max_requests + random.randint(0, self.max_requests_jitter) if self.max_requests else 0
+        pid = os.fork()
+        if pid:
+            self.workers[pid] = time.monotonic()
+            return pid
+        try:
+            self.work(limit)
+            code = 0
+        except BaseException:
+            import traceback
+            traceback.print_exc()
+            code = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        os._exit(code)
+
+    def reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if not pid:
+                return
+            self.workers.pop(pid, None)
+            self.retiring.pop(pid, None)
+
+    def reload(self):
+        # rolling: start a replacement before retiring each old worker
+        for pid in list(self.workers):
+            self.workers.pop(pid)
+            self.spawn()
+            self.retiring[pid] = time.monotonic()
+            self._kill(pid, signal.SIGTERM)
+        self.log(f"[serve] replaced {len(self.retiring)} workers")
+
+    def shutdown(self):
+        self.log("[serve] shutting down")
+        for pid in list(self.workers) + list(self.retiring):
+            self._kill(pid, signal.SIGTERM)
+        deadline = time.monotonic() + self.graceful_timeout
+        while (self.workers or self.retiring) and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.1)
+        for pid in list(self.workers) + list(self.retiring):
+            self._kill(pid, signal.SIGKILL)
+        self.reap()
+        self.socket.close()
+
+    def report(self):
+        master = memory_stats(os.getpid())
+        if master is None:
+            self.log("[serve] memory report needs /proc/<pid>/smaps_rollup (Linux)")
+            return
+        rows = [('master', os.getpid(), master)]
+        rows += [('worker', pid, memory_stats(pid)) for pid in sorted(self.workers)]
+        total_pss = 0
+        for role, pid, stats in rows:
+            if stats is None:
+                continue
+            total_pss += stats['pss']
+            self.log(
+                f"[serve] {role} {pid}: rss {stats['rss'] / 1024:.1f}MB, shared {stats['shared'] / 1024:.1f}MB, "
+                f"private {stats['private'] / 1024:.1f}MB, pss {stats['pss'] / 1024:.1f}MB"
+            )
+        self.log(f"[serve] total pss {total_pss / 1024:.1f}MB for {len(self.workers)} workers")
+
+    def _kill(self, pid, sig):
+        try:
+            os.kill(pid, sig)
+        except ProcessLookupError:
+            pass
+
+    def _on_stop(self, signum, frame):
+        self.stopping = True
+
+    def _on_reload(self, signum, frame):
+        self.reload_requested = True
+
+    def _on_stats(self, signum, frame):
+        self.stats_requested = True
+
+    # worker
+
+    def work(self, limit):
+        self.worker_stopping = False
+        signal.signal(signal.SIGTERM, self._on_worker_stop)
+        # Ctrl-C reaches the whole process group; the master decides what to do
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGHUP, signal.SIG_DFL)
+        signal.signal(signal.SIGUSR1, signal.SIG_DFL)
+        gc.enable()
+        # forked workers would otherwise share one random sequence
+        random.seed()
+        if self.post_fork:
+            self.post_fork()
+
+        server = WorkerServer(self.socket, self.app, self.handler)
+        while not self.worker_stopping and not (limit and server.served >= limit):
+            if os.getppid() == 1:
+                # the master died
+                break
+            server.handle_request()
+
+    def _on_worker_stop(self, signum, frame):
+        self.worker_stopping = True
@@ -0,0 +1,185 @@
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connection
+
+TRIGGER_HEADER = 'HTTP_X_PROFILE'
+TRIGGER_COOKIE = 'profile'
+DEFAULT_INTERVAL = 0.005
+DEFAULT_KEEP = 200
+
+_SAFE_NAME = re.compile(r'^[\w.-]+$')
+_STDLIB = os.path.dirname(os.__file__)
+_LABELS = {}
+
+
+def profile_dir():
+    return Path(getattr(settings, 'PROFILE_DIR', settings.BASE_DIR / 'profiles'))
+
+
+def _label(code):
+    label = _LABELS.get(code)
+    if label is None:
+        filename = code.co_filename
+        marker = f'{os.sep}site-packages{os.sep}'
+        if marker in filename:
+            filename = filename.split(marker, 1)[1]
+        elif filename.startswith(str(settings.BASE_DIR)):
+            filename = os.path.relpath(filename, settings.BASE_DIR)
+        elif filename.startswith(_STDLIB):
+            filename = os.path.relpath(filename, _STDLIB)
+        # ';' separates frames in the collapsed format
+        label = _LABELS[code] = f"{code.co_name} ({filename}:{code.co_firstlineno})".replace(';', ':')
+    return label
+
+
+class Sampler:
+    """
+    Samples the stack of one thread from a helper thread every ``interval``
+    seconds and counts identical stacks, giving the "collapsed" format read
+    by flamegraph.pl and speedscope (``frame;frame;frame count`` per line).
+    The profiled thread runs unmodified, so the cost is one stack walk per
+    sample rather than a hook on every call.
+    """
+
+    def __init__(self, interval=DEFAULT_INTERVAL):
+        self.interval = interval
+        self.thread_id = threading.get_ident()
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_label(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+                self.samples += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def collapsed(self):
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class QueryTimer:
+    """``connection.execute_wrapper`` hook counting queries and their time."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - started
+
+
+def save_profile(sampler, meta):
+    """Write ``<name>.folded`` and ``<name>.json`` and drop the oldest beyond ``PROFILE_KEEP``."""
+    directory = profile_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    view = re.sub(r'[^\w.-]+', '_', meta['view'])[:60]
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}-{view}"
+    (directory / f'{name}.folded').write_text(sampler.collapsed())
+    (directory / f'{name}.json').write_text(json.dumps(dict(meta, name=name)))
+
+    keep = getattr(settings, 'PROFILE_KEEP', DEFAULT_KEEP)
+    for old in sorted(directory.glob('*.json'))[:-keep]:
+        old.unlink(missing_ok=True)
+        old.with_suffix('.folded').unlink(missing_ok=True)
+    return name
+
+
+def list_profiles(limit=100):
+    profiles = []
+    for path in sorted(profile_dir().glob('*.json'), reverse=True)[:limit]:
+        try:
+            profiles.append(json.loads(path.read_text()))
+        except (OSError, ValueError):
+            continue
+    return profiles
+
+
+def profile_path(name):
+    """Path of a stored profile, or None for unknown or unsafe names."""
+    if not _SAFE_NAME.match(name):
+        return None
+    path = profile_dir() / f'{name}.folded'
+    return path if path.is_file() else None
+
+
+class ProfilingMiddleware:
+    """
+    Profiles ``PROFILE_SAMPLE_RATE`` of requests, plus any request from an
+    admin carrying an ``X-Profile: 1`` header or ``profile=1`` cookie, and
+    stores the result for the admin profiles page. Requests that are not
+    sampled cost one ``random()`` call and a header lookup.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.rate = getattr(settings, 'PROFILE_SAMPLE_RATE', 0.0)
+        self.interval = getattr(settings, 'PROFILE_INTERVAL', DEFAULT_INTERVAL)
+
+    def should_profile(self, request):
+        if self.rate and random.random() < self.rate:
+            return True
+        if request.META.get(TRIGGER_HEADER) == '1' or request.COOKIES.get(TRIGGER_COOKIE) == '1':
+            from shop.views import admin_check
+            return admin_check(request.user)
+        return False
+
+    def __call__(self, request):
+        if not self.should_profile(request):
+            return self.get_response(request)
+
+        sampler = Sampler(self.interval)
+        queries = QueryTimer()
+        started = time.perf_counter()
+        cpu_started = time.thread_time()
+        sampler.start()
+        try:
+            with connection.execute_wrapper(queries):
+                response = self.get_response(request)
+        finally:
+            sampler.stop()
+        wall = time.perf_counter() - started
+
+        match = request.resolver_match
+        name = save_profile(sampler, {
+            'view': match.view_name if match else 'unresolved',
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'started': time.time() - wall,
+            'wall_ms': round(wall * 1000, 1),
+            'cpu_ms': round((time.thread_time() - cpu_started) * 1000, 1),
+            'db_ms': round(queries.seconds * 1000, 1),
+            'queries': queries.count,
+            'samples': sampler.samples,
+        })
+        response['X-Profile-Id'] = name
+        return response
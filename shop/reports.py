@@ -0,0 +1,146 @@
+from collections import Counter
+
+from django.db import connection, transaction
+from django.db.models import F, Sum
+from django.db.models.functions import TruncDate, TruncMonth, TruncWeek
+
+from shop.models import Order, OrderItem, Product, Category, ProductSalesDaily, CategorySalesDaily, RolledUpOrder
+from shop.sharding import shards, writable
+
+# once an order reaches any of these it counts as sold
+SOLD_STATUSES = ('paid', 'shipping', 'delivered')
+
+PERIODS = {
+    'day': None,
+    'week': TruncWeek,
+    'month': TruncMonth,
+}
+
+
+def _upsert(model, key_column, rows):
+    """Add ``(day, key, units, revenue)`` rows onto the rollup, creating missing ones."""
+    if not rows:
+        return
+    qn = connection.ops.quote_name
+    table = qn(model._meta.db_table)
+    key = qn(key_column)
+    sql = (
+        f"INSERT INTO {table} (day, {key}, units, revenue) VALUES (%s, %s, %s, %s) "
+        f"ON CONFLICT (day, {key}) DO UPDATE SET "
+        f"units = {table}.units + excluded.units, revenue = {table}.revenue + excluded.revenue"
+    )
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, rows)
+
+
+def record_orders(order_ids, using='default', sign=1):
+    """
+    Fold the items of ``order_ids`` (on shard ``using``) into the daily
+    product and category rollups, or take them back out with ``sign=-1``.
+    Items are summed per product on the shard; categories live on default,
+    so they are added up here.
+
+    Every recorded order is listed in RolledUpOrder on default. Orders
+    already listed are skipped when adding and unlisted ones when taking
+    back out, so calling this twice for the same orders counts them once.
+    Run it inside a default transaction so the list and the rollups commit
+    together. Returns the ids that were applied.
+    """
+    listed = set(RolledUpOrder.objects.filter(order_id__in=order_ids).values_list('order_id', flat=True))
+    if sign > 0:
+        order_ids = [order_id for order_id in order_ids if order_id not in listed]
+        RolledUpOrder.objects.bulk_create([RolledUpOrder(order_id=order_id) for order_id in order_ids])
+    else:
+        order_ids = [order_id for order_id in order_ids if order_id in listed]
+        RolledUpOrder.objects.filter(order_id__in=order_ids).delete()
+    if not order_ids:
+        return order_ids
+
+    items = OrderItem.objects.using(using).filter(order_id__in=order_ids, product__isnull=False)
+    product_rows = list(
+        items.annotate(day=TruncDate('order__created_at'))
+        .values('day', 'product_id')
+        .annotate(units=Sum('quantity'), revenue=Sum(F('quantity') * F('unit_price')))
+        .values_list('day', 'product_id', 'units', 'revenue')
+    )
+    product_rows = [(day, product_id, units * sign, revenue * sign) for day, product_id, units, revenue in product_rows]
+    categories = {}
+    for product_id, category_id in Product.categories.through.objects.filter(
+        product_id__in={row[1] for row in product_rows}
+    ).values_list('product_id', 'category_id'):
+        categories.setdefault(product_id, []).append(category_id)
+    units, revenue = Counter(), Counter()
+    for day, product_id, product_units, product_revenue in product_rows:
+        for category_id in categories.get(product_id, ()):
+            units[day, category_id] += product_units
+            revenue[day, category_id] += product_revenue
+    category_rows = [(day, category_id, units[day, category_id], revenue[day, category_id]) for day, category_id in units]
+
+    _upsert(ProductSalesDaily, 'product_id', product_rows)
+    _upsert(CategorySalesDaily, 'category_id', category_rows)
+    return order_ids
+
+
+def roll_up_paid_orders(batch_size=1000, id_range=None):
+    """
+    Record every sold order that is not in the rollups yet, and take back
+    out every recorded one that is no longer sold (a paid order that was
+    cancelled), shard by shard, ``batch_size`` orders per transaction. Rows are claimed with SKIP
+    LOCKED so several workers (or backfill processes) never count an order
+    twice. On another shard the rollups commit on default before the
+    ``sales_recorded`` flags are flipped; if a crash comes in between, the
+    batch is claimed again and record_orders() skips the orders it already
+    counted. Returns the number of orders recorded.
+    """
+    recorded = 0
+    for using in shards():
+        recorded += _roll_up(using, batch_size, id_range)
+        _roll_up(using, batch_size, id_range, sold=False)
+    return recorded
+
+
+def _roll_up(using, batch_size, id_range, sold=True):
+    total = 0
+    while True:
+        with transaction.atomic(using=using):
+            pending = Order.objects.using(using).select_for_update(skip_locked=True)
+            if sold:
+                pending = pending.filter(sales_recorded=False, status__in=SOLD_STATUSES)
+            else:
+                pending = pending.filter(sales_recorded=True).exclude(status__in=SOLD_STATUSES)
+            pending = writable(pending)
+            if id_range:
+                pending = pending.filter(id__gte=id_range[0], id__lt=id_range[1])
+            ids = list(pending.order_by('id').values_list('id', flat=True)[:batch_size])
+            if not ids:
+                return total
+            with transaction.atomic():
+                applied = record_orders(ids, using, sign=1 if sold else -1)
+            # only after the rollups and their ledger have committed
+            Order.objects.using(using).filter(id__in=ids).update(sales_recorded=sold)
+        total += len(applied)
+
+
+def sales_report(start, end, period='day', group='product'):
+    """
+    Revenue and units per period for ``start <= day <= end`` read only from
+    the rollup tables. Returns a list of dicts ordered by period then revenue.
+    """
+    if group == 'category':
+        model, key, names = CategorySalesDaily, 'category_id', Category.objects
+    else:
+        model, key, names = ProductSalesDaily, 'product_id', Product.objects
+
+    rows = model.objects.filter(day__gte=start, day__lte=end)
+    trunc = PERIODS.get(period)
+    rows = rows.annotate(period=trunc('day') if trunc else F('day'))
+    rows = list(
+        rows.values('period', key)
+        .annotate(units=Sum('units'), revenue=Sum('revenue'))
+        .order_by('period', '-revenue')
+    )
+
+    labels = dict(names.filter(id__in={row[key] for row in rows}).values_list('id', 'name'))
+    for row in rows:
+        row['name'] = labels.get(row[key], f"#{row[key]} (ถูกลบแล้ว)")
+    return rows
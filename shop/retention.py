@@ -0,0 +1,109 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from shop.models import ActivityLog, Cart, CartItem
+
+# days to keep activity logs: 'default' plus optional per-category overrides
+DEFAULT_RETENTION = {'default': 365}
+DEFAULT_CART_IDLE_DAYS = 60
+DEFAULT_EMPTY_CART_IDLE_DAYS = 7
+
+
+def retention_policy():
+    policy = dict(DEFAULT_RETENTION)
+    policy.update(getattr(settings, 'ACTIVITY_LOG_RETENTION_DAYS', {}))
+    return policy
+
+
+def expired_logs(now=None):
+    """Yield ``(rule, queryset)`` for the logs each retention rule has expired."""
+    now = now or timezone.now()
+    policy = retention_policy()
+    overrides = [category for category in policy if category != 'default']
+    for rule, days in policy.items():
+        logs = ActivityLog.objects.filter(timestamp__lt=now - timedelta(days=days))
+        if rule == 'default':
+            logs = logs.exclude(category__in=overrides)
+        else:
+            logs = logs.filter(category=rule)
+        yield rule, logs
+
+
+def purge_activity_logs(batch_size=5000, pause=0.0, now=None):
+    """
+    Delete expired logs oldest first, ``batch_size`` rows per statement so
+    no single transaction holds locks on a large range. Returns
+    ``{rule: deleted}``.
+    """
+    deleted = {}
+    for rule, logs in expired_logs(now):
+        total = 0
+        while True:
+            # the oldest rows sit at the start of the (timestamp, id) indexes
+            ids = list(logs.order_by('timestamp', 'id').values_list('id', flat=True)[:batch_size])
+            if not ids:
+                break
+            ActivityLog.objects.filter(id__in=ids).delete()
+            total += len(ids)
+            if len(ids) < batch_size:
+                break
+            time.sleep(pause)
+        deleted[rule] = total
+    return deleted
+
+
+def idle_carts(now=None):
+    """
+    Yield ``(rule, queryset)`` for carts with no activity for CART_IDLE_DAYS
+    ('idle') and for empty ones idle for EMPTY_CART_IDLE_DAYS ('empty').
+    """
+    now = now or timezone.now()
+    idle_days = getattr(settings, 'CART_IDLE_DAYS', DEFAULT_CART_IDLE_DAYS)
+    empty_days = getattr(settings, 'EMPTY_CART_IDLE_DAYS', DEFAULT_EMPTY_CART_IDLE_DAYS)
+    idle_since = now - timedelta(days=idle_days)
+    yield 'idle', Cart.objects.filter(last_activity__lt=idle_since)
+    filled = CartItem.objects.filter(cart=OuterRef('pk'))
+    empty = Cart.objects.filter(last_activity__gte=idle_since, last_activity__lt=now - timedelta(days=empty_days))
+    yield 'empty', empty.exclude(Exists(filled))
+
+
+def purge_carts(batch_size=1000, pause=0.0, now=None, limit=None, progress=None):
+    """
+    Delete idle carts and their items oldest first, ``batch_size`` carts per
+    transaction, walking the (last_activity, id) index with a cursor so rows
+    a rule skips are not scanned again. Every batch commits on its own, so
+    an interrupted run loses nothing and the next run carries on from the
+    oldest cart left. ``progress(rule, carts, items, reached)`` is called
+    after each batch. Returns ``{rule: (carts, items)}``.
+    """
+    deleted = {}
+    remaining = limit
+    for rule, carts in idle_carts(now):
+        total_carts = total_items = 0
+        cursor = None
+        while remaining is None or remaining > 0:
+            batch = carts
+            if cursor:
+                batch = batch.filter(Q(last_activity__gt=cursor[0]) | Q(last_activity=cursor[0], id__gt=cursor[1]))
+            size = batch_size if remaining is None else min(batch_size, remaining)
+            rows = list(batch.order_by('last_activity', 'id').values_list('last_activity', 'id')[:size])
+            if not rows:
+                break
+            cursor = rows[-1]
+            # re-filtered by the rule: a cart touched (or filled) since the scan is no longer idle and stays
+            _, per_model = carts.filter(id__in=[pk for _, pk in rows]).delete()
+            total_carts += per_model.get(Cart._meta.label, 0)
+            total_items += per_model.get(CartItem._meta.label, 0)
+            if remaining is not None:
+                remaining -= len(rows)
+            if progress:
+                progress(rule, total_carts, total_items, cursor[0])
+            if len(rows) < size:
+                break
+            time.sleep(pause)
+        deleted[rule] = (total_carts, total_items)
+    return deleted
@@ -0,0 +1,46 @@
+import hashlib
+
+from django.contrib.sessions.backends import cached_db
+
+# new fields go at the end so lists packed before them still unpack
+CHECKOUT_FIELDS = ('receiver_name', 'phone', 'address_line', 'payment_method', 'city', 'province', 'postal_code')
+
+
+class SessionStore(cached_db.SessionStore):
+    """
+    ``cached_db`` session engine that reads from the cache and falls back to
+    ``django_session``, but skips the write entirely when a request marked the
+    session modified without actually changing its contents (for example
+    popping and re-setting the same flash or checkout data).
+    """
+
+    def load(self):
+        data = super().load()
+        self._loaded_fingerprint = self._fingerprint(data)
+        return data
+
+    def _fingerprint(self, data):
+        return hashlib.blake2b(self.serializer().dumps(data), digest_size=16).digest()
+
+    def save(self, must_create=False):
+        loaded = getattr(self, '_loaded_fingerprint', None)
+        if not must_create and loaded is not None and self.session_key is not None:
+            current = self._fingerprint(self._get_session(no_load=True))
+            if current == loaded:
+                return
+        super().save(must_create=must_create)
+        self._loaded_fingerprint = self._fingerprint(self._get_session(no_load=True))
+
+
+def pack_checkout_info(cleaned_data):
+    """Store checkout details as a positional list instead of a keyed dict."""
+    return [cleaned_data.get(field, '') for field in CHECKOUT_FIELDS]
+
+
+def unpack_checkout_info(packed):
+    if not packed:
+        return None
+    if isinstance(packed, dict):
+        # sessions written before the compact format
+        return packed
+    return dict(zip(CHECKOUT_FIELDS, packed))
@@ -0,0 +1,406 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections, transaction
+from django.db.models import Count, Max, Sum
+
+from shop.models import Order, OrderItem, Payment, ShardBucket
+
+DEFAULT_BUCKETS = 1024
+DEFAULT_ID_STRIDE = 16
+DEFAULT_MAP_TTL = 5.0
+SHARDED = (Order, OrderItem, Payment)
+
+_relocating = contextvars.ContextVar('relocating', default=False)
+
+
+class ShardMoving(Exception):
+    """A write to a bucket of orders the rebalancer is moving; retry in a few seconds."""
+
+
+def shards():
+    """Database aliases holding orders, in ``ORDER_SHARDS`` order: a shard's number is its position."""
+    return list(getattr(settings, 'ORDER_SHARDS', ['default']))
+
+
+def bucket_count():
+    return getattr(settings, 'ORDER_SHARD_BUCKETS', DEFAULT_BUCKETS)
+
+
+def id_stride():
+    return getattr(settings, 'ORDER_ID_STRIDE', DEFAULT_ID_STRIDE)
+
+
+def bucket_of(user_id):
+    # guest orders (no user) all share bucket 0
+    return (user_id or 0) % bucket_count()
+
+
+def shard_number(alias):
+    aliases = shards()
+    if len(aliases) > id_stride():
+        raise ImproperlyConfigured(f"ORDER_SHARDS has {len(aliases)} databases, ORDER_ID_STRIDE allows {id_stride()}")
+    if alias not in aliases:
+        raise ImproperlyConfigured(f"{alias!r} is not in ORDER_SHARDS")
+    return aliases.index(alias)
+
+
+class BucketMap:
+    """
+    Where each bucket lives, read from ShardBucket on ``default`` and kept
+    in the process for ``ORDER_SHARD_MAP_TTL`` seconds. Buckets without a
+    row are on the first shard. With a single shard there is nothing to
+    look up and the table is never read.
+    """
+
+    def __init__(self):
+        self.placement = {}
+        self.moving = frozenset()
+        self.loaded_at = None
+        self.lock = threading.Lock()
+
+    def ttl(self):
+        return getattr(settings, 'ORDER_SHARD_MAP_TTL', DEFAULT_MAP_TTL)
+
+    def refresh(self, force=False):
+        if not force and self.loaded_at is not None and time.monotonic() - self.loaded_at < self.ttl():
+            return
+        with self.lock:
+            rows = list(ShardBucket.objects.using('default').values_list('bucket', 'database', 'moving'))
+            self.placement = {bucket: database for bucket, database, _ in rows}
+            self.moving = frozenset(bucket for bucket, _, moving in rows if moving)
+            self.loaded_at = time.monotonic()
+
+    def shard_of(self, bucket):
+        aliases = shards()
+        if len(aliases) == 1:
+            return aliases[0]
+        self.refresh()
+        return self.placement.get(bucket, aliases[0])
+
+    def moving_buckets(self):
+        if len(shards()) == 1:
+            return frozenset()
+        self.refresh()
+        return self.moving
+
+
+bucket_map = BucketMap()
+
+
+def shard_for(user_id, write=False):
+    """The database holding ``user_id``'s orders; ``write`` raises ShardMoving while they are being moved."""
+    bucket = bucket_of(user_id)
+    if write and bucket in bucket_map.moving_buckets():
+        raise ShardMoving(f"bucket {bucket} is being moved")
+    return bucket_map.shard_of(bucket)
+
+
+def orders_of(user):
+    """The user's orders, read from their shard."""
+    return Order.objects.using(shard_for(user.pk)).filter(user_id=user.pk)
+
+
+def writable(queryset):
+    """``queryset`` without the rows of buckets that are being moved."""
+    moving = bucket_map.moving_buckets()
+    if not moving:
+        return queryset
+    if queryset.model is Order:
+        return queryset.exclude(bucket__in=moving)
+    return queryset.exclude(order__bucket__in=moving)
+
+
+def each_shard(queryset, write=False):
+    """
+    ``queryset`` on every shard in turn, or only on the one it was pinned to
+    with ``using()``. With ``write`` the rows of buckets being moved are
+    left out, so bulk updates cannot land on a copy about to be dropped.
+    """
+    aliases = [queryset._db] if queryset._db else shards()
+    for alias in aliases:
+        shard_queryset = queryset.using(alias)
+        yield writable(shard_queryset) if write else shard_queryset
+
+
+def count(queryset):
+    return sum(shard_queryset.count() for shard_queryset in each_shard(queryset))
+
+
+def total(queryset, field):
+    return sum(shard_queryset.aggregate(total=Sum(field))['total'] or 0 for shard_queryset in each_shard(queryset))
+
+
+def find_order(order_id, queryset=None):
+    """
+    The order with ``order_id`` from whichever shard holds it, asking the
+    shard that created it first (a rebalance may have moved it since).
+    Raises Order.DoesNotExist.
+    """
+    queryset = Order.objects.all() if queryset is None else queryset
+    aliases = shards()
+    home = order_id % id_stride()
+    if home < len(aliases):
+        aliases.insert(0, aliases.pop(home))
+    for alias in aliases:
+        try:
+            return queryset.using(alias).get(id=order_id)
+        except Order.DoesNotExist:
+            pass
+    raise Order.DoesNotExist(f"order {order_id} is on none of {', '.join(shards())}")
+
+
+def _next_id(high, number, stride):
+    """The smallest id above ``high`` that belongs to shard ``number``."""
+    candidate = high - high % stride + number
+    return candidate if candidate > high else candidate + stride
+
+
+def next_order_id(using):
+    """
+    Id for a new order on ``using``, or None where the database's own
+    sequence hands them out (PostgreSQL, see prepare_sequence()). Shard k
+    only uses ids with ``id % ORDER_ID_STRIDE == k``, so ids stay unique
+    across shards. Elsewhere it is the next such id above the shard's
+    highest, which two concurrent writers can both pick: fine for local
+    testing on SQLite, where writes are serialised anyway.
+    """
+    if connections[using].vendor == 'postgresql':
+        return None
+    high = Order.objects.using(using).aggregate(high=Max('id'))['high'] or 0
+    return _next_id(high, shard_number(using), id_stride())
+
+
+def prepare_sequence(using, restart=False):
+    """
+    Make the PostgreSQL sequence behind Order.id on shard ``using`` count in
+    steps of ``ORDER_ID_STRIDE`` from the next id of that shard above every
+    id it holds. Runs after each ``migrate``; a sequence already stepping by
+    the stride is left alone unless ``restart`` (after writing explicit
+    ids). Returns whether it was changed.
+    """
+    connection = connections[using]
+    if connection.vendor != 'postgresql' or using not in shards():
+        return False
+    stride = id_stride()
+    table = Order._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [table])
+        sequence = cursor.fetchone()[0]
+        cursor.execute("SELECT seqincrement FROM pg_sequence WHERE seqrelid = %s::regclass", [sequence])
+        if cursor.fetchone()[0] == stride and not restart:
+            return False
+        cursor.execute(f"SELECT COALESCE(MAX(id), 0) FROM {connection.ops.quote_name(table)}")
+        start = _next_id(cursor.fetchone()[0], shard_number(using), stride)
+        cursor.execute(f"ALTER SEQUENCE {sequence} INCREMENT BY {stride} RESTART WITH {start}")
+    return True
+
+
+class ShardRouter:
+    """
+    Sends orders, their items and payments to the shard of the user's
+    bucket (ORDER_SHARDS, shop.sharding) and every other model to
+    ``default``. A query only reaches the right shard with a hint: a
+    related manager or a fetched instance, ``using()``, or one of the
+    helpers above; an unhinted read of a sharded model goes to ``default``.
+    Every shard carries the full schema, only the order tables are used.
+    """
+
+    def db_for_read(self, model, **hints):
+        return self._route(model, hints.get('instance'), write=False)
+
+    def db_for_write(self, model, **hints):
+        return self._route(model, hints.get('instance'), write=True)
+
+    def _route(self, model, instance, write):
+        if model not in SHARDED:
+            return 'default'
+        if isinstance(instance, Order):
+            if instance._state.adding:
+                return shard_for(instance.user_id, write)
+            if write and instance.bucket in bucket_map.moving_buckets():
+                raise ShardMoving(f"bucket {instance.bucket} is being moved")
+            return instance._state.db
+        if isinstance(instance, (OrderItem, Payment)):
+            order = instance._state.fields_cache.get('order')
+            if order is None:
+                return instance._state.db
+            if write and order.bucket in bucket_map.moving_buckets():
+                raise ShardMoving(f"bucket {order.bucket} is being moved")
+            return order._state.db or instance._state.db
+        if isinstance(instance, get_user_model()):
+            return shard_for(instance.pk, write)
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # orders point at users and products on default
+        sharded = [isinstance(obj, SHARDED) for obj in (obj1, obj2)]
+        if any(sharded) and not all(sharded):
+            return True
+        return None
+
+
+# moving buckets
+
+def is_relocating():
+    """True while rows are being copied or dropped by a move, which is not a change of the orders."""
+    return _relocating.get()
+
+
+@contextmanager
+def relocating():
+    token = _relocating.set(True)
+    try:
+        yield
+    finally:
+        _relocating.reset(token)
+
+
+def placement():
+    """``{alias: {bucket: orders}}`` of the rows each shard holds now."""
+    return {
+        alias: dict(Order.objects.using(alias).order_by().values_list('bucket').annotate(n=Count('id')))
+        for alias in shards()
+    }
+
+
+def plan_moves(sizes, limit=None):
+    """
+    Moves ``[(bucket, source, target)]`` that even out the shards. Each
+    bucket weighs its orders plus one, so buckets of users who have not
+    ordered yet are spread as well; every move takes the largest bucket of
+    the heaviest shard that fits in half the gap to the lightest.
+    """
+    aliases = shards()
+    buckets = {alias: {} for alias in aliases}
+    for bucket in range(bucket_count()):
+        buckets.setdefault(bucket_map.shard_of(bucket), {})[bucket] = 1
+    for counts in sizes.values():
+        for bucket, orders in counts.items():
+            buckets[bucket_map.shard_of(bucket)][bucket] += orders
+    loads = {alias: sum(weights.values()) for alias, weights in buckets.items()}
+
+    moves = []
+    while limit is None or len(moves) < limit:
+        heavy = max(aliases, key=loads.get)
+        light = min(aliases, key=loads.get)
+        half_gap = (loads[heavy] - loads[light]) // 2
+        fitting = [(weight, bucket) for bucket, weight in buckets[heavy].items() if weight <= half_gap]
+        if not fitting:
+            break
+        weight, bucket = max(fitting)
+        del buckets[heavy][bucket]
+        buckets[light][bucket] = weight
+        loads[heavy] -= weight
+        loads[light] += weight
+        moves.append((bucket, heavy, light))
+    return moves
+
+
+def _copy(model, rows, using, keep_pk):
+    """INSERT ``rows`` as they are; bulk_create() would stamp auto_now_add columns with the current time."""
+    if not rows:
+        return
+    connection = connections[using]
+    fields = [field for field in model._meta.concrete_fields if keep_pk or not field.primary_key]
+    qn = connection.ops.quote_name
+    sql = (
+        f"INSERT INTO {qn(model._meta.db_table)} ({', '.join(qn(field.column) for field in fields)}) "
+        f"VALUES ({', '.join(['%s'] * len(fields))})"
+    )
+    values = [[field.get_db_prep_value(getattr(row, field.attname), connection) for field in fields] for row in rows]
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, values)
+
+
+def copy_bucket(bucket, source, target, batch_size=1000):
+    """
+    Copy the bucket's orders (ids kept), items and payments (new ids) from
+    ``source`` to ``target`` in one transaction on the target, replacing
+    whatever an interrupted earlier move left there. Returns the order ids.
+    """
+    copied = []
+    with relocating(), transaction.atomic(using=target):
+        Order.objects.using(target).filter(bucket=bucket).delete()
+        last = 0
+        while True:
+            orders = list(Order.objects.using(source).filter(bucket=bucket, id__gt=last).order_by('id')[:batch_size])
+            if not orders:
+                break
+            ids = [order.id for order in orders]
+            last = ids[-1]
+            _copy(Order, orders, target, keep_pk=True)
+            _copy(OrderItem, list(OrderItem.objects.using(source).filter(order_id__in=ids)), target, keep_pk=False)
+            _copy(Payment, list(Payment.objects.using(source).filter(order_id__in=ids)), target, keep_pk=False)
+            copied += ids
+    return copied
+
+
+def drop_rows(alias, ids, batch_size=1000):
+    with relocating():
+        for start in range(0, len(ids), batch_size):
+            Order.objects.using(alias).filter(id__in=ids[start:start + batch_size]).delete()
+
+
+def move_buckets(moves, wait=None, batch_size=1000, log=None):
+    """
+    Move each ``(bucket, source, target)``. The buckets are marked moving,
+    which makes order writes to them fail with ShardMoving, and the move
+    waits ``wait`` seconds (the map TTL plus a second by default) for every
+    process to see that before copying. Once the copies match the source
+    the map points at the targets, and after another wait, when no process
+    reads the old placement any more, the source rows are dropped. Moves
+    are not changes of the orders, so no change events are written for
+    them; items and payments get new ids on their new shard. Returns the
+    number of orders moved.
+    """
+    if not moves:
+        return 0
+    log = log or (lambda message: None)
+    wait = bucket_map.ttl() + 1 if wait is None else wait
+    for bucket, source, _ in moves:
+        ShardBucket.objects.update_or_create(bucket=bucket, defaults={'database': source, 'moving': True})
+    log(f"marked {len(moves)} buckets moving, waiting {wait:.0f}s")
+    time.sleep(wait)
+
+    copied = {}
+    try:
+        for bucket, source, target in moves:
+            ids = copy_bucket(bucket, source, target, batch_size)
+            # a process that had yet to see the flag may still have added one
+            if set(ids) != set(Order.objects.using(source).filter(bucket=bucket).values_list('id', flat=True)):
+                ids = copy_bucket(bucket, source, target, batch_size)
+            copied[bucket] = ids
+            log(f"copied bucket {bucket}: {len(ids)} orders {source} -> {target}")
+    except Exception:
+        # the source still has every row: drop the partial copies and let writes in again
+        for bucket, source, target in moves:
+            drop_rows(target, list(Order.objects.using(target).filter(bucket=bucket).values_list('id', flat=True)))
+            ShardBucket.objects.filter(bucket=bucket).update(moving=False)
+        raise
+
+    for bucket, _, target in moves:
+        ShardBucket.objects.filter(bucket=bucket).update(database=target, moving=False)
+    bucket_map.refresh(force=True)
+    log(f"switched {len(moves)} buckets, waiting {wait:.0f}s before dropping the old rows")
+    time.sleep(wait)
+
+    for bucket, source, _ in moves:
+        drop_rows(source, copied[bucket], batch_size)
+    return sum(len(ids) for ids in copied.values())
+
+
+def misplaced():
+    """``{alias: {bucket: order ids}}`` of rows on a shard their bucket no longer maps to."""
+    found = {}
+    for alias in shards():
+        rows = Order.objects.using(alias).order_by().values_list('bucket', 'id')
+        for bucket, pk in rows.iterator():
+            if bucket_map.shard_of(bucket) != alias:
+                found.setdefault(alias, {}).setdefault(bucket, []).append(pk)
+    return found
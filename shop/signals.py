@@ -0,0 +1,115 @@
+from django.db.models.signals import post_save, post_delete, post_migrate, m2m_changed
+from django.dispatch import receiver
+
+from shop.auth_backends import invalidate_user
+from shop.autocomplete import autocomplete
+from shop.changes import record
+from shop.models import User, Address, Product, Category, Order, Payment
+from shop.sharding import is_relocating, prepare_sequence, shards
+from shop.snapshots import PRODUCT, LIST, make_key, list_keys, refresh
+
+# saves touching only these leave names and rendered pages unchanged (checkout stock updates)
+STOCK_FIELDS = {'stock', 'updated_at'}
+
+
+def _stock_only(update_fields):
+    return update_fields is not None and set(update_fields) <= STOCK_FIELDS
+
+
+@receiver([post_save, post_delete], sender=User)
+def drop_cached_user(sender, instance, **kwargs):
+    invalidate_user(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=Address)
+def drop_cached_user_address(sender, instance, **kwargs):
+    invalidate_user(instance.user_id)
+
+
+@receiver(post_save, sender=Product)
+def index_product_name(sender, instance, update_fields=None, **kwargs):
+    if not _stock_only(update_fields):
+        autocomplete.product_changed(instance)
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product_name(sender, instance, **kwargs):
+    autocomplete.product_deleted(instance.pk)
+
+
+@receiver(post_save, sender=Product)
+def refresh_product_snapshots(sender, instance, update_fields=None, **kwargs):
+    if _stock_only(update_fields):
+        return
+    newest = Product.objects.order_by('-id').values_list('id', flat=True)[:4]
+    if instance.pk in newest:
+        # shown as a recommended product on every list page
+        keys = list_keys()
+    else:
+        keys = [make_key(LIST)] + [make_key(LIST, pk) for pk in instance.categories.values_list('id', flat=True)]
+    refresh([make_key(PRODUCT, instance.pk)] + keys)
+
+
+@receiver(post_delete, sender=Product)
+def drop_product_snapshots(sender, instance, **kwargs):
+    refresh([make_key(PRODUCT, instance.pk)] + list_keys())
+
+
+@receiver([post_save, post_delete], sender=Category)
+def refresh_list_snapshots(sender, instance, **kwargs):
+    # every list page has the category menu
+    refresh(list_keys())
+
+
+@receiver(m2m_changed, sender=Product.categories.through)
+def refresh_category_snapshots(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if reverse:
+        category_ids = [instance.pk]
+    elif action == 'pre_clear':
+        category_ids = list(instance.categories.values_list('id', flat=True))
+    else:
+        category_ids = pk_set
+    refresh([make_key(LIST, pk) for pk in category_ids])
+
+
+# saves are recorded by ChangeTracked.save(); deletes and category changes run
+# inside Django's own transaction, so they are recorded here
+
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=Order)
+@receiver(post_delete, sender=Payment)
+def record_delete(sender, instance, using, **kwargs):
+    if is_relocating():
+        return
+    record(sender.change_topic, [instance.pk], 'delete', using=using)
+
+
+@receiver(m2m_changed, sender=Product.categories.through)
+def record_product_categories(sender, instance, action, reverse, pk_set, using, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        product_ids = [instance.pk]
+    elif action == 'pre_clear':
+        product_ids = list(instance.products.values_list('id', flat=True))
+    else:
+        product_ids = pk_set
+    record(Product.change_topic, sorted(product_ids), using=using)
+
+
+# orders of a deleted user on other shards than default keep their row, like
+# the ones SET_NULL clears on default
+@receiver(post_delete, sender=User)
+def detach_sharded_orders(sender, instance, using, **kwargs):
+    for alias in shards():
+        if alias != using:
+            Order.objects.using(alias).filter(user_id=instance.pk).update(user=None)
+
+
+@receiver(post_migrate)
+def stride_order_ids(sender, using, **kwargs):
+    if sender.name == 'shop':
+        prepare_sequence(using)
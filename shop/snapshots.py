@@ -0,0 +1,150 @@
+import os
+import re
+import time
+from functools import wraps
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.messages import get_messages
+from django.contrib.messages.api import MessageFailure
+from django.db import transaction
+from django.http import HttpRequest, HttpResponse
+from django.middleware.csrf import get_token
+
+from shop.models import Category
+from shop.task_queue import enqueue
+
+ALL = 'all'
+PRODUCT = 'product'
+LIST = 'list'
+CSRF_PLACEHOLDER = b'__snapshot_csrf_token__'
+DEFAULT_MAX_AGE = 24 * 60 * 60
+
+_CSRF_INPUT = re.compile(rb'(name="csrfmiddlewaretoken" value=")[^"]*(")')
+
+# kind -> undecorated view, filled in by @snapshot
+RENDERERS = {}
+
+
+def snapshot_dir():
+    return Path(getattr(settings, 'SNAPSHOT_DIR', settings.BASE_DIR / 'snapshots'))
+
+
+def make_key(kind, ident=None):
+    return f"{kind}:{ALL if ident is None else ident}"
+
+
+def key_path(key):
+    kind, ident = key.split(':', 1)
+    return snapshot_dir() / kind / f'{ident}.html'
+
+
+def list_keys():
+    """Keys of every product list page: all products plus one per category."""
+    return [make_key(LIST)] + [make_key(LIST, pk) for pk in Category.objects.values_list('id', flat=True)]
+
+
+def _cacheable(request):
+    # snapshots are anonymous first-page renders, anything else is live
+    return (
+        request.method == 'GET'
+        and not request.META.get('QUERY_STRING')
+        and not request.user.is_authenticated
+        and not len(get_messages(request))
+    )
+
+
+def snapshot(kind):
+    """
+    Serve the view from its pre-rendered snapshot when one is fresh and
+    the request would render the same HTML, otherwise render it live.
+    The view must take at most one URL argument, which identifies the page.
+    """
+    def decorator(view):
+        RENDERERS[kind] = view
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if _cacheable(request):
+                ident = args[0] if args else next(iter(kwargs.values()), None)
+                response = load(make_key(kind, ident), request)
+                if response is not None:
+                    return response
+            return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def load(key, request):
+    path = key_path(key)
+    try:
+        age = time.time() - path.stat().st_mtime
+        if age > getattr(settings, 'SNAPSHOT_MAX_AGE', DEFAULT_MAX_AGE):
+            # answer live from now on and let the worker write a new one
+            path.unlink(missing_ok=True)
+            refresh([key])
+            return None
+        html = path.read_bytes()
+    except FileNotFoundError:
+        return None
+    if CSRF_PLACEHOLDER in html:
+        html = html.replace(CSRF_PLACEHOLDER, get_token(request).encode())
+    response = HttpResponse(html)
+    response['X-Snapshot'] = 'hit'
+    return response
+
+
+def render(key):
+    """Render ``key`` as an anonymous visitor would see it, or None if the page is gone."""
+    from shop import views  # noqa: F401  (registers the renderers)
+
+    kind, ident = key.split(':', 1)
+    request = HttpRequest()
+    request.method = 'GET'
+    request.META = {'SERVER_NAME': 'localhost', 'SERVER_PORT': '80'}
+    request.user = AnonymousUser()
+    view = RENDERERS[kind]
+    try:
+        response = view(request) if ident == ALL else view(request, int(ident))
+    except MessageFailure:
+        # the view tried to flash "not found" and redirect
+        return None
+    if response.status_code != 200:
+        return None
+    return _CSRF_INPUT.sub(rb'\g<1>' + CSRF_PLACEHOLDER + rb'\g<2>', response.content)
+
+
+def write(key, html):
+    path = key_path(key)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f'.{path.name}.{os.getpid()}')
+    tmp.write_bytes(html)
+    tmp.replace(path)
+
+
+def drop(keys):
+    for key in keys:
+        key_path(key).unlink(missing_ok=True)
+
+
+def refresh(keys):
+    """Drop ``keys`` when the current transaction commits and queue their regeneration."""
+    from shop.tasks import regenerate_snapshots
+
+    keys = sorted(set(keys))
+    transaction.on_commit(lambda: drop(keys))
+    enqueue(regenerate_snapshots, keys)
+
+
+def regenerate(keys):
+    """Re-render ``keys``; pages that no longer exist lose their snapshot. Returns pages written."""
+    written = 0
+    for key in keys:
+        html = render(key)
+        if html is None:
+            drop([key])
+        else:
+            write(key, html)
+            written += 1
+    return written
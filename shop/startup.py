@@ -0,0 +1,108 @@
+import time
+from importlib import import_module
+
+from django.template import TemplateDoesNotExist, engines
+from django.template.utils import get_app_template_dirs
+from django.urls import URLPattern, URLResolver, get_resolver
+
+
+class LazyView:
+    """
+    URL callback that imports its view module on the first request instead
+    of when the URLconf is loaded. Name attributes are known up front, so
+    building the resolver and ``reverse()`` never trigger the import; any
+    other attribute (``csrf_exempt`` and the like) loads the real view.
+    """
+
+    def __init__(self, module, name, initkwargs=None):
+        self.__module__ = module
+        self.__name__ = self.__qualname__ = name
+        self._initkwargs = initkwargs
+        self._view = None
+
+    def load(self):
+        if self._view is None:
+            view = getattr(import_module(self.__module__), self.__name__)
+            if self._initkwargs is not None:
+                view = view.as_view(**self._initkwargs)
+            self._view = view
+        return self._view
+
+    def as_view(self, **initkwargs):
+        return LazyView(self.__module__, self.__name__, initkwargs)
+
+    def __call__(self, request, *args, **kwargs):
+        return self.load()(request, *args, **kwargs)
+
+    def __getattr__(self, name):
+        # URLPattern.lookup_str probes view_class; answering it would mean
+        # importing every view the first time anything is reversed
+        if name == 'view_class' and self._view is None:
+            raise AttributeError(name)
+        return getattr(self.load(), name)
+
+    def __repr__(self):
+        return f"<LazyView {self.__module__}.{self.__name__}>"
+
+
+class LazyModule:
+    """``views = LazyModule('shop.views')``; ``views.product_list`` is then a LazyView."""
+
+    def __init__(self, module):
+        self._module = module
+
+    def __getattr__(self, name):
+        return LazyView(self._module, name)
+
+
+def _callbacks(patterns):
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            yield from _callbacks(pattern.url_patterns)
+        elif isinstance(pattern, URLPattern):
+            yield pattern.callback
+
+
+def template_names():
+    """Every template the project's template engines can find, per engine."""
+    for engine in engines.all():
+        dirs = list(engine.engine.dirs) + list(get_app_template_dirs('templates'))
+        names = set()
+        for directory in dirs:
+            names.update(str(path.relative_to(directory)) for path in directory.rglob('*.html'))
+        yield engine, sorted(names)
+
+
+def warm_up(templates=True):
+    """
+    Do the work the first requests would otherwise pay for: build the URL
+    resolver and its reverse lookup, import every lazily routed view and
+    compile every template into the cached loader. Returns the seconds
+    spent per phase.
+    """
+    timings = {}
+
+    started = time.perf_counter()
+    resolver = get_resolver()
+    for callback in _callbacks(resolver.url_patterns):
+        if isinstance(callback, LazyView):
+            callback.load()
+    timings['views'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    # populates the reverse dictionaries used by {% url %} and redirect()
+    resolver.reverse_dict
+    for namespace, (prefix, sub_resolver) in resolver.namespace_dict.items():
+        sub_resolver.reverse_dict
+    timings['urls'] = time.perf_counter() - started
+
+    if templates:
+        started = time.perf_counter()
+        for engine, names in template_names():
+            for name in names:
+                try:
+                    engine.get_template(name)
+                except TemplateDoesNotExist:
+                    pass
+        timings['templates'] = time.perf_counter() - started
+    return timings
@@ -0,0 +1,80 @@
+import gzip
+import os
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files.base import ContentFile
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.mjs', '.json', '.svg', '.txt', '.html', '.xml', '.map', '.ico', '.ttf', '.otf')
+MIN_COMPRESS_SIZE = 256
+
+
+def _gzip(data):
+    # mtime=0 keeps the output byte-identical between collectstatic runs
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def _brotli(data):
+    return brotli.compress(data, quality=11)
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    Manifest storage that also writes ``.gz`` (and ``.br`` when the brotli
+    package is installed) siblings of every hashed text asset, so the app can
+    serve precompressed files without compressing per request.
+    """
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run=dry_run, **options)
+        if dry_run:
+            return
+        for hashed_name in set(self.hashed_files.values()):
+            self.compress(hashed_name)
+
+    def encoders(self):
+        encoders = [('.gz', _gzip)]
+        if brotli is not None:
+            encoders.insert(0, ('.br', _brotli))
+        return encoders
+
+    def compress(self, name):
+        if not name.lower().endswith(COMPRESSIBLE_EXTENSIONS):
+            return
+        with self.open(name) as original:
+            data = original.read()
+        if len(data) < MIN_COMPRESS_SIZE:
+            return
+        for suffix, encode in self.encoders():
+            compressed = encode(data)
+            # not worth a separate file if it saves less than 5%
+            if len(compressed) >= len(data) * 0.95:
+                continue
+            target = name + suffix
+            if self.exists(target):
+                self.delete(target)
+            self._save(target, ContentFile(compressed))
+
+    def is_hashed(self, path):
+        return path in self._hashed_names
+
+    @property
+    def _hashed_names(self):
+        names = getattr(self, '_hashed_names_cache', None)
+        if names is None:
+            names = self._hashed_names_cache = frozenset(self.hashed_files.values())
+        return names
+
+
+def compressed_variants(path):
+    """Return ``(content_encoding, path)`` pairs that exist next to ``path``."""
+    variants = []
+    for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+        candidate = path + suffix
+        if os.path.isfile(candidate):
+            variants.append((encoding, candidate))
+    return variants
@@ -0,0 +1,94 @@
+import logging
+import traceback
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+
+from shop.models import Task
+
+logger = logging.getLogger(__name__)
+
+REGISTRY = {}
+BACKOFF_BASE_SECONDS = 5
+BACKOFF_MAX_SECONDS = 60 * 60
+STALE_LOCK_SECONDS = 15 * 60
+
+
+def task(func):
+    """Register ``func`` so it can be queued with ``enqueue(func, *args)``."""
+    func.task_name = f'{func.__module__}.{func.__name__}'
+    REGISTRY[func.task_name] = func
+    return func
+
+
+def enqueue(func, *args, max_attempts=5, delay=0):
+    """
+    Queue ``func(*args)`` to run in the worker once the current transaction
+    commits; nothing is queued if it rolls back.
+    """
+    run_at = timezone.now() + timedelta(seconds=delay)
+    job = Task(name=func.task_name, args=list(args), max_attempts=max_attempts, run_at=run_at)
+    transaction.on_commit(job.save)
+
+
+def backoff(attempts):
+    return min(BACKOFF_BASE_SECONDS * 2 ** (attempts - 1), BACKOFF_MAX_SECONDS)
+
+
+def claim(batch_size):
+    now = timezone.now()
+    with transaction.atomic():
+        # tasks whose worker died mid-run go back to the queue; the run counts as an
+        # attempt, so a task that kills its worker every time ends up failed
+        stale = Task.objects.filter(status='running', locked_at__lt=now - timedelta(seconds=STALE_LOCK_SECONDS)).update(
+            status=Case(When(attempts__gte=F('max_attempts') - 1, then=Value('failed')), default=Value('pending')),
+            attempts=F('attempts') + 1,
+            locked_at=None,
+            last_error=Value(f"worker stopped without finishing it within {STALE_LOCK_SECONDS}s"),
+        )
+        if stale:
+            logger.warning("Reclaimed %s tasks from workers that stopped mid-run", stale)
+        jobs = list(
+            Task.objects.select_for_update(skip_locked=True)
+            .filter(status='pending', run_at__lte=now)
+            .order_by('run_at', 'id')[:batch_size]
+        )
+        if jobs:
+            Task.objects.filter(id__in=[job.id for job in jobs]).update(status='running', locked_at=now)
+    return jobs
+
+
+def run(job):
+    """Run one claimed task; failures are rescheduled with backoff or marked failed."""
+    func = REGISTRY.get(job.name)
+    try:
+        if func is None:
+            raise LookupError(f"unknown task {job.name}")
+        with transaction.atomic():
+            func(*job.args)
+    except Exception:
+        job.attempts += 1
+        job.last_error = traceback.format_exc()
+        if job.attempts >= job.max_attempts:
+            job.status = 'failed'
+            logger.error("Task %s #%s failed permanently", job.name, job.id)
+        else:
+            job.status = 'pending'
+            job.run_at = timezone.now() + timedelta(seconds=backoff(job.attempts))
+        job.locked_at = None
+        job.save(update_fields=['status', 'attempts', 'run_at', 'locked_at', 'last_error'])
+        return False
+    return True
+
+
+def run_batch(batch_size=100):
+    """Claim and run up to ``batch_size`` due tasks. Returns ``(ran, failed)``."""
+    jobs = claim(batch_size)
+    # each task runs in its own savepoint, the batch commits once
+    with transaction.atomic():
+        done = [job.id for job in jobs if run(job)]
+        if done:
+            Task.objects.filter(id__in=done).update(status='done', locked_at=None, attempts=F('attempts') + 1)
+    return len(jobs), len(jobs) - len(done)
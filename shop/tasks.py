@@ -0,0 +1,45 @@
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.template.loader import render_to_string
+
+from shop.models import Order, Product, ActivityLog
+from shop.reports import roll_up_paid_orders
+from shop.sharding import find_order
+from shop.snapshots import regenerate
+from shop.task_queue import task
+
+
+@task
+def render_order_receipt(order_id):
+    order = find_order(order_id, Order.objects.prefetch_related('user', 'items__product', 'payments'))
+    html = render_to_string('order_receipt.html', {'order': order})
+    name = f'receipts/order_{order.id}.html'
+    if default_storage.exists(name):
+        default_storage.delete(name)
+    default_storage.save(name, ContentFile(html.encode('utf-8')))
+
+
+@task
+def alert_low_stock(product_ids, user_id):
+    threshold = getattr(settings, 'LOW_STOCK_THRESHOLD', 5)
+    low = Product.objects.filter(id__in=product_ids, stock__lt=threshold).values_list('name', 'stock')
+    ActivityLog.objects.bulk_create([
+        ActivityLog(user_id=user_id, action=f"สินค้าใกล้หมด: {name} (เหลือ {stock})", category="แจ้งเตือนสต็อก")
+        for name, stock in low
+    ])
+
+
+@task
+def log_order_activity(user_id, action, category):
+    ActivityLog.objects.create(user_id=user_id, action=action, category=category)
+
+
+@task
+def update_sales_rollups():
+    roll_up_paid_orders()
+
+
+@task
+def regenerate_snapshots(keys):
+    regenerate(keys)
@@ -0,0 +1,515 @@
+import json
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock, skipIf
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from shop import orders, sharding, throttle
+from shop.auth_backends import _user_cache_key
+from shop.autocomplete import Autocomplete
+from shop.cart import MAX_QUANTITY, CartError, apply_changes
+from shop.models import ActivityLog, Cart, CartItem, ChangeEvent, Checkout, Order, OrderItem, Payment, PaymentEvent, Product, ProductSalesDaily, RolledUpOrder, ShardBucket, User
+from shop.orders import bulk_transition, place_pending_checkouts
+from shop.payments import process_events, sign_payload
+from shop.reports import record_orders, roll_up_paid_orders
+from shop.session_store import pack_checkout_info
+
+# the configured tiers, with the shared one in memory instead of on disk
+TEST_CACHES = {
+    'default': settings.CACHES['default'],
+    'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'shop-tests'},
+}
+
+CHECKOUT = {'receiver_name': 'Test', 'phone': '0800000000', 'address_line': '1 Rama I Rd', 'city': 'ปทุมวัน', 'province': 'กรุงเทพมหานคร', 'postal_code': '10330', 'payment_method': 'transfer'}
+
+# tests that need orders on more than one database run under ongoshop_project.settings_shards
+single_shard = skipIf(len(sharding.shards()) < 2, "needs ORDER_SHARDS with several databases")
+
+
+def all_orders(**filters):
+    return [order for queryset in sharding.each_shard(Order.objects.filter(**filters)) for order in queryset]
+
+
+@override_settings(CACHES=TEST_CACHES)
+class CachedUserRoleTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_user('admin', password='x', role='admin')
+        self.customer = User.objects.create_user('customer', password='x')
+        self.admin_client = self.client_class()
+        self.admin_client.force_login(self.admin)
+        self.client.force_login(self.customer)
+
+    def set_role(self, role):
+        response = self.admin_client.post(
+            reverse('shop:admin_user_edit', args=[self.customer.pk]), {'role': role},
+        )
+        self.assertRedirects(response, reverse('shop:admin_user_list'), fetch_redirect_response=False)
+
+    def test_role_change_applies_on_next_request(self):
+        admin_page = reverse('shop:admin_user_list')
+
+        response = self.client.get(admin_page)
+        self.assertRedirects(response, reverse('shop:login'), fetch_redirect_response=False)
+        # the customer is now served from the cache, so what follows relies on invalidation
+        self.assertIsNotNone(cache.get(_user_cache_key(self.customer.pk)))
+
+        self.set_role('admin')
+        self.assertEqual(self.client.get(admin_page).status_code, 200)
+
+        self.set_role('customer')
+        response = self.client.get(admin_page)
+        self.assertRedirects(response, reverse('shop:login'), fetch_redirect_response=False)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class CheckoutTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        cache.clear()
+        sharding.bucket_map.refresh(force=True)
+        self.user = User.objects.create_user('buyer', password='x')
+        self.product = Product.objects.create(name='tea', price=40, stock=10)
+        self.client.force_login(self.user)
+
+    def fill_cart(self, quantity=2):
+        cart, _ = Cart.objects.get_or_create(user=self.user)
+        CartItem.objects.update_or_create(cart=cart, product=self.product, defaults={'quantity': quantity})
+
+    def start_checkout(self):
+        session = self.client.session
+        session['checkout_info'] = pack_checkout_info(CHECKOUT)
+        session['checkout_token'] = token = '0' * 31 + '1'
+        session.save()
+        return token
+
+    def confirm(self):
+        return self.client.post(reverse('shop:confirm_order'), {'action': 'pay_later'})
+
+    def stock(self):
+        return Product.objects.get(pk=self.product.pk).stock
+
+    def test_order_placed_on_the_users_shard(self):
+        self.fill_cart()
+        token = self.start_checkout()
+        self.assertRedirects(self.confirm(), reverse('shop:product_list'), fetch_redirect_response=False)
+
+        [order] = all_orders(user=self.user)
+        shard = sharding.shard_for(self.user.pk)
+        self.assertEqual(order._state.db, shard)
+        self.assertEqual(order.id % sharding.id_stride(), sharding.shard_number(shard))
+        self.assertEqual(str(order.checkout_token).replace('-', ''), token)
+        self.assertEqual((order.total_price, order.items.get().quantity, order.payments.get().amount), (80, 2, 80))
+        self.assertEqual(self.stock(), 8)
+        self.assertFalse(CartItem.objects.filter(cart__user=self.user).exists())
+
+    def test_same_token_orders_once(self):
+        self.fill_cart()
+        self.start_checkout()
+        self.confirm()
+        # the same form again, with the cart filled in the meantime
+        self.fill_cart(3)
+        self.start_checkout()
+        self.assertRedirects(self.confirm(), reverse('shop:my_orders'), fetch_redirect_response=False)
+
+        self.assertEqual(len(all_orders(user=self.user)), 1)
+        self.assertEqual(self.stock(), 8)
+        self.assertEqual(CartItem.objects.get(cart__user=self.user).quantity, 3)
+
+    def test_failed_shard_write_is_placed_once_later(self):
+        self.fill_cart()
+        token = self.start_checkout()
+        with mock.patch.object(orders.Payment.objects, 'using', side_effect=RuntimeError('shard down')), \
+                self.assertLogs('shop.views', 'ERROR'):
+            self.assertRedirects(self.confirm(), reverse('shop:my_orders'), fetch_redirect_response=False)
+
+        # stock is taken and the checkout holds what it was taken for
+        self.assertEqual(all_orders(user=self.user), [])
+        self.assertEqual(self.stock(), 8)
+        self.assertIsNone(Checkout.objects.get(token=token).order_id)
+
+        self.assertEqual(place_pending_checkouts(older_than=0), (1, 0, 0))
+        self.assertEqual(place_pending_checkouts(older_than=0), (0, 0, 0))
+        [order] = all_orders(user=self.user)
+        self.assertEqual(Checkout.objects.get(token=token).order_id, order.id)
+        self.assertEqual(order.items.get().quantity, 2)
+
+    def test_strided_ids(self):
+        self.assertEqual(sharding._next_id(0, 0, 16), 16)
+        self.assertEqual(sharding._next_id(31, 1, 16), 33)
+        self.assertEqual(sharding._next_id(33, 1, 16), 49)
+        self.assertEqual(sharding._next_id(40, 5, 16), 53)
+
+    @single_shard
+    def test_rebalance_moves_orders_with_their_rows(self):
+        self.fill_cart()
+        self.start_checkout()
+        self.confirm()
+        [order] = all_orders(user=self.user)
+        source = order._state.db
+        target = next(alias for alias in sharding.shards() if alias != source)
+        bucket = sharding.bucket_of(self.user.pk)
+        try:
+            moved = sharding.move_buckets([(bucket, source, target)], wait=0)
+            self.assertEqual(moved, 1)
+            self.assertEqual(sharding.shard_for(self.user.pk), target)
+            self.assertFalse(Order.objects.using(source).filter(id=order.id).exists())
+            copy = sharding.find_order(order.id)
+            self.assertEqual(copy._state.db, target)
+            self.assertEqual((copy.checkout_token, copy.items.count(), copy.payments.count()), (order.checkout_token, 1, 1))
+        finally:
+            ShardBucket.objects.filter(bucket=bucket).delete()
+            sharding.bucket_map.refresh(force=True)
+
+    @single_shard
+    def test_writes_to_a_moving_bucket_wait(self):
+        bucket = sharding.bucket_of(self.user.pk)
+        ShardBucket.objects.create(bucket=bucket, database=sharding.shard_for(self.user.pk), moving=True)
+        sharding.bucket_map.refresh(force=True)
+        try:
+            self.fill_cart()
+            self.start_checkout()
+            self.assertRedirects(self.confirm(), reverse('shop:confirm_order'), fetch_redirect_response=False)
+            self.assertEqual(self.stock(), 10)
+            self.assertFalse(Checkout.objects.exists())
+        finally:
+            ShardBucket.objects.filter(bucket=bucket).delete()
+            sharding.bucket_map.refresh(force=True)
+
+
+class CartChangeTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('shopper', password='x')
+        self.cart = Cart.objects.create(user=self.user)
+        self.tea, self.rice = Product.objects.bulk_create([Product(name='tea', price=40), Product(name='rice', price=60)])
+
+    def quantities(self):
+        return dict(self.cart.items.values_list('product_id', 'quantity'))
+
+    def test_deltas_merge_into_existing_lines(self):
+        apply_changes(self.cart, [{'product_id': self.tea.id, 'delta': 2}])
+        apply_changes(self.cart, [
+            {'product_id': self.tea.id, 'delta': 3},
+            {'product_id': self.rice.id},
+            {'product_id': self.rice.id, 'delta': 4},
+        ])
+        self.assertEqual(self.quantities(), {self.tea.id: 5, self.rice.id: 5})
+
+    def test_quantity_replaces_and_zero_removes(self):
+        apply_changes(self.cart, [{'product_id': self.tea.id, 'delta': 2}, {'product_id': self.rice.id, 'delta': 1}])
+        apply_changes(self.cart, [{'product_id': self.tea.id, 'quantity': 7}, {'product_id': self.rice.id, 'quantity': 0}])
+        self.assertEqual(self.quantities(), {self.tea.id: 7})
+        apply_changes(self.cart, [{'product_id': self.tea.id, 'delta': -9}])
+        self.assertEqual(self.quantities(), {})
+
+    def test_repeated_adds_stop_at_the_cap(self):
+        for _ in range(3):
+            apply_changes(self.cart, [{'product_id': self.tea.id, 'delta': MAX_QUANTITY}])
+        self.assertEqual(self.quantities(), {self.tea.id: MAX_QUANTITY})
+
+    def test_invalid_changes_are_rejected(self):
+        for changes in ([], [{'product_id': self.tea.id, 'quantity': MAX_QUANTITY + 1}], [{'delta': 1}], [{'product_id': 0}]):
+            with self.subTest(changes=changes), self.assertRaises(CartError):
+                apply_changes(self.cart, changes)
+        self.assertEqual(self.quantities(), {})
+
+    def test_batch_endpoint_returns_the_cart(self):
+        self.client.force_login(self.user)
+        response = self.client.post(
+            reverse('shop:update_cart_batch'),
+            {'changes': [{'product_id': self.tea.id, 'delta': 2}, {'product_id': self.rice.id, 'quantity': 1}]},
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200)
+        state = response.json()
+        self.assertEqual([(line['product_id'], line['quantity']) for line in state['items']], [(self.tea.id, 2), (self.rice.id, 1)])
+        self.assertEqual(state['total'], 140)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class PaymentCallbackTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        cache.clear()
+        sharding.bucket_map.refresh(force=True)
+        user = User.objects.create_user('payer', password='x')
+        self.order = Order.objects.create(user=user, total_price=120)
+        self.payment = self.order.payments.create(amount=120, method='transfer', status='pending', provider_ref='ref-1')
+
+    def callback(self, signature=None, **event):
+        body = json.dumps({'provider_ref': 'ref-1', 'status': 'success', 'amount': 120, **event}).encode()
+        return self.client.post(
+            reverse('shop:payment_callback'), body, content_type='application/json',
+            HTTP_X_SIGNATURE=signature or sign_payload(body),
+        )
+
+    def refresh(self):
+        return Order.objects.using(self.order._state.db).get(id=self.order.id), Payment.objects.using(self.order._state.db).get(id=self.payment.id)
+
+    def test_unsigned_or_wrong_callbacks_are_refused(self):
+        self.assertEqual(self.callback(signature='forged').status_code, 403)
+        self.assertEqual(self.callback(amount=100).status_code, 400)
+        self.assertEqual(self.callback(amount='120').status_code, 400)
+        self.assertEqual(self.callback(amount=None).status_code, 400)
+        self.assertFalse(PaymentEvent.objects.exists())
+
+    def test_repeated_callbacks_apply_once(self):
+        for _ in range(2):
+            self.assertEqual(self.callback().status_code, 202)
+        self.assertEqual(PaymentEvent.objects.count(), 1)
+
+        self.assertEqual(process_events(), (1, 1))
+        self.assertEqual(process_events(), (0, 0))
+        order, payment = self.refresh()
+        self.assertEqual((order.status, payment.status), ('paid', 'success'))
+        # a later redelivery is dropped as well
+        self.callback()
+        self.assertEqual(process_events(), (0, 0))
+
+    def test_success_for_a_cancelled_order_goes_to_review(self):
+        Order.objects.using(self.order._state.db).filter(id=self.order.id).update(status='cancelled')
+        self.callback()
+        self.assertEqual(process_events(), (1, 1))
+        order, payment = self.refresh()
+        self.assertEqual((order.status, payment.status), ('cancelled', 'review'))
+
+
+class TieredCacheTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        tiers = {
+            'default': settings.CACHES['default'],
+            'shared': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directory.name},
+        }
+        overridden = override_settings(CACHES=tiers)
+        overridden.enable()
+        self.addCleanup(overridden.disable)
+        self.cache = caches['default']
+        self.cache.clear()
+
+    def later(self, seconds):
+        return mock.patch('time.time', return_value=time.time() + seconds)
+
+    def test_incr_keeps_the_expiry(self):
+        self.cache.add('forever', 0, None)
+        self.cache.set('brief', 0, 60)
+        self.cache.incr('forever')
+        self.cache.incr('brief', 5)
+        with self.later(301):
+            self.assertEqual(self.cache.incr('forever'), 2)
+            self.assertEqual(self.cache.get('brief'), None)
+            with self.assertRaises(ValueError):
+                self.cache.incr('brief')
+
+    def test_add_only_when_absent_or_expired(self):
+        self.assertTrue(self.cache.add('key', 'first', 10))
+        self.assertFalse(self.cache.add('key', 'second', 10))
+        with self.later(11):
+            self.assertTrue(self.cache.add('key', 'third', 10))
+            self.assertEqual(self.cache.get('key'), 'third')
+
+    def test_concurrent_increments_are_not_lost(self):
+        self.cache.add('hits', 0, None)
+
+        def hit(_):
+            for _ in range(50):
+                self.cache.incr('hits')
+
+        with ThreadPoolExecutor(8) as pool:
+            list(pool.map(hit, range(8)))
+        self.assertEqual(self.cache.get('hits'), 400)
+
+    def test_expired_key_is_recomputed_once(self):
+        self.cache.set('slow', 'old', 1)
+        computed = []
+        start = threading.Barrier(8)
+
+        def compute():
+            computed.append(1)
+            time.sleep(0.2)
+            return 'new'
+
+        def read(_):
+            start.wait()
+            return self.cache.get_or_set('slow', compute, 60)
+
+        time.sleep(1.1)
+        with ThreadPoolExecutor(8) as pool:
+            values = set(pool.map(read, range(8)))
+        self.assertEqual(len(computed), 1)
+        self.assertLessEqual(values, {'old', 'new'})
+        self.assertEqual(self.cache.get('slow'), 'new')
+
+
+@override_settings(CACHES=TEST_CACHES, THROTTLE_RULES={
+    'login_ip': {'burst': 100, 'per_minute': 100},
+    'register_ip': {'burst': 3, 'per_minute': 1},
+    'login_user': {'burst': 3, 'per_minute': 1, 'lockout': 900},
+})
+class ThrottleTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('victim', password='right')
+
+    def login(self, password='wrong', ip='10.0.0.1'):
+        return self.client.post(reverse('shop:login'), {'username': 'victim', 'password': password}, REMOTE_ADDR=ip)
+
+    def test_username_locks_out_before_any_hashing(self):
+        for ip in ('10.0.0.1', '10.0.0.2', '10.0.0.3'):
+            self.assertEqual(self.login(ip=ip).status_code, 200)
+        with mock.patch('django.contrib.auth.hashers.PBKDF2PasswordHasher.verify') as verify:
+            response = self.login(password='right', ip='10.0.0.4')
+        verify.assert_not_called()
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '900')
+        # the lock outlasts the refill
+        with mock.patch('time.time', return_value=time.time() + 600):
+            self.assertEqual(self.login(password='right').status_code, 429)
+        self.assertEqual(throttle.counters()['login_user'], {'allowed': 3, 'limited': 0, 'locked': 2})
+
+    def test_successful_login_refills_the_username(self):
+        self.login()
+        self.login()
+        self.assertRedirects(self.login(password='right'), reverse('shop:product_list'), fetch_redirect_response=False)
+        self.client.logout()
+        for _ in range(3):
+            self.assertEqual(self.login().status_code, 200)
+
+    def test_bucket_refills_over_time(self):
+        register = throttle.bucket('register_ip')
+        self.assertEqual([register.take('10.0.0.9') for _ in range(4)], [0, 0, 0, 60])
+        with mock.patch('time.time', return_value=time.time() + 61):
+            self.assertEqual(register.take('10.0.0.9'), 0)
+            self.assertGreater(register.take('10.0.0.9'), 0)
+
+    def test_parallel_burst_gets_one_bucket(self):
+        user_bucket = throttle.bucket('login_user')
+        with ThreadPoolExecutor(16) as pool:
+            waits = list(pool.map(lambda _: user_bucket.take('victim'), range(32)))
+        self.assertEqual(waits.count(0), 3)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class BulkTransitionTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_user('admin', password='x', role='admin')
+        self.customers = [User.objects.create_user(f'customer{i}', password='x') for i in range(2)]
+        # with several shards the second customer's orders live on another one
+        for alias in sharding.shards()[1:2]:
+            ShardBucket.objects.create(bucket=sharding.bucket_of(self.customers[1].pk), database=alias)
+        self.addCleanup(sharding.bucket_map.refresh, force=True)
+        sharding.bucket_map.refresh(force=True)
+        self.orders = {
+            (customer.username, status): Order.objects.create(user=customer, total_price=100, status=status)
+            for customer in self.customers
+            for status in ('pending', 'paid', 'delivered')
+        }
+        # only the events of the transitions are of interest
+        for queryset in sharding.each_shard(ChangeEvent.objects.all()):
+            queryset.delete()
+
+    def statuses(self):
+        return {key: sharding.find_order(order.id).status for key, order in self.orders.items()}
+
+    def test_only_allowed_sources_move(self):
+        summary = bulk_transition(Order.objects.all(), 'shipping', self.admin)
+
+        self.assertEqual((summary['updated'], summary['skipped']), (2, 4))
+        self.assertEqual(summary['by_status'], {'pending': 2, 'paid': 2, 'delivered': 2})
+        for (username, status), current in self.statuses().items():
+            self.assertEqual(current, 'shipping' if status == 'paid' else status)
+        moved = [self.orders[customer.username, 'paid'].id for customer in self.customers]
+        logged = ActivityLog.objects.filter(user=self.admin).values_list('action', flat=True)
+        self.assertEqual(sorted(logged), sorted(f"อัปเดตสถานะคำสั่งซื้อ #{pk} เป็น 'shipping'" for pk in moved))
+        events = [pk for queryset in sharding.each_shard(ChangeEvent.objects.filter(topic='order', object_id__in=moved))
+                  for pk in queryset.values_list('object_id', flat=True)]
+        self.assertEqual(sorted(events), sorted(moved))
+
+        # replaying is a no-op
+        self.assertEqual(bulk_transition(Order.objects.all(), 'shipping', self.admin)['updated'], 0)
+
+    def test_cancel_selected_orders_from_the_admin(self):
+        self.client.force_login(self.admin)
+        selected = [order.id for order in self.orders.values()]
+        response = self.client.post(reverse('shop:admin_order_bulk_status'), {'status': 'cancelled', 'orders': selected})
+        self.assertRedirects(response, reverse('shop:admin_order_list') + '?', fetch_redirect_response=False)
+        for (username, status), current in self.statuses().items():
+            self.assertEqual(current, 'cancelled' if status in ('pending', 'paid') else status)
+
+
+class RollupTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.product = Product.objects.create(name='tea', price=40)
+        self.customer = User.objects.create_user('customer', password='x')
+        for alias in sharding.shards()[1:2]:
+            ShardBucket.objects.create(bucket=sharding.bucket_of(self.customer.pk), database=alias)
+        self.addCleanup(sharding.bucket_map.refresh, force=True)
+        sharding.bucket_map.refresh(force=True)
+        self.order = Order.objects.create(user=self.customer, total_price=120, status='paid')
+        OrderItem.objects.using(self.order._state.db).create(order=self.order, product=self.product, quantity=3, unit_price=40)
+
+    def units(self):
+        return sum(ProductSalesDaily.objects.filter(product=self.product).values_list('units', flat=True))
+
+    def test_batch_committed_before_a_crash_is_counted_once(self):
+        # the rollups committed, the process died before the shard flags flipped
+        record_orders([self.order.id], self.order._state.db)
+        self.assertEqual(roll_up_paid_orders(), 0)
+        self.assertEqual(self.units(), 3)
+        self.assertTrue(sharding.find_order(self.order.id).sales_recorded)
+
+    def test_cancelled_order_is_taken_out_once(self):
+        self.assertEqual(roll_up_paid_orders(), 1)
+        Order.objects.using(self.order._state.db).filter(id=self.order.id).update(status='cancelled')
+        record_orders([self.order.id], self.order._state.db, sign=-1)
+        roll_up_paid_orders()
+        self.assertEqual(self.units(), 0)
+        self.assertFalse(RolledUpOrder.objects.filter(order_id=self.order.id).exists())
+        self.assertFalse(sharding.find_order(self.order.id).sales_recorded)
+
+
+class AutocompleteTests(TestCase):
+    def setUp(self):
+        self.wallet = Product.objects.create(name='กระเป๋าสตางค์ หนังแท้', price=500)
+        self.watch = Product.objects.create(name='นาฬิกาข้อมือ Classic', price=900)
+        self.autocomplete = Autocomplete()
+
+    def names(self, prefix):
+        return [row['name'] for row in self.autocomplete.search(prefix)]
+
+    def test_thai_prefixes_inside_compounds(self):
+        self.assertEqual(self.names('สตางค์'), [self.wallet.name])
+        self.assertEqual(self.names('ข้อมือ'), [self.watch.name])
+        self.assertEqual(self.names('cla'), [self.watch.name])
+        # not a syllable start: the middle of เป๋า
+        self.assertEqual(self.names('ป๋า'), [])
+
+    def test_renames_show_without_a_rebuild(self):
+        self.names('x')
+        self.autocomplete.product_changed(Product(pk=self.watch.pk, name='นาฬิกาแขวนผนัง'))
+        self.assertEqual(self.names('แขวน'), ['นาฬิกาแขวนผนัง'])
+        self.assertEqual(self.names('ข้อมือ'), [])
+
+    def test_forked_worker_keeps_the_index(self):
+        self.names('x')
+        index = self.autocomplete.index
+        with mock.patch('time.monotonic', return_value=time.monotonic() + 2 * 60 * 60):
+            self.autocomplete.after_fork()
+            with mock.patch.object(self.autocomplete, '_rebuild_in_background') as rebuild:
+                self.assertEqual(self.names('สตางค์'), [self.wallet.name])
+        rebuild.assert_not_called()
+        self.assertIs(self.autocomplete.index, index)
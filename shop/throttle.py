@@ -0,0 +1,153 @@
+import hashlib
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+KEY_PREFIX = 'shop:throttle'
+OUTCOMES = ('allowed', 'limited', 'locked')
+
+DEFAULT_RULES = {
+    'login_ip': {'burst': 5, 'per_minute': 5},
+    'register_ip': {'burst': 3, 'per_minute': 1},
+    'login_user': {'burst': 5, 'per_minute': 1, 'lockout': 900},
+}
+
+
+def rules():
+    return {**DEFAULT_RULES, **getattr(settings, 'THROTTLE_RULES', {})}
+
+
+def _digest(ident):
+    # usernames are user input: keep cache keys short and free of spaces
+    return hashlib.sha1(ident.strip().lower().encode()).hexdigest()
+
+
+def client_ip(request):
+    """
+    The caller's address. Behind THROTTLE_TRUSTED_PROXIES reverse proxies
+    it is the entry those proxies appended to X-Forwarded-For, so a client
+    cannot pick its own bucket by sending the header itself.
+    """
+    proxies = getattr(settings, 'THROTTLE_TRUSTED_PROXIES', 0)
+    if proxies:
+        forwarded = [part.strip() for part in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if part.strip()]
+        if len(forwarded) >= proxies:
+            return forwarded[-proxies]
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def count(rule, outcome):
+    key = f'{KEY_PREFIX}:count:{rule}:{outcome}'
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # evicted between add() and incr()
+        cache.set(key, 1, None)
+
+
+def counters():
+    """``{rule: {outcome: n}}`` since the cache was last cleared."""
+    names = rules()
+    keys = {f'{KEY_PREFIX}:count:{rule}:{outcome}': (rule, outcome) for rule in names for outcome in OUTCOMES}
+    found = cache.get_many(list(keys))
+    result = {rule: dict.fromkeys(OUTCOMES, 0) for rule in names}
+    for key, value in found.items():
+        rule, outcome = keys[key]
+        result[rule][outcome] = value
+    return result
+
+
+class TokenBucket:
+    """
+    ``burst`` attempts at once, refilled at ``per_minute``. The bucket is one
+    cache entry, ``(tokens, stamp)``, that expires once it would be full
+    again, so idle clients cost nothing. It is read and written under a lock
+    taken with the cache's atomic ``add()``: a caller that cannot get it
+    within ``LOCK_WAIT`` seconds is part of a burst on one identity and is
+    refused. With a ``lockout``, emptying the bucket locks the identity for
+    that many seconds.
+    """
+
+    LOCK_WAIT = 0.5
+    LOCK_TIMEOUT = 2
+
+    def __init__(self, rule, burst, per_minute, lockout=None):
+        self.rule = rule
+        self.burst = burst
+        self.rate = per_minute / 60
+        self.lockout = lockout
+
+    def _key(self, kind, ident):
+        return f'{KEY_PREFIX}:{kind}:{self.rule}:{_digest(ident)}'
+
+    def _acquire(self, key):
+        deadline = time.monotonic() + self.LOCK_WAIT
+        while not cache.add(key, True, self.LOCK_TIMEOUT):
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.005)
+        return True
+
+    def take(self, ident):
+        """Spend one token; returns 0, or the seconds until one is available."""
+        until = cache.get(self._key('lock', ident)) if self.lockout else None
+        if until and until > time.time():
+            count(self.rule, 'locked')
+            return math.ceil(until - time.time())
+        key, lock_key = self._key('bucket', ident), self._key('mutex', ident)
+        if not self._acquire(lock_key):
+            count(self.rule, 'limited')
+            return math.ceil(1 / self.rate)
+        try:
+            now = time.time()
+            tokens, stamp = cache.get(key) or (self.burst, now)
+            tokens = min(self.burst, tokens + (now - stamp) * self.rate)
+            if tokens < 1:
+                if self.lockout:
+                    cache.set(self._key('lock', ident), now + self.lockout, self.lockout)
+                    count(self.rule, 'locked')
+                    return self.lockout
+                count(self.rule, 'limited')
+                return math.ceil((1 - tokens) / self.rate)
+            cache.set(key, (tokens - 1, now), math.ceil(self.burst / self.rate) + 1)
+        finally:
+            cache.delete(lock_key)
+        count(self.rule, 'allowed')
+        return 0
+
+    def reset(self, ident):
+        cache.delete_many([self._key('bucket', ident), self._key('lock', ident)])
+
+
+def bucket(rule):
+    config = rules().get(rule)
+    return TokenBucket(rule, config['burst'], config['per_minute'], config.get('lockout')) if config else None
+
+
+def check_login(request, username):
+    """
+    Seconds the login attempt must wait, or 0 if it may go ahead. Runs
+    before the form, so a rejected attempt costs no password hash and no
+    query. Every attempt on a username takes a token, so a parallel burst
+    gets no more than ``burst`` guesses; a successful login refills it.
+    """
+    ip_bucket = bucket('login_ip')
+    wait = ip_bucket.take(client_ip(request)) if ip_bucket else 0
+    if not wait and username:
+        user_bucket = bucket('login_user')
+        wait = user_bucket.take(username) if user_bucket else 0
+    return wait
+
+
+def login_succeeded(username):
+    user_bucket = bucket('login_user')
+    if user_bucket and username:
+        user_bucket.reset(username)
+
+
+def check_register(request):
+    ip_bucket = bucket('register_ip')
+    return ip_bucket.take(client_ip(request)) if ip_bucket else 0
@@ -0,0 +1,298 @@
+import fcntl
+import math
+import os
+import pickle
+import random
+import threading
+import time
+import zlib
+from collections import Counter, OrderedDict, namedtuple
+from contextlib import contextmanager
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.cache.backends.filebased import FileBasedCache
+
+STATS = (
+    'local_hits', 'shared_hits', 'misses', 'local_evictions',
+    'recomputes', 'early_refreshes', 'coalesced', 'stale_served',
+)
+
+FLIGHT_LOCKS = 64
+# lock files add() and incr() take turns on in a file-based shared tier
+ATOMIC_LOCKS = 64
+
+_tiers = {}
+_tiers_lock = threading.Lock()
+
+# what the shared tier stores for every key: the value, when it expires
+# (None for never) and how long it took to compute (0 when simply set)
+Entry = namedtuple('Entry', 'value expires delta')
+
+
+class LocalTier:
+    """
+    The in-process half: an LRU of pickled entries, each kept until a TTL.
+    Django hands every thread its own cache instance, so instances share a
+    tier by name (``LOCATION``), like the locmem backend.
+    """
+
+    def __init__(self, max_entries, timeout):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        # refreshes in this process are serialised per key on one of a fixed set of locks
+        self.flights = [threading.Lock() for _ in range(FLIGHT_LOCKS)]
+        self.stats = Counter()
+
+    def count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+    def get(self, key):
+        with self.lock:
+            item = self.entries.get(key)
+            if item is None:
+                return None
+            until, expires, delta, pickled = item
+            if until <= time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+        # pickled, like locmem, so callers never share one mutable object
+        return Entry(pickle.loads(pickled), expires, delta)
+
+    def set(self, key, entry):
+        until = time.time() + self.timeout
+        if entry.expires is not None:
+            until = min(until, entry.expires)
+        pickled = pickle.dumps(entry.value, pickle.HIGHEST_PROTOCOL)
+        with self.lock:
+            self.entries[key] = (until, entry.expires, entry.delta, pickled)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.stats['local_evictions'] += 1
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class TieredCache(BaseCache):
+    """
+    Django cache backend with a bounded in-process LRU in front of another
+    configured cache (``OPTIONS['SHARED']``, a file or database cache) that
+    every worker reads and writes.
+
+    Local copies live for at most ``LOCAL_TIMEOUT`` seconds, so a write or
+    delete from another process shows here within that time; keys starting
+    with one of ``LOCAL_EXCLUDE`` (sessions, throttle counters, anything that
+    must never be stale) always go to the shared tier. ``get_or_set()``
+    recomputes an expired key in one place only: threads of a process queue
+    on a lock, other processes see a lock key in the shared tier and serve
+    the expired value meanwhile, for up to ``STALE_TIMEOUT`` seconds past
+    its expiry. Keys are also refreshed early at random, more likely the
+    closer they are to expiring and the slower they were to compute, so hot
+    keys are usually replaced before they expire at all.
+
+    ``add()`` and ``incr()`` are atomic across processes: each reads and
+    writes its key under a lock, an ``flock()`` on one of ``ATOMIC_LOCKS``
+    files in the directory of a file-based shared tier, or else a lock key
+    taken with the shared backend's own ``add()`` (atomic on the database,
+    Redis and Memcached caches). ``incr()`` keeps the key's expiry.
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self.shared_alias = options.get('SHARED', 'shared')
+        self.local_exclude = tuple(options.get('LOCAL_EXCLUDE', ()))
+        self.stale_timeout = int(options.get('STALE_TIMEOUT', 30))
+        self.lock_timeout = int(options.get('LOCK_TIMEOUT', 10))
+        self.beta = float(options.get('EARLY_REFRESH_BETA', 1.0))
+        max_entries = int(options.get('LOCAL_MAX_ENTRIES', 1000))
+        with _tiers_lock:
+            self._local = _tiers.setdefault(location, LocalTier(max_entries, float(options.get('LOCAL_TIMEOUT', 5))))
+
+    @property
+    def shared(self):
+        return caches[self.shared_alias]
+
+    def _version(self, version):
+        return self.version if version is None else version
+
+    def _count(self, name):
+        self._local.count(name)
+
+    def stats(self):
+        """This process's counters, plus the current size of its local tier."""
+        with self._local.lock:
+            result = {name: self._local.stats[name] for name in STATS}
+            result['local_entries'] = len(self._local.entries)
+        return result
+
+    def _is_local(self, key):
+        return self._local.max_entries > 0 and not key.startswith(self.local_exclude)
+
+    def _entry(self, key, version, count=True, local_first=True):
+        """The stored entry for ``key``, expired or not, or None; fills the local tier from the shared one."""
+        local_key = self.make_and_validate_key(key, version=version)
+        local = self._is_local(key)
+        if local and local_first:
+            entry = self._local.get(local_key)
+            if entry is not None:
+                if count:
+                    self._count('local_hits')
+                return entry
+        entry = self.shared.get(key, version=self._version(version))
+        if not isinstance(entry, Entry):
+            if count:
+                self._count('misses')
+            return None
+        if count:
+            self._count('shared_hits')
+        if local and not self._expired(entry):
+            self._local.set(local_key, entry)
+        return entry
+
+    def _expired(self, entry, now=None):
+        return entry.expires is not None and entry.expires <= (now or time.time())
+
+    def _refresh_due(self, entry):
+        """Expired, or picked for an early refresh (XFetch: more likely near expiry and for slow values)."""
+        if entry.expires is None:
+            return False
+        now = time.time()
+        if self._expired(entry, now):
+            return True
+        return bool(entry.delta) and now - entry.delta * self.beta * math.log(1.0 - random.random()) >= entry.expires
+
+    def _store(self, key, value, timeout, version, delta=0.0):
+        # absolute expiry time (already past for timeout=0), or None for never
+        self._write(key, Entry(value, self.get_backend_timeout(timeout), delta), version)
+
+    def _write(self, key, entry, version):
+        # the shared copy outlives its expiry so it can be served while one caller recomputes
+        shared_timeout = None if entry.expires is None else max(1, math.ceil(entry.expires - time.time())) + self.stale_timeout
+        self.shared.set(key, entry, shared_timeout, version=self._version(version))
+        if self._is_local(key):
+            self._local.set(self.make_and_validate_key(key, version=version), entry)
+
+    @contextmanager
+    def _mutex(self, key, version):
+        """Hold ``key`` against add() and incr() in every process."""
+        shared = self.shared
+        if isinstance(shared, FileBasedCache):
+            # the file cache has no atomic operation of its own
+            stripe = zlib.crc32(self.make_and_validate_key(key, version=version).encode()) % ATOMIC_LOCKS
+            os.makedirs(shared._dir, exist_ok=True)
+            with open(os.path.join(shared._dir, f'lock-{stripe}'), 'a') as handle:
+                fcntl.flock(handle, fcntl.LOCK_EX)
+                yield
+            return
+        lock_key, shared_version = f'{key}:mutex', self._version(version)
+        # held for LOCK_TIMEOUT at most, should its holder die
+        while not shared.add(lock_key, 1, self.lock_timeout, version=shared_version):
+            time.sleep(0.001)
+        try:
+            yield
+        finally:
+            shared.delete(lock_key, version=shared_version)
+
+    def get(self, key, default=None, version=None):
+        entry = self._entry(key, version)
+        if entry is None or self._expired(entry):
+            return default
+        return entry.value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self._store(key, value, timeout, version)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        with self._mutex(key, version):
+            entry = self._entry(key, version, count=False, local_first=False)
+            if entry is not None and not self._expired(entry):
+                return False
+            self._store(key, value, timeout, version)
+            return True
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        entry = self._entry(key, version)
+        if entry is None or self._expired(entry):
+            return False
+        self._store(key, entry.value, timeout, version, entry.delta)
+        return True
+
+    def incr(self, key, delta=1, version=None):
+        with self._mutex(key, version):
+            entry = self._entry(key, version, count=False, local_first=False)
+            if entry is None or self._expired(entry):
+                raise ValueError(f"Key '{key}' not found.")
+            value = entry.value + delta
+            self._write(key, entry._replace(value=value), version)
+        return value
+
+    def delete(self, key, version=None):
+        self._local.delete(self.make_and_validate_key(key, version=version))
+        return self.shared.delete(key, version=self._version(version))
+
+    def clear(self):
+        self._local.clear()
+        self.shared.clear()
+
+    def close(self, **kwargs):
+        self.shared.close(**kwargs)
+
+    def get_or_set(self, key, default, timeout=DEFAULT_TIMEOUT, version=None):
+        entry = self._entry(key, version)
+        if entry is not None and not self._refresh_due(entry):
+            return entry.value
+
+        local_key = self.make_and_validate_key(key, version=version)
+        flight = self._local.flights[hash(local_key) % FLIGHT_LOCKS]
+        if not flight.acquire(blocking=entry is None):
+            # another thread of this process is already refreshing it
+            self._count('stale_served')
+            return entry.value
+        try:
+            # past the local copy: another process may have refreshed it already
+            current = self._entry(key, version, count=False, local_first=False)
+            if current is not None and not self._expired(current) and (entry is None or current.expires != entry.expires):
+                self._count('coalesced')
+                return current.value
+
+            lock_key = f'{key}:refresh'
+            locked = self.add(lock_key, True, self.lock_timeout, version=version)
+            if not locked:
+                # another process is refreshing it
+                if current is not None:
+                    self._count('stale_served')
+                    return current.value
+                deadline = time.monotonic() + self.lock_timeout
+                while time.monotonic() < deadline:
+                    time.sleep(0.05)
+                    current = self._entry(key, version, count=False)
+                    if current is not None and not self._expired(current):
+                        self._count('coalesced')
+                        return current.value
+                # the other process died or is too slow: compute it here as well
+
+            if current is not None and not self._expired(current):
+                self._count('early_refreshes')
+            try:
+                started = time.monotonic()
+                value = default() if callable(default) else default
+                self._count('recomputes')
+                self._store(key, value, timeout, version, delta=time.monotonic() - started)
+            finally:
+                if locked:
+                    self.delete(lock_key, version=version)
+            return value
+        finally:
+            flight.release()
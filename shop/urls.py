@@ -1,15 +1,22 @@
 from django.urls import path
-from shop import views
-from django.contrib.auth import views as auth_views
+from shop.startup import LazyModule
+
+# views are imported on their first request (or by warm_up()), not when the
+# URLconf loads, so a fresh worker does not pay for shop.views and its forms
+views = LazyModule('shop.views')
+auth_views = LazyModule('django.contrib.auth.views')
 
 app_name = 'shop'
 
 urlpatterns = [
     path('', views.login_view, name='home'),
     path('products/', views.product_list, name='product_list'),
+    path('products/autocomplete/', views.product_autocomplete, name='product_autocomplete'),
     path('products/category/<int:category_id>/', views.product_list, name='product_list_by_category'),
     path('product/<int:pk>/', views.product_detail, name='product_detail'),
     
+    path('address/autocomplete/', views.address_autocomplete, name='address_autocomplete'),
+    
     path('profile/', views.profile_view, name='profile'),
     path('profile/edit/', views.profile_edit, name='profile_edit'),
     path('profile/password_change/', auth_views.PasswordChangeView.as_view(template_name='password_change_form.html', success_url='/profile/'), name='password_change'),
@@ -22,6 +29,7 @@ urlpatterns = [
     path('cart/', views.view_cart, name='cart'),
     path('cart/add/', views.add_to_cart, name='add_to_cart'),
     path('update_cart/', views.update_cart, name='update_cart'),
+    path('cart/batch/', views.update_cart_batch, name='update_cart_batch'),
     path('cart/remove/', views.remove_from_cart, name='remove_from_cart'),
 
     path('checkout/', views.checkout, name='checkout'),
@@ -30,8 +38,10 @@ urlpatterns = [
     path('orders/<int:order_id>/', views.my_order_detail, name='my_order_detail'),
     path('order/<int:order_id>/pay/', views.retry_payment, name='retry_payment'),
     path('order/confirm/', views.confirm_order, name='confirm_order'),
+    path('payments/callback/', views.payment_callback, name='payment_callback'),
 
     path('admin/dashboard/', views.admin_dashboard, name='admin_dashboard'),
+    path('admin/live/', views.admin_live_feed, name='admin_live_feed'),
     path('admin/products/', views.admin_product_list, name='admin_product_list'),
     path('admin/products/add/', views.admin_product_add, name='admin_product_add'),
     path('admin/products/edit/<int:pk>/', views.admin_product_edit, name='admin_product_edit'),
@@ -41,9 +51,14 @@ urlpatterns = [
     path('admin/categories/edit/<int:pk>/', views.admin_category_edit, name='admin_category_edit'),
     path('admin/categories/delete/<int:pk>/', views.admin_category_delete, name='admin_category_delete'),
     path('admin/orders/', views.admin_order_list, name='admin_order_list'),
+    path('admin/orders/bulk-status/', views.admin_order_bulk_status, name='admin_order_bulk_status'),
     path('admin/orders/<int:order_id>/', views.admin_order_detail, name='admin_order_detail'),
     path('admin/orders/<int:order_id>/delete/', views.admin_order_delete, name='admin_order_delete'),
     path('admin/orders/<int:order_id>/cancel/', views.admin_order_cancel, name='admin_order_cancel'),
+    path('admin/reports/sales/', views.admin_sales_report, name='admin_sales_report'),
+    path('admin/activity/', views.admin_activity_log, name='admin_activity_log'),
+    path('admin/profiles/', views.admin_profile_list, name='admin_profile_list'),
+    path('admin/profiles/<str:name>/', views.admin_profile_download, name='admin_profile_download'),
     path('admin/users/', views.admin_user_list, name='admin_user_list'),
     path('admin/users/edit/<int:user_id>/', views.admin_user_edit, name='admin_user_edit'),
 
@@ -1,10 +1,43 @@
+import json
+import logging
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from django.utils.dateparse import parse_date
 from django.shortcuts import render, redirect
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse, QueryDict
+from django.urls import reverse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 from django.contrib import messages
 from django.db import transaction
 from django.contrib.auth import login, logout
-from django.db.models import Sum
+from django.db.models import Count
 from shop.forms import RegisterForm, AuthenticationForm, ProductForm, GuestCheckoutForm, OrderStatusForm, UserRoleForm, ProfileForm, CategoryForm
-from shop.models import User, Product, Category, Cart, CartItem, Order, OrderItem, Payment, Address, ActivityLog
+from shop.models import User, Product, Category, Cart, CartItem, Order, Address, ActivityLog
+from shop.grid import UserGrid, ProductGrid, CategoryGrid, OrderGrid, ActivityLogGrid
+from shop.session_store import pack_checkout_info, unpack_checkout_info
+from shop.auth_backends import get_cached_address
+from shop.payments import amount_error, enqueue_event, get_provider, verify_signature
+from shop.task_queue import enqueue
+from shop.tasks import alert_low_stock, update_sales_rollups
+from shop.reports import SOLD_STATUSES, PERIODS, record_orders, sales_report
+from shop.autocomplete import autocomplete
+from shop.postal import postal
+from shop.profiling import list_profiles, profile_path
+from shop.snapshots import PRODUCT, LIST, snapshot
+from shop.cart import CartError, apply_changes, cart_state, touch
+from shop.orders import ALLOWED_TRANSITIONS, bulk_transition, open_checkout, place_order
+from shop.throttle import check_login, check_register, login_succeeded, counters as throttle_counters
+from shop.live import dashboard_totals
+from shop.sharding import ShardMoving, find_order, orders_of, shard_for
+
+logger = logging.getLogger(__name__)
+
+SHARD_MOVING = "ข้อมูลคำสั่งซื้อนี้กำลังถูกย้ายฐานข้อมูล กรุณาลองใหม่อีกครั้งในอีกสักครู่"
 
 def admin_check(user):
     return user.is_authenticated and (getattr(user, 'role', '') in ['admin', 'owner'] or user.is_staff or user.is_superuser)
@@ -17,26 +50,34 @@ def admin_dashboard(request):
         messages.error(request, "คุณไม่มีสิทธิ์เข้าถึงหน้านี้")
         return redirect('shop:product_list')
 
-    total_users = User.objects.all().count()
-    total_products = Product.objects.all().count()
-    total_orders = Order.objects.all().count()
-    total_sales = Order.objects.filter(status='paid').aggregate(total=Sum('total_price'))['total'] or 0
     activity_logs = ActivityLog.objects.select_related('user').order_by('-timestamp')[:10]
 
     return render(request, 'admin_dashboard.html', {
-        'total_users': total_users,
-        'total_products': total_products,
-        'total_orders': total_orders,
-        'total_sales': total_sales,
+        **dashboard_totals(),
         'activity_logs': activity_logs,
+        'throttle_counters': throttle_counters(),
+        # per worker: the LRU tier and its counters live in each process
+        'cache_stats': cache.stats() if hasattr(cache, 'stats') else None,
     })
 
+def admin_live_feed(request):
+    """
+    Under ASGI the live feed is served by shop.live.LiveFeedApp before a
+    request reaches Django, so this only answers under WSGI, where a stream
+    would hold a worker for as long as the tab is open: 204 tells
+    EventSource not to reconnect and the pages stay as rendered.
+    """
+    if not request.user.is_authenticated or not admin_check(request.user):
+        return HttpResponse(status=403)
+    return HttpResponse(status=204)
+
 def admin_product_list(request):
     if not request.user.is_authenticated or not admin_check(request.user):
         return redirect('shop:login')
 
-    products = Product.objects.all()
-    return render(request, 'admin_product_list.html', {'products': products})
+    grid = ProductGrid(request)
+    products = grid.page()
+    return render(request, 'admin_product_list.html', {'products': products, 'grid': grid})
 
 def log_activity(user, action, category="ทั่วไป"):
     try:
@@ -107,8 +148,9 @@ def admin_category_list(request):
     if not admin_check(request.user):
         return redirect('shop:login')
 
-    categories = Category.objects.all()
-    return render(request, 'admin_category_list.html', {'categories': categories})
+    grid = CategoryGrid(request)
+    categories = grid.page()
+    return render(request, 'admin_category_list.html', {'categories': categories, 'grid': grid})
 
 def admin_category_add(request):
     if not admin_check(request.user):
@@ -171,25 +213,75 @@ def admin_order_list(request):
     if not request.user.is_authenticated or not admin_check(request.user):
         return redirect('shop:login')
 
-    orders = Order.objects.select_related('user').prefetch_related('items__product').order_by('-created_at')
-    return render(request, 'admin_order_list.html', {'orders': orders})
+    # users are on default, the orders on their shards: joined in Python
+    grid = OrderGrid(request, Order.objects.prefetch_related('user').annotate(item_count=Count('items')))
+    orders = grid.page()
+    transitions = [(value, label) for value, label in Order.STATUS_CHOICES if value in ALLOWED_TRANSITIONS]
+    return render(request, 'admin_order_list.html', {
+        'orders': orders,
+        'grid': grid,
+        'transitions': transitions,
+        # new orders from the live feed belong at the top of an unfiltered first page only
+        'live_insert': grid.at_head and not grid.active_filters,
+    })
+
+@require_POST
+def admin_order_bulk_status(request):
+    if not request.user.is_authenticated or not admin_check(request.user):
+        return redirect('shop:login')
+
+    query = request.POST.get('query', '')
+    back = f"{reverse('shop:admin_order_list')}?{query}"
+    target = request.POST.get('status')
+    if target not in ALLOWED_TRANSITIONS:
+        messages.error(request, "กรุณาเลือกสถานะที่ต้องการเปลี่ยน")
+        return redirect(back)
+
+    if request.POST.get('scope') == 'filtered':
+        # every order matching the list's current filters, not just this page
+        orders = OrderGrid(request, params=QueryDict(query)).get_queryset()
+    else:
+        ids = [int(pk) for pk in request.POST.getlist('orders') if pk.isdigit()]
+        if not ids:
+            messages.warning(request, "ยังไม่ได้เลือกคำสั่งซื้อ")
+            return redirect(back)
+        orders = Order.objects.filter(id__in=ids)
+
+    summary = bulk_transition(orders, target, request.user)
+    if summary['updated']:
+        # records newly sold orders and takes cancelled ones back out of the rollups
+        enqueue(update_sales_rollups)
+    label = dict(Order.STATUS_CHOICES)[target]
+    messages.success(
+        request,
+        f"เปลี่ยนสถานะเป็น '{label}' แล้ว {summary['updated']} รายการ"
+        f" (ข้าม {summary['skipped']} รายการที่เปลี่ยนเป็นสถานะนี้ไม่ได้)"
+    )
+    return redirect(back)
 
 def admin_order_detail(request, order_id):
     if not request.user.is_authenticated or not admin_check(request.user):
         return redirect('shop:login')
 
     try:
-        order = Order.objects.prefetch_related('items__product', 'payments').get(id=order_id)
+        order = find_order(order_id, Order.objects.prefetch_related('items__product', 'payments'))
     except Order.DoesNotExist:
         messages.error(request, "ไม่พบคำสั่งซื้อนี้")
         return redirect('shop:admin_order_list')
 
     if request.method == 'POST':
+        old_status = order.status
         form = OrderStatusForm(request.POST, instance=order)
         if form.is_valid():
             new_status = form.cleaned_data.get('status')
+            try:
+                form.save()
+            except ShardMoving:
+                messages.error(request, SHARD_MOVING)
+                return redirect('shop:admin_order_detail', order_id=order.id)
             log_activity(request.user, f"อัปเดตสถานะคำสั่งซื้อ #{order.id} เป็น '{new_status}'", "จัดการคำสั่งซื้อ")
-            form.save()
+            if new_status in SOLD_STATUSES or old_status in SOLD_STATUSES:
+                enqueue(update_sales_rollups)
             messages.success(request, f"อัพเดตสถานะ #{order.id} เรียบร้อยแล้ว")
             return redirect('shop:admin_order_detail', order_id=order.id)
     else:
@@ -202,13 +294,21 @@ def admin_order_delete(request, order_id):
         return redirect('shop:login')
 
     try:
-        order = Order.objects.get(id=order_id)
+        order = find_order(order_id)
     except Order.DoesNotExist:
         messages.error(request, "ไม่พบคำสั่งซื้อนี้")
         return redirect('shop:admin_order_list')
 
     if request.method == 'POST':
-        order.delete()
+        try:
+            with transaction.atomic():
+                if order.sales_recorded:
+                    # its items go with it, so the rollups can only give it back now
+                    record_orders([order.id], order._state.db, sign=-1)
+                order.delete()
+        except ShardMoving:
+            messages.error(request, SHARD_MOVING)
+            return redirect('shop:admin_order_list')
         messages.success(request, f"ลบคำสั่งซื้อ #{order_id} เรียบร้อยแล้ว")
         return redirect('shop:admin_order_list')
 
@@ -222,21 +322,83 @@ def admin_order_cancel(request, order_id):
 
     if request.method == 'POST':
         try:
-            order = Order.objects.get(id=order_id)
+            order = find_order(order_id)
+            old_status = order.status
             order.status = 'cancelled'
             order.save()
             log_activity(request.user, f"ยกเลิกคำสั่งซื้อ #{order.id}", "จัดการคำสั่งซื้อ")
+            if old_status in SOLD_STATUSES:
+                enqueue(update_sales_rollups)
             messages.info(request, f"ยกเลิกคำสั่งซื้อ #{order.id}")
         except Order.DoesNotExist:
             messages.error(request, "ไม่พบคำสั่งซื้อนี้")
+        except ShardMoving:
+            messages.error(request, SHARD_MOVING)
     return redirect('shop:admin_order_list')
 
+def _parse_day(raw, default):
+    try:
+        return parse_date(raw or '') or default
+    except ValueError:
+        # well formed but impossible, like 2024-02-30
+        return default
+
+def admin_sales_report(request):
+    if not request.user.is_authenticated or not admin_check(request.user):
+        return redirect('shop:login')
+
+    today = timezone.localdate()
+    start = _parse_day(request.GET.get('start'), today - timedelta(days=30))
+    end = _parse_day(request.GET.get('end'), today)
+    period = request.GET.get('period') if request.GET.get('period') in PERIODS else 'day'
+    group = 'category' if request.GET.get('group') == 'category' else 'product'
+
+    rows = sales_report(start, end, period, group)
+    return render(request, 'admin_sales_report.html', {
+        'rows': rows,
+        'start': start,
+        'end': end,
+        'period': period,
+        'group': group,
+        'total_revenue': sum(row['revenue'] for row in rows),
+        'total_units': sum(row['units'] for row in rows),
+    })
+
+def admin_activity_log(request):
+    if not request.user.is_authenticated or not admin_check(request.user):
+        return redirect('shop:login')
+
+    categories = cache.get_or_set(
+        'shop:activity_log_categories',
+        lambda: list(ActivityLog.objects.order_by('category').values_list('category', flat=True).distinct()),
+        600,
+    )
+    grid = ActivityLogGrid(request, ActivityLog.objects.select_related('user'), categories=categories)
+    logs = grid.page()
+    return render(request, 'admin_activity_log.html', {'logs': logs, 'grid': grid})
+
+def admin_profile_list(request):
+    if not request.user.is_authenticated or not admin_check(request.user):
+        return redirect('shop:login')
+
+    return render(request, 'admin_profile_list.html', {'profiles': list_profiles()})
+
+def admin_profile_download(request, name):
+    if not request.user.is_authenticated or not admin_check(request.user):
+        return redirect('shop:login')
+
+    path = profile_path(name)
+    if path is None:
+        raise Http404("ไม่พบโปรไฟล์นี้")
+    return FileResponse(open(path, 'rb'), as_attachment=True, filename=path.name, content_type='text/plain')
+
 def admin_user_list(request):
     if not request.user.is_authenticated or not admin_check(request.user):
         return redirect('shop:login')
 
-    users = User.objects.all().order_by('-date_joined')
-    return render(request, 'admin_user_list.html', {'users': users})
+    grid = UserGrid(request)
+    users = grid.page()
+    return render(request, 'admin_user_list.html', {'users': users, 'grid': grid})
 
 def admin_user_edit(request, user_id):
     if not request.user.is_authenticated or not admin_check(request.user):
@@ -263,8 +425,19 @@ def admin_user_edit(request, user_id):
 
 
 # authen part
+def _throttled(request, template, form, wait):
+    messages.error(request, f"ทำรายการบ่อยเกินไป โปรดลองใหม่ในอีก {wait} วินาที")
+    response = render(request, template, {'form': form}, status=429)
+    response['Retry-After'] = str(wait)
+    return response
+
+
 def register_view(request):
     if request.method == 'POST':
+        # before the form: validation queries the username and hashes the password
+        wait = check_register(request)
+        if wait:
+            return _throttled(request, 'register.html', RegisterForm(), wait)
         form = RegisterForm(request.POST)
         if form.is_valid():
             user = form.save(commit=False)
@@ -279,9 +452,15 @@ def register_view(request):
 
 def login_view(request):
     if request.method == 'POST':
+        username = request.POST.get('username', '')
+        # before the form: authenticating always runs the full password hash
+        wait = check_login(request, username)
+        if wait:
+            return _throttled(request, 'login.html', AuthenticationForm(initial={'username': username}), wait)
         form = AuthenticationForm(request, data=request.POST)
         if form.is_valid():
             user = form.get_user()
+            login_succeeded(username)
             login(request, user)
             if admin_check(user):
                 return redirect('shop:admin_dashboard')
@@ -316,10 +495,7 @@ def profile_edit(request):
         return redirect('shop:login')
 
     user = request.user
-    try:
-        user_address = Address.objects.get(user=user)
-    except Address.DoesNotExist:
-        user_address = None
+    user_address = get_cached_address(user)
 
     if request.method == 'POST':
         form = ProfileForm(request.POST, instance=user)
@@ -332,7 +508,10 @@ def profile_edit(request):
                 defaults={
                     'receiver_name': f"{form.cleaned_data['first_name']} {form.cleaned_data['last_name']}".strip(),
                     'phone': form.cleaned_data['phone'],
-                    'address_line': form.cleaned_data['address_line']
+                    'address_line': form.cleaned_data['address_line'],
+                    'city': form.cleaned_data['city'],
+                    'province': form.cleaned_data['province'],
+                    'postal_code': form.cleaned_data['postal_code'],
                 }
             )
             messages.success(request, "อัปเดตโปรไฟล์เรียบร้อยแล้ว!")
@@ -340,7 +519,8 @@ def profile_edit(request):
     else:
         initial_data = {}
         if user_address:
-            initial_data['address_line'] = user_address.address_line
+            for field in ('address_line', 'city', 'province', 'postal_code'):
+                initial_data[field] = getattr(user_address, field)
         form = ProfileForm(instance=user, initial=initial_data)
 
     template_name = 'admin_profile_edit.html' if admin_check(user) else 'profile_edit.html'
@@ -348,6 +528,7 @@ def profile_edit(request):
 
 
 # Product part
+@snapshot(LIST)
 def product_list(request, category_id=None):
     products = Product.objects.all()
     categories = Category.objects.all()
@@ -383,6 +564,16 @@ def product_list(request, category_id=None):
     }
     return render(request, 'product_list.html', context)
 
+def product_autocomplete(request):
+    query = request.GET.get('q', '')[:100]
+    results = autocomplete.search(query) if query.strip() else []
+    return JsonResponse({'results': results})
+
+def address_autocomplete(request):
+    query = request.GET.get('q', '')[:100]
+    return JsonResponse({'results': postal.search(query) if query.strip() else []})
+
+@snapshot(PRODUCT)
 def product_detail(request, pk):
     try:
         product = Product.objects.get(id=pk)
@@ -398,6 +589,11 @@ def _get_cart(request):
     return cart
 
 
+def _find_cart(request):
+    # for pages that only read the cart: looking must not create a row
+    return Cart.objects.filter(user=request.user).first()
+
+
 def add_to_cart(request):
     if not request.user.is_authenticated:
         messages.warning(request, "กรุณาเข้าสู่ระบบก่อนเพิ่มสินค้าลงตะกร้า")
@@ -413,14 +609,11 @@ def add_to_cart(request):
         return redirect("shop:product_list")
 
     cart = _get_cart(request)
-
-    item, created = CartItem.objects.get_or_create(
-        cart=cart, product=product, defaults={"quantity": quantity}
-    )
-
-    if not created:
-        item.quantity += quantity
-        item.save()
+    try:
+        apply_changes(cart, [{"product_id": product.id, "delta": quantity}])
+    except CartError as error:
+        messages.error(request, str(error))
+        return redirect("shop:product_list")
 
     messages.success(request, f"เพิ่ม {product.name} ลงในตะกร้าแล้ว!")
     return redirect("shop:product_list")
@@ -430,8 +623,8 @@ def view_cart(request):
         messages.warning(request, "กรุณาเข้าสู่ระบบก่อนดูตะกร้าสินค้า")
         return redirect("shop:login")
 
-    cart = _get_cart(request)
-    items = cart.items.select_related("product")
+    cart = _find_cart(request)
+    items = cart.items.select_related("product") if cart else CartItem.objects.none()
 
     for item in items:
         item.subtotal = item.product.price * item.quantity
@@ -446,8 +639,9 @@ def remove_from_cart(request):
 
     if request.method == "POST":
         product_id = request.POST.get("product_id")
-        cart = _get_cart(request)
-        CartItem.objects.filter(cart=cart, product_id=product_id).delete()
+        cart = _find_cart(request)
+        if cart and CartItem.objects.filter(cart=cart, product_id=product_id).delete()[0]:
+            touch(cart)
         messages.info(request, "นำสินค้าออกจากตะกร้าแล้ว")
 
     return redirect("shop:cart")
@@ -462,26 +656,35 @@ def update_cart(request):
     product_id = request.POST.get("product_id")
     action = request.POST.get("action")
 
-    cart = _get_cart(request)
+    cart = _find_cart(request)
 
-    try:
-        item = CartItem.objects.get(cart=cart, product_id=product_id)
-    except CartItem.DoesNotExist:
+    if not cart or not cart.items.filter(product_id=product_id).exists():
         messages.error(request, "ไม่พบสินค้าในตะกร้า")
         return redirect("shop:cart")
 
-    if action == "increase":
-        item.quantity += 1
-    elif action == "decrease":
-        item.quantity -= 1
-        if item.quantity <= 0:
-            item.delete()
+    delta = {"increase": 1, "decrease": -1}.get(action)
+    if delta:
+        apply_changes(cart, [{"product_id": product_id, "delta": delta}])
+        if not cart.items.filter(product_id=product_id).exists():
             messages.info(request, "นำสินค้าออกจากตะกร้าแล้ว")
-            return redirect("shop:cart")
-
-    item.save()
     return redirect("shop:cart")
 
+@require_POST
+def update_cart_batch(request):
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'กรุณาเข้าสู่ระบบก่อน'}, status=401)
+
+    try:
+        changes = json.loads(request.body).get('changes')
+    except (ValueError, AttributeError):
+        return JsonResponse({'error': 'ข้อมูลไม่ถูกต้อง'}, status=400)
+
+    cart = _get_cart(request)
+    try:
+        apply_changes(cart, changes)
+    except CartError as error:
+        return JsonResponse({'error': str(error)}, status=400)
+    return JsonResponse(cart_state(cart))
 
 # checkout Part
 
@@ -491,9 +694,9 @@ def checkout(request):
         messages.warning(request, "กรุณาเข้าสู่ระบบก่อนสั่งซื้อสินค้า")
         return redirect("shop:login")
 
-    cart = _get_cart(request)
+    cart = _find_cart(request)
 
-    if not cart.items.exists():
+    if not cart or not cart.items.exists():
         messages.warning(request, "ตะกร้าสินค้าของคุณว่างเปล่า")
         return redirect("shop:product_list")
 
@@ -503,79 +706,78 @@ def checkout(request):
         'phone': getattr(user, 'phone', ''),
     }
 
-    try:
-        address = Address.objects.get(user=user)
-        initial_data['address_line'] = address.address_line
-    except Address.DoesNotExist:
-        pass
+    address = get_cached_address(user)
+    if address:
+        for field in ('address_line', 'city', 'province', 'postal_code'):
+            initial_data[field] = getattr(address, field)
 
     if request.method == 'POST':
         form = GuestCheckoutForm(request.POST)
         if form.is_valid():
-            request.session['checkout_info'] = form.cleaned_data
+            request.session['checkout_info'] = pack_checkout_info(form.cleaned_data)
+            # the idempotency key of the confirmation that follows
+            request.session['checkout_token'] = uuid.uuid4().hex
             return redirect('shop:confirm_order')
     else:
         form = GuestCheckoutForm(initial=initial_data)
 
     return render(request, 'checkout.html', {'form': form})
 
-@transaction.atomic
 def confirm_order(request):
     if not request.user.is_authenticated:
         return redirect("shop:login")
 
-    checkout_info = request.session.get('checkout_info')
-    cart = _get_cart(request)
+    checkout_info = unpack_checkout_info(request.session.get('checkout_info'))
+    cart = _find_cart(request)
 
-    if not checkout_info or not cart.items.exists():
+    if not checkout_info or not cart or not cart.items.exists():
         messages.error(request, "ข้อมูลการสั่งซื้อไม่สมบูรณ์ กรุณาเริ่มใหม่อีกครั้ง")
         return redirect('shop:checkout')
 
-    items = list(cart.items.select_related('product'))
-    total_price = sum(item.quantity * item.product.price for item in items)
-
     if request.method == 'POST':
         action = request.POST.get('action')
+        # stock and the cart commit on default first, then the order is written on its
+        # shard; a checkout whose order failed is placed later by `manage.py place_checkouts`
+        token = request.session.setdefault('checkout_token', uuid.uuid4().hex)
         try:
-            order = Order.objects.create(
-                user=request.user,
-                total_price=total_price,
-                status='pending'
-            )
-
-            for item in items:
-                OrderItem.objects.create(
-                    order=order,
-                    product=item.product,
-                    quantity=item.quantity,
-                    unit_price=item.product.price
-                )
-                product = item.product
-                product.stock = max(0, product.stock - item.quantity)
-                product.save()
-
-            Payment.objects.create(
-                order=order,
-                amount=total_price,
-                method=checkout_info['payment_method'],
-                status='pending'
-            )
+            # turn the customer away before taking stock while their orders are being moved
+            shard_for(request.user.pk, write=True)
+            low_stock_threshold = getattr(settings, 'LOW_STOCK_THRESHOLD', 5)
+            checkout, crossed_threshold = open_checkout(token, cart, checkout_info['payment_method'], low_stock_threshold)
+        except ShardMoving:
+            messages.error(request, SHARD_MOVING)
+            return redirect('shop:confirm_order')
+        except Exception as e:
+            messages.error(request, f"เกิดข้อผิดพลาด: {e}")
+            return redirect('shop:checkout')
 
-            cart.items.all().delete()
-            if 'checkout_info' in request.session:
-                del request.session['checkout_info']
+        if crossed_threshold is None:
+            messages.error(request, "ข้อมูลการสั่งซื้อไม่สมบูรณ์ กรุณาเริ่มใหม่อีกครั้ง")
+            return redirect('shop:checkout')
+        for key in ('checkout_info', 'checkout_token'):
+            request.session.pop(key, None)
+        if checkout is None:
+            messages.info(request, "คำสั่งซื้อนี้ได้รับการยืนยันไปแล้ว")
+            return redirect('shop:my_orders')
+        if crossed_threshold:
+            enqueue(alert_low_stock, crossed_threshold, request.user.id)
 
-            messages.success(request, "ยืนยันคำสั่งซื้อสำเร็จแล้ว!")
+        try:
+            place_order(checkout)
+        except Exception:
+            logger.exception("order of checkout %s not placed yet", checkout.token)
+            messages.warning(request, "ได้รับคำสั่งซื้อแล้ว ระบบกำลังบันทึกคำสั่งซื้อ กรุณาตรวจสอบอีกครั้งในอีกสักครู่")
+            return redirect('shop:my_orders')
 
-            if action == 'pay_later':
-                return redirect('shop:product_list')
-            else:
-                return redirect('shop:order_success')
+        messages.success(request, "ยืนยันคำสั่งซื้อสำเร็จแล้ว!")
 
-        except Exception as e:
-            messages.error(request, f"เกิดข้อผิดพลาด: {e}")
-            return redirect('shop:checkout')
+        if action == 'pay_later':
+            return redirect('shop:product_list')
+        else:
+            return redirect('shop:order_success')
 
+    items = list(cart.items.select_related('product'))
+    total_price = sum(item.quantity * item.product.price for item in items)
     return render(request, 'confirm_order.html', {
         'checkout_info': checkout_info,
         'cart_items': items,
@@ -588,7 +790,7 @@ def retry_payment(request, order_id):
         return redirect("shop:login")
 
     try:
-        order = Order.objects.get(id=order_id, user=request.user)
+        order = orders_of(request.user).get(id=order_id)
     except Order.DoesNotExist:
         messages.error(request, "ไม่พบคำสั่งซื้อนี้")
         return redirect('shop:my_orders')
@@ -597,14 +799,25 @@ def retry_payment(request, order_id):
         messages.warning(request, "คำสั่งซื้อนี้ได้ชำระเงินแล้ว หรือถูกยกเลิกไปแล้ว")
         return redirect('shop:my_order_detail', order_id=order.id)
 
-    items = order.items.select_related('product')
+    # products are on default, the items on the order's shard
+    items = order.items.prefetch_related('product')
     
     if request.method == 'POST':
-        order.status = 'paid'
-        order.save()
-        Payment.objects.filter(order=order).update(status='success')
-        
-        messages.success(request, f"ชำระเงินสำหรับคำสั่งซื้อ #{order.id} สำเร็จแล้ว!")
+        provider = get_provider()
+        payment = order.payments.filter(status='pending').first()
+        if payment is None:
+            try:
+                payment = order.payments.create(amount=order.total_price, method='transfer', status='pending')
+            except ShardMoving:
+                messages.error(request, SHARD_MOVING)
+                return redirect('shop:my_order_detail', order_id=order.id)
+        if not payment.provider_ref:
+            payment.provider_ref = provider.create_charge(payment)
+            payment.save(update_fields=['provider_ref'])
+        # the order is marked paid by the payment worker once the provider confirms
+        provider.capture(payment.provider_ref)
+
+        messages.success(request, f"ได้รับการชำระเงินสำหรับคำสั่งซื้อ #{order.id} แล้ว ระบบกำลังยืนยันการชำระเงิน")
         return redirect('shop:order_success')
 
     payment = order.payments.first()
@@ -618,13 +831,33 @@ def retry_payment(request, order_id):
     })
 
 
+@csrf_exempt
+@require_POST
+def payment_callback(request):
+    if not verify_signature(request.body, request.headers.get('X-Signature')):
+        return JsonResponse({'error': 'invalid signature'}, status=403)
+    try:
+        event = json.loads(request.body)
+        provider_ref = str(event['provider_ref'])
+        status = event['status']
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'error': 'invalid payload'}, status=400)
+
+    amount = event.get('amount')
+    error = amount_error(provider_ref, status, amount)
+    if error:
+        return JsonResponse({'error': error}, status=400)
+    if not enqueue_event(provider_ref, status, amount, event):
+        return JsonResponse({'error': 'unknown status'}, status=400)
+    return JsonResponse({'queued': True}, status=202)
+
 # Order Part
 
 def my_orders(request):
     if not request.user.is_authenticated:
         return redirect('shop:login')
 
-    orders = Order.objects.filter(user=request.user).order_by('-created_at')
+    orders = orders_of(request.user).order_by('-created_at')
     return render(request, 'my_orders.html', {'orders': orders})
 
 def my_order_detail(request, order_id):
@@ -632,7 +865,7 @@ def my_order_detail(request, order_id):
         return redirect('shop:login')
 
     try:
-        order = Order.objects.prefetch_related('items__product').get(id=order_id, user=request.user)
+        order = orders_of(request.user).prefetch_related('items__product').get(id=order_id)
     except Order.DoesNotExist:
         messages.error(request, "ไม่พบคำสั่งซื้อนี้")
         return redirect('shop:my_orders')